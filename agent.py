@@ -0,0 +1,133 @@
+"""Node agent: runs VBoxManage on this machine for a remote dashboard
+
+Start one per VirtualBox host, then register it with the dashboard
+(POST /api/hosts {"name": ..., "url": "http://host:8765"}):
+
+    VSM_AGENT_TOKEN=secret python agent.py --listen 0.0.0.0 --port 8765
+
+The dashboard sends the same token (VSM_AGENT_TOKEN) with every request.
+Without a token the agent only listens on the loopback interface. Needs the
+standard library and this repository's modules, not Flask.
+"""
+import argparse
+import ipaddress
+import json
+import os
+import socket
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telemetry
+from hosts import check_token
+from scheduler import host_resources
+from vbox import VBoxDriver, find_vboxmanage, run_vboxmanage
+
+# Longest VBoxManage run the dashboard may ask for (a full clone of a big disk)
+MAX_TIMEOUT = 3600
+
+MAX_BODY = 16 * 1024 * 1024
+
+
+class AgentHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the dashboard's pooled connections are reused
+    protocol_version = 'HTTP/1.1'
+    server_version = 'vsm-agent'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status, body, content_type='application/json'):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        if check_token(self.server.token, self.headers.get('Authorization')):
+            return True
+        self._reply(401, {'error': 'Missing or wrong agent token'})
+        return False
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            raise ValueError('Request body too large')
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not isinstance(body, dict):
+            raise ValueError('Request body must be a JSON object')
+        return body
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == '/health':
+            cpus, ram_mb = self.server.resources
+            self._reply(200, {'name': self.server.name, 'cpus': cpus, 'ram_mb': ram_mb,
+                              'vboxmanage': find_vboxmanage()})
+        elif self.path == '/metrics':
+            self._reply(200, telemetry.render(), 'text/plain; version=0.0.4')
+        else:
+            self._reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path != '/vboxmanage':
+            self._reply(404, {'error': 'Not found'})
+            return
+        try:
+            body = self._read_json()
+            args = body.get('args')
+            if not args or not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+                raise ValueError('"args" must be a non-empty list of strings')
+            timeout = min(float(body.get('timeout', 30)), MAX_TIMEOUT)
+            files = body.get('files') or None
+            if files is not None and (not isinstance(files, dict)
+                                      or not all(isinstance(v, str) for v in files.values())):
+                raise ValueError('"files" must map placeholders to strings')
+        except (ValueError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        self._reply(200, run_vboxmanage(args, timeout, files))
+
+
+def is_loopback(address):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(address)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='VirtualBox node agent')
+    parser.add_argument('--listen', default='127.0.0.1', help='address to bind (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--name', default=socket.gethostname(), help='name reported to the dashboard')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+
+    token = os.environ.get('VSM_AGENT_TOKEN')
+    if not token and not is_loopback(args.listen):
+        print("ERROR: set VSM_AGENT_TOKEN before listening on a non-loopback address")
+        return 1
+
+    server = ThreadingHTTPServer((args.listen, args.port), AgentHandler)
+    server.daemon_threads = True
+    server.token = token
+    server.name = args.name
+    server.verbose = args.verbose
+    # Cores and memory do not change while the agent runs
+    server.resources = host_resources(VBoxDriver())
+    print(f"Agent {args.name} listening on http://{args.listen}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
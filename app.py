@@ -1,164 +1,403 @@
-import sqlite3
-import subprocess
+import hashlib
+import json
 import os
+import threading
+import time
 import traceback
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, session, g
 from datetime import datetime
 
+import db
+import fleet
+import oplog
+import telemetry
+from balloon import BalloonController
+from bulk import BulkRunner
+from events import EventBroadcaster
+from hibernation import IdleHibernator
+from hosts import AgentError, HostRegistry
+from images import ImageCatalog
+from instances import InvalidCursor, change_version, list_instances, select_instances
+from jobs import ACTIVE_STATES, JobManager
+from metrics import MetricsStore, parse_range
+from provisioning import Provisioner
+from reconciler import Reconciler
+from scheduler import PRIORITIES, AdmissionScheduler
+from stats_collector import StatsCollector
+from storage import StorageManager
+from vbox import VBoxDriver
+from warm_pool import WarmPool
+
 app = Flask(__name__)
 app.secret_key = 'super_secret_key_change_in_production'
 
-# Directory for shell scripts
-SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), 'scripts')
-
 def init_db():
-    """Initialize the database with all required tables"""
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    # INSTANCES table - stores VM information
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS instances (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            os_type TEXT NOT NULL,
-            cpu_cores INTEGER DEFAULT 1,
-            ram_size INTEGER DEFAULT 1024,
-            storage_size INTEGER DEFAULT 10000,
-            ip_address TEXT,
-            status TEXT DEFAULT 'stopped',
-            vm_uuid TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # SERVICES table - stores installed services
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS services (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            instance_id INTEGER NOT NULL,
-            service_name TEXT NOT NULL,
-            status TEXT DEFAULT 'installed',
-            installed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (instance_id) REFERENCES instances (id) ON DELETE CASCADE
-        )
-    ''')
-    
-    # VM_USERS table - stores users on VMs
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vm_users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            instance_id INTEGER NOT NULL,
-            username TEXT NOT NULL,
-            has_sudo BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (instance_id) REFERENCES instances (id) ON DELETE CASCADE
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print("Database initialized successfully!")
+    """Create or upgrade the database schema"""
+    version = db.migrate()
+    print(f"Database initialized successfully! (schema version {version})")
 
 def get_db_connection():
-    """Get a database connection"""
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def run_shell_script(script_name, *args):
-    """Execute a shell script and return the result"""
-    script_path = os.path.join(SCRIPTS_DIR, script_name)
-    
-    # Convert to absolute path and normalize for the current OS
-    script_path = os.path.abspath(script_path)
-    
-    if not os.path.exists(script_path):
-        return {
-            'success': False, 
-            'message': f'Script {script_name} not found at {script_path}',
-            'stderr': f'Script not found: {script_path}',
-            'stdout': ''
+    """Get this thread's database connection (reused; do not close it)"""
+    return db.get_connection()
+
+# Background job engine: slow scripts run here instead of in request workers
+job_manager = JobManager(get_db_connection, max_workers=int(os.environ.get('VSM_JOB_WORKERS', 4)))
+
+# All VirtualBox calls go through one driver so VM details are cached once
+vbox_driver = VBoxDriver(cache_ttl=float(os.environ.get('VSM_VBOX_CACHE_TTL', 5)))
+
+# Other VirtualBox machines, each running agent.py; VMs there use its driver
+host_registry = HostRegistry(
+    get_db_connection, vbox_driver,
+    token=os.environ.get('VSM_AGENT_TOKEN'),
+    include_local=os.environ.get('VSM_LOCAL_HOST', '1') != '0',
+    interval=float(os.environ.get('VSM_HOST_CHECK_INTERVAL', 15)),
+    pool_size=int(os.environ.get('VSM_AGENT_POOL_SIZE', 4))
+)
+
+def driver_for(vm):
+    """Driver of the host an instance row lives on"""
+    return host_registry.driver(vm['host_id'])
+
+# Creates, starts and resumes wait here until the host has CPU and RAM for them
+scheduler = AdmissionScheduler(
+    get_db_connection, vbox_driver,
+    max_concurrent=int(os.environ.get('VSM_BOOT_CONCURRENCY', 2)),
+    stagger=float(os.environ.get('VSM_BOOT_STAGGER', 2)),
+    cpu_overcommit=float(os.environ.get('VSM_CPU_OVERCOMMIT', 2)),
+    ram_reserve_mb=int(os.environ.get('VSM_HOST_RAM_RESERVE_MB', 1024)),
+    cpus=int(os.environ.get('VSM_HOST_CPUS', 0)) or None,
+    ram_mb=int(os.environ.get('VSM_HOST_RAM_MB', 0)) or None,
+    hosts=host_registry
+)
+
+# Installer ISOs, scanned in the background so creates never search the disk
+image_catalog = ImageCatalog(
+    get_db_connection,
+    directories=[d for d in os.environ.get('VSM_IMAGE_DIRS', '').split(os.pathsep) if d] or None,
+    interval=float(os.environ.get('VSM_IMAGE_SCAN_INTERVAL', 600))
+)
+
+# Keeps instances.status in line with VirtualBox without per-request calls
+reconciler = Reconciler(
+    get_db_connection, vbox_driver,
+    interval=float(os.environ.get('VSM_RECONCILE_INTERVAL', 10)),
+    drivers=host_registry.drivers
+)
+
+# Guest setup: pending services and users go to each VM in one session
+provisioner = Provisioner(
+    get_db_connection,
+    guest_user=os.environ.get('VSM_GUEST_USER'),
+    guest_password=os.environ.get('VSM_GUEST_PASSWORD'),
+    guest_password_file=os.environ.get('VSM_GUEST_PASSWORD_FILE'),
+    max_parallel=int(os.environ.get('VSM_PROVISION_PARALLEL', 4)),
+    timeout=int(os.environ.get('VSM_PROVISION_TIMEOUT', 1800)),
+    boot_timeout=int(os.environ.get('VSM_GUEST_BOOT_TIMEOUT', 300)),
+    driver=vbox_driver,
+    driver_for=host_registry.driver
+)
+
+# Shared fleet stats sampler behind the monitoring API
+metrics_store = MetricsStore()
+stats_collector = StatsCollector(
+    metrics_store,
+    interval=float(os.environ.get('VSM_STATS_INTERVAL', 3)),
+    ttl=float(os.environ.get('VSM_STATS_TTL', 5)),
+    driver=vbox_driver,
+    drivers=host_registry.drivers,
+    idle_after=float(os.environ.get('VSM_STATS_IDLE_AFTER', 60)),
+    # Open monitor streams and the policies that judge VMs from their raw history need every sample
+    keep_sampling=lambda: stats_events.subscribers > 0 or hibernator.enabled or balloon_controller.enabled
+)
+
+# Push channel for the monitor pages: one sample fans out to every open tab
+stats_events = EventBroadcaster()
+
+def publish_stats(stats, sampled_at):
+    """Collector listener: publish one event per VM sample"""
+    conn = get_db_connection()
+    ids = {row['name']: row['id'] for row in conn.execute('SELECT id, name FROM instances')}
+    for name, vm_stats in stats.items():
+        stats_events.publish(name, dict(vm_stats, name=name, id=ids.get(name)))
+
+stats_collector.add_listener(publish_stats)
+
+# Shrinks the RAM idle guests hold through their memory balloons (VSM_BALLOON=1)
+balloon_controller = BalloonController(
+    get_db_connection, metrics_store, host_registry.driver,
+    enabled=os.environ.get('VSM_BALLOON', '0') == '1',
+    floor_mb=int(os.environ.get('VSM_BALLOON_FLOOR_MB', 512)),
+    ceiling_percent=float(os.environ.get('VSM_BALLOON_CEILING_PERCENT', 75)),
+    headroom_percent=float(os.environ.get('VSM_BALLOON_HEADROOM_PERCENT', 25)),
+    low_percent=float(os.environ.get('VSM_BALLOON_LOW_PERCENT', 10)),
+    step_mb=int(os.environ.get('VSM_BALLOON_STEP_MB', 128)),
+    window=float(os.environ.get('VSM_BALLOON_WINDOW', 300)),
+    interval=float(os.environ.get('VSM_BALLOON_INTERVAL', 30))
+)
+
+# Identical guest pages are shared between VMs (needs Guest Additions)
+PAGE_FUSION = os.environ.get('VSM_PAGE_FUSION', '1') != '0'
+
+# Live job logs: every line and progress marker a job writes, for the log tail
+job_events = EventBroadcaster(backlog=int(os.environ.get('VSM_LOG_BACKLOG', 5000)))
+
+def publish_job_event(job_id, event, data):
+    """Operation log listener: one event per log line, progress marker or job end"""
+    job_events.publish(job_id, data, event=event)
+
+oplog.add_listener(publish_job_event)
+
+@app.before_request
+def start_request_timer():
+    """Time every request for /metrics"""
+    g.request_started = time.perf_counter()
+    telemetry.HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_time(response):
+    """Record the request's latency by route template, method and status"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        telemetry.HTTP_IN_FLIGHT.dec()
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        seconds = time.perf_counter() - started
+        telemetry.HTTP_SECONDS.observe(seconds, route=route, method=request.method, status=response.status_code)
+        telemetry.log_if_slow('request', f'{request.method} {route}', seconds)
+    return response
+
+@app.teardown_request
+def release_db_connection(exc):
+    """Never leave a half-finished transaction on a reused connection"""
+    db.release()
+    # A request that died before after_request still has to leave the gauge
+    if g.pop('request_started', None) is not None:
+        telemetry.HTTP_IN_FLIGHT.dec()
+
+@app.before_request
+def start_background_services():
+    """Start the samplers with the first request (and only in the serving process)"""
+    stats_collector.ensure_started()
+    warm_pool.ensure_started()
+    reconciler.ensure_started()
+    scheduler.ensure_started()
+    image_catalog.ensure_started()
+    host_registry.ensure_started()
+    hibernator.ensure_started()
+    balloon_controller.ensure_started()
+    storage_manager.ensure_started()
+
+def wants_json():
+    """True when the client asked for a JSON response instead of a redirect"""
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return request.is_json or best == 'application/json'
+
+def job_queued_response(job_id, message, redirect_to):
+    """Answer a request that queued a background job"""
+    queue = scheduler.position(job_id)
+    if wants_json():
+        body = {
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': url_for('job_status', job_id=job_id),
+            'log_url': url_for('job_log_stream', job_id=job_id)
         }
+        if queue:
+            body['queue'] = queue
+        return jsonify(body), 202
+    if queue:
+        message += f', waiting for host capacity (position {queue["position"] + 1}, about {queue["eta_seconds"]:.0f}s)'
+    flash(f'{message} (job #{job_id})', 'success')
+    return redirect(redirect_to)
+
+def submit_admitted(kind, func, *args, instance_id, cpu_cores, ram_size, priority='normal', params=None,
+                    host_id=None, owner=None):
+    """Queue a create, start or resume job that runs once the scheduler admits it
+
+    Raises ValueError (CapacityError) before anything is queued if the
+    priority is unknown or the VM could never fit on the host. owner
+    defaults to the requesting client's address.
+    """
+    scheduler.validate(cpu_cores, ram_size, priority, host_id)
+    job_id = job_manager.enqueue(kind, instance_id=instance_id, params=dict(params or {}, priority=priority))
+    scheduler.submit(
+        kind, instance_id, cpu_cores, ram_size,
+        # Released in run_admitted, or by on_done if the worker fails before it runs
+        lambda ticket: job_manager.dispatch(job_id, kind, scheduler.run_admitted, (ticket, func) + args,
+                                            on_done=lambda: scheduler.release(ticket)),
+        priority=priority, owner=owner or request.remote_addr, key=job_id, host_id=host_id,
+        on_error=lambda ticket, e: job_manager.fail(job_id, f'Could not start the job: {e}')
+    )
+    return job_id
+
+def busy_response(vm, job, redirect_to):
+    """Answer a request for a VM that already has a job in flight"""
+    message = f'Server "{vm["name"]}" is busy with job #{job["id"]} ({job["kind"]})'
+    if wants_json():
+        return jsonify({'error': message, 'job_id': job['id']}), 409
+    flash(message, 'error')
+    return redirect(redirect_to)
+
+# Pre-provisioned VMs per shape, refilled in the background
+warm_pool = WarmPool(
+    get_db_connection, vbox_driver,
+    interval=float(os.environ.get('VSM_POOL_INTERVAL', 30)),
+    idle_ttl=float(os.environ.get('VSM_POOL_IDLE_TTL', 7 * 86400)),
+    max_parallel=int(os.environ.get('VSM_POOL_PARALLEL', 2))
+)
+
+def split_arg(name):
+    """Read a comma separated (or repeated) query argument as a list"""
+    values = []
+    for value in request.args.getlist(name):
+        values.extend(v.strip() for v in value.split(',') if v.strip())
+    return values or None
+
+def listing_etag(prefix, version):
+    """ETag for a listing: the change counter plus a digest of the query"""
+    digest = hashlib.sha1(request.query_string).hexdigest()[:12]
+    return f'{prefix}-{version}-{digest}'
+
+def not_modified(etag):
+    """Return a 304 response when the client already has this version"""
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+@app.route('/')
+def index():
+    """Display all virtual servers"""
+    conn = get_db_connection()
     
-    # Find bash executable (works on Windows with Git Bash)
-    bash_cmd = 'bash'
-    possible_bash_paths = [
-        'bash',  # If in PATH
-        r'C:\Program Files\Git\bin\bash.exe',
-        r'C:\Program Files (x86)\Git\bin\bash.exe',
-    ]
+    # Flash messages live in the session, so only cache pages without them
+    cacheable = not session.get('_flashes')
+    etag = listing_etag('index', change_version(conn, 'instances', 'jobs'))
+    if cacheable:
+        cached = not_modified(etag)
+        if cached:
+            return cached
     
-    bash_executable = None
-    for bash_path in possible_bash_paths:
-        try:
-            result = subprocess.run([bash_path, '--version'], 
-                                  capture_output=True, 
-                                  timeout=5)
-            if result.returncode == 0:
-                bash_executable = bash_path
-                break
-        except:
-            continue
-    
-    if not bash_executable:
-        return {
-            'success': False,
-            'message': 'Bash not found. Please install Git Bash.',
-            'stderr': 'Bash executable not found',
-            'stdout': ''
-        }
+    try:
+        vms, next_cursor = list_instances(
+            conn,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 50, type=int),
+            statuses=split_arg('status'),
+            os_types=split_arg('os')
+        )
+    except InvalidCursor:
+        return redirect(url_for('index'))
+    jobs = job_manager.list(active_only=True, limit=20)
+    
+    response = app.make_response(render_template(
+        'index.html', vms=vms, jobs=jobs, next_cursor=next_cursor,
+        first_page=not request.args.get('cursor')
+    ))
+    if cacheable:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/vms')
+def api_list_vms():
+    """List VMs page by page: ?status=&os=&fields=&limit=&cursor="""
+    conn = get_db_connection()
+    
+    etag = listing_etag('vms', change_version(conn, 'instances'))
+    cached = not_modified(etag)
+    if cached:
+        return cached
     
     try:
-        # Make script executable (Unix-like systems)
-        try:
-            os.chmod(script_path, 0o755)
-        except:
-            pass  # Windows doesn't need this
-        
-        # Run the script
-        print(f"Executing: {bash_executable} \"{script_path}\" {' '.join(str(arg) for arg in args)}")
-        
-        result = subprocess.run(
-            [bash_executable, script_path] + list(args),
-            capture_output=True,
-            text=True,
-            timeout=120,
-            cwd=SCRIPTS_DIR  # Set working directory to scripts folder
+        vms, next_cursor = list_instances(
+            conn,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 50, type=int),
+            statuses=split_arg('status'),
+            os_types=split_arg('os'),
+            fields=split_arg('fields')
         )
-        
-        print(f"Return code: {result.returncode}")
-        print(f"STDOUT: {result.stdout}")
-        print(f"STDERR: {result.stderr}")
-        
-        return {
-            'success': result.returncode == 0,
-            'stdout': result.stdout.strip(),
-            'stderr': result.stderr.strip(),
-            'returncode': result.returncode
-        }
-    except subprocess.TimeoutExpired:
-        return {
-            'success': False, 
-            'message': 'Script execution timed out',
-            'stderr': 'Timeout after 120 seconds',
-            'stdout': ''
-        }
-    except Exception as e:
-        return {
-            'success': False, 
-            'message': str(e),
-            'stderr': str(e),
-            'stdout': ''
-        }
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response = jsonify({'vms': vms, 'next_cursor': next_cursor})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-@app.route('/')
-def index():
-    """Display all virtual servers"""
+def create_vm_job(instance_id, name, os_type, cpu_cores, ram_size, storage_size,
+                  services, username, password, has_sudo, iso=None, use_pool=True, host_id=None):
+    """Background job: create the VM in VirtualBox and complete its database row"""
+    # Renaming a pre-provisioned VM takes seconds; building one takes minutes
+    from_pool = False
+    # The warm pool lives on the local host
+    use_pool = use_pool and host_id is None
+    warm_vm = warm_pool.claim(os_type, cpu_cores, ram_size, storage_size) if use_pool else None
+    if warm_vm:
+        print(f"Claiming warm pool VM {warm_vm['vm_name']} for '{name}'")
+        result = warm_pool.complete_claim(warm_vm, name, cpu_cores, ram_size)
+        from_pool = result['success']
+        if not from_pool:
+            print(f"Warning: warm pool claim failed, creating from scratch: {result.get('stderr') or result.get('message')}")
+    
+    if not from_pool:
+        print(f"Creating VM '{name}' in VirtualBox on {host_registry.name_of(host_id)}...")
+        result = host_registry.driver(host_id).create(name, os_type, cpu_cores, ram_size, storage_size, iso,
+                                                      page_fusion=PAGE_FUSION)
+    
     conn = get_db_connection()
-    vms = conn.execute('SELECT * FROM instances ORDER BY created_at DESC').fetchall()
-    conn.close()
-    return render_template('index.html', vms=vms)
+    
+    if not result['success']:
+        error_msg = result.get('stderr') or result.get('message') or 'Unknown error'
+        print(f"ERROR: VM creation failed: {error_msg}")
+        # Release the reserved name so the user can try again
+        conn.execute('DELETE FROM instances WHERE id = ?', (instance_id,))
+        conn.commit()
+        return result
+    
+    vm_uuid = result['uuid']
+    
+    print(f"VM created with UUID: {vm_uuid}")
+    
+    conn.execute(
+        'UPDATE instances SET vm_uuid = ?, status = ? WHERE id = ?',
+        (vm_uuid, 'stopped', instance_id)
+    )
+    if from_pool:
+        # Cloned from the pool's golden VM, not installed from the image
+        conn.execute('UPDATE instances SET image_id = NULL WHERE id = ?', (instance_id,))
+    
+    # Queue selected services and the user; one script on the guest applies them all
+    for service in services:
+        provisioner.queue_service(conn, instance_id, service)
+        print(f"Queued service: {service}")
+    
+    if username and password:
+        provisioner.queue_user(conn, instance_id, username, password, has_sudo)
+        print(f"Queued user creation: {username} (sudo: {has_sudo})")
+    
+    conn.commit()
+    
+    print(f"SUCCESS: VM '{name}' created successfully!\n")
+    created = {'success': True, 'instance_id': instance_id, 'vm_uuid': vm_uuid,
+               'warm_pool': from_pool, 'stdout': result['stdout']}
+    if not services and not (username and password):
+        return created
+    
+    # Guest commands need a running VM. Provisioning is a job of its own, which
+    # waits for the guest to boot; this job's capacity covers the start
+    started = perform_vm_action('start', name, host_id, instance_id)
+    if not started['success']:
+        error = started.get('stderr') or started.get('message') or 'Unknown error'
+        return dict(created, success=False,
+                    message=f'VM created, but it could not be started to provision it: {error}')
+    record_vm_actions('start', [instance_id])
+    created['provision_job_id'] = submit_provision(
+        [instance_id], instance_id=instance_id, params={'name': name, 'reason': 'create'}
+    )
+    return created
 
 @app.route('/create', methods=['GET', 'POST'])
 def create():
@@ -195,214 +434,636 @@ def create():
                 flash('Server name is required!', 'error')
                 return redirect(url_for('create'))
             
+            priority = request.form.get('priority', 'normal')
+            try:
+                # New VMs go to the least-loaded host they fit on
+                host_id = scheduler.place(cpu_cores, ram_size)
+                scheduler.validate(cpu_cores, ram_size, priority, host_id)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('create'))
+            
+            # An explicitly chosen image must be installed, so it skips the warm pool
+            image_id = request.form.get('image_id', '').strip()
+            if image_id:
+                image = image_catalog.get(int(image_id)) if image_id.isdigit() else None
+                if not image or not image['available']:
+                    flash(f'Image {image_id} is not in the image catalog', 'error')
+                    return redirect(url_for('create'))
+            else:
+                image = image_catalog.default_for(os_type)
+            
             conn = get_db_connection()
             
             # Check if name already exists
             existing = conn.execute('SELECT id FROM instances WHERE name = ?', (name,)).fetchone()
             if existing:
                 flash(f'Server with name "{name}" already exists!', 'error')
-                conn.close()
-                return redirect(url_for('create'))
-            
-            # Call shell script to create VM in VirtualBox
-            print("Calling create_vm.sh script...")
-            result = run_shell_script('create_vm.sh', name, os_type, cpu_cores, ram_size, storage_size)
-            
-            if not result['success']:
-                error_msg = result.get('stderr') or result.get('message') or 'Unknown error'
-                print(f"ERROR: VM creation failed: {error_msg}")
-                flash(f'Error creating VM: {error_msg}', 'error')
-                conn.close()
                 return redirect(url_for('create'))
             
-            # Extract UUID from script output
-            stdout_lines = result['stdout'].split('\n')
-            vm_uuid = stdout_lines[-1].strip() if stdout_lines else None
-            
-            print(f"VM created with UUID: {vm_uuid}")
-            
-            # Insert into database
+            # Reserve the name now; the background job fills in the rest
             cursor = conn.execute(
-                '''INSERT INTO instances (name, os_type, cpu_cores, ram_size, storage_size, vm_uuid) 
-                   VALUES (?, ?, ?, ?, ?, ?)''',
-                (name, os_type, cpu_cores, ram_size, storage_size, vm_uuid)
+                '''INSERT INTO instances (name, os_type, cpu_cores, ram_size, storage_size, status, image_id, host_id) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                (name, os_type, cpu_cores, ram_size, storage_size, 'creating', image['id'] if image else None,
+                 host_id)
             )
             instance_id = cursor.lastrowid
-            print(f"Inserted into database with ID: {instance_id}")
-            
-            # Insert selected services
-            for service in services:
-                conn.execute(
-                    'INSERT INTO services (instance_id, service_name) VALUES (?, ?)',
-                    (instance_id, service)
-                )
-                print(f"Queued service: {service}")
-            
-            # Create user if provided
-            if username and password:
-                conn.execute(
-                    'INSERT INTO vm_users (instance_id, username, has_sudo) VALUES (?, ?, ?)',
-                    (instance_id, username, has_sudo)
-                )
-                print(f"Queued user creation: {username} (sudo: {has_sudo})")
-                
-                # Call script to create user on VM (this will be simulated)
-                user_result = run_shell_script('manage_users.sh', name, username, password, 'yes' if has_sudo else 'no')
-                if not user_result['success']:
-                    print(f"Warning: User creation script failed: {user_result.get('stderr', 'Unknown')}")
-            
             conn.commit()
-            conn.close()
+            print(f"Reserved database ID {instance_id} for '{name}'")
             
-            flash(f'Server "{name}" created successfully!', 'success')
-            print(f"SUCCESS: VM '{name}' created successfully!\n")
-            return redirect(url_for('index'))
+            job_id = submit_admitted(
+                'create', create_vm_job,
+                instance_id, name, os_type, cpu_cores, ram_size, storage_size,
+                services, username, password, has_sudo, image['path'] if image else None, not image_id, host_id,
+                instance_id=instance_id, cpu_cores=cpu_cores, ram_size=ram_size, priority=priority, host_id=host_id,
+                params={'name': name, 'os_type': os_type, 'cpu': cpu_cores, 'ram': ram_size,
+                        'storage': storage_size, 'services': services, 'username': username,
+                        'image_id': image['id'] if image else None, 'host': host_registry.name_of(host_id)}
+            )
+            return job_queued_response(job_id, f'Server "{name}" is being created', url_for('index'))
             
         except Exception as e:
             print(f"EXCEPTION in create(): {str(e)}")
             print(traceback.format_exc())
             flash(f'Unexpected error: {str(e)}', 'error')
-            if 'conn' in locals():
-                conn.close()
+            db.release()
             return redirect(url_for('create'))
     
-    return render_template('create.html')
+    return render_template('create.html', images=image_catalog.list())
+
+# Driver method and resulting status for each lifecycle action
+VM_ACTIONS = {
+    'start': ('start', 'running'),
+    'stop': ('stop', 'stopped'),
+    'suspend': ('suspend', 'suspended'),
+    'resume': ('resume', 'running'),
+    'delete': ('destroy', None),
+}
+
+# Actions that bring a VM up and so wait for host capacity first
+ADMITTED_ACTIONS = ('start', 'resume')
+
+def perform_vm_action(action, vm_name, host_id=None, instance_id=None):
+    """Run one lifecycle action for one VM through its host's driver"""
+    method, _ = VM_ACTIONS[action]
+    # Measured right before the delete, so the ledger has what the host gets back
+    size_mb = storage_manager.measure(instance_id) if action == 'delete' and instance_id else None
+    result = getattr(host_registry.driver(host_id), method)(vm_name)
+    if not result['success']:
+        print(f"{action.capitalize()} failed for {vm_name}: {result}")
+    elif size_mb is not None:
+        storage_manager.record_freed('destroy', instance_id, vm_name, host_id, size_mb)
+        result['freed_mb'] = size_mb
+    return result
+
+def record_vm_actions(action, ids):
+    """Apply the outcome of successful actions to the database in one transaction"""
+    if not ids:
+        return
+    conn = get_db_connection()
+    if action == 'delete':
+        conn.executemany('DELETE FROM instances WHERE id = ?', [(id,) for id in ids])
+    else:
+        conn.executemany(
+            'UPDATE instances SET status = ? WHERE id = ?',
+            [(VM_ACTIONS[action][1], id) for id in ids]
+        )
+    conn.commit()
+
+def vm_action_job(action, id, vm_name, host_id=None):
+    """Background job: run a lifecycle action and record the new status"""
+    result = perform_vm_action(action, vm_name, host_id, id)
+    if result['success']:
+        record_vm_actions(action, [id])
+    return result
 
 @app.route('/vm/<action>/<int:id>')
 def vm_action(action, id):
-    """Handle VM actions: start, stop, delete"""
+    """Handle VM actions: start, stop, suspend, resume, delete"""
     conn = get_db_connection()
     vm = conn.execute('SELECT * FROM instances WHERE id = ?', (id,)).fetchone()
     
     if not vm:
         flash('Server not found!', 'error')
-        conn.close()
         return redirect(url_for('index'))
     
-    if action == 'start':
-        # Changed to use start_vm.sh instead of manage_vm.sh
-        result = run_shell_script('start_vm.sh', vm['name'])
-        if result['success']:
-            conn.execute('UPDATE instances SET status = ? WHERE id = ?', ('running', id))
-            conn.commit()
-            flash(f'Server "{vm["name"]}" started successfully!', 'success')
-        else:
-            error_msg = result.get('stderr') or result.get('message') or result.get('stdout') or 'Unknown error'
-            print(f"Start failed: {result}")
-            flash(f'Error starting server: {error_msg}', 'error')
+    if action not in VM_ACTIONS:
+        flash('Invalid action!', 'error')
+        return redirect(url_for('index'))
     
-    elif action == 'stop':
-        # Changed to use stop_vm.sh instead of manage_vm.sh
-        result = run_shell_script('stop_vm.sh', vm['name'])
-        if result['success']:
-            conn.execute('UPDATE instances SET status = ? WHERE id = ?', ('stopped', id))
-            conn.commit()
-            flash(f'Server "{vm["name"]}" stopped successfully!', 'success')
-        else:
-            error_msg = result.get('stderr') or result.get('message') or result.get('stdout') or 'Unknown error'
-            print(f"Stop failed: {result}")
-            flash(f'Error stopping server: {error_msg}', 'error')
+    # One operation per VM at a time; a double click must not queue it twice
+    active = job_manager.active_job_for(id)
+    if active:
+        return busy_response(vm, active, url_for('index'))
+    
+    if action == 'delete':
+        children = linked_clones_of(conn, id)
+        if children:
+            message = (f'Server "{vm["name"]}" is the base of linked clones '
+                       f'{", ".join(c["name"] for c in children)}; delete or flatten them first')
+            if wants_json():
+                return jsonify({'error': message, 'linked_clones': [dict(c) for c in children]}), 409
+            flash(message, 'error')
+            return redirect(url_for('index'))
+    
+    if action in ADMITTED_ACTIONS:
+        # Starts and resumes wait for host capacity; the others free it, so they never wait
+        try:
+            job_id = submit_admitted(
+                action, vm_action_job, action, id, vm['name'], vm['host_id'],
+                instance_id=id, cpu_cores=vm['cpu_cores'], ram_size=vm['ram_size'],
+                priority=request.args.get('priority', 'normal'), params={'name': vm['name']},
+                host_id=vm['host_id']
+            )
+        except ValueError as e:
+            if wants_json():
+                return jsonify({'error': str(e)}), 400
+            flash(str(e), 'error')
+            return redirect(url_for('index'))
+    else:
+        job_id = job_manager.submit(
+            action, vm_action_job, action, id, vm['name'], vm['host_id'],
+            instance_id=id, params={'name': vm['name']}
+        )
+    verbs = {'start': 'starting', 'stop': 'stopping', 'suspend': 'being suspended', 'resume': 'resuming',
+             'delete': 'being deleted'}
+    return job_queued_response(job_id, f'Server "{vm["name"]}" is {verbs[action]}', url_for('index'))
+
+def suspend_idle_vm(vm):
+    """Idle hibernation: queue a suspend unless the VM is busy; returns the job id"""
+    if job_manager.active_job_for(vm['id']):
+        return None
+    return job_manager.submit(
+        'suspend', vm_action_job, 'suspend', vm['id'], vm['name'], vm['host_id'],
+        instance_id=vm['id'], params={'name': vm['name'], 'reason': 'idle'}
+    )
+
+# Suspends VMs that have been idle for VSM_IDLE_SUSPEND_MINUTES (0 turns it off)
+hibernator = IdleHibernator(
+    get_db_connection, metrics_store, suspend_idle_vm,
+    idle_seconds=float(os.environ.get('VSM_IDLE_SUSPEND_MINUTES', 0)) * 60,
+    cpu_percent=float(os.environ.get('VSM_IDLE_CPU_PERCENT', 5)),
+    net_bps=float(os.environ.get('VSM_IDLE_NET_BPS', 10240)),
+    interval=float(os.environ.get('VSM_IDLE_CHECK_INTERVAL', 60)),
+    limit=int(os.environ.get('VSM_IDLE_SUSPEND_LIMIT', 4))
+)
+
+def compact_stopped_vm(vm):
+    """Compaction queue: compact one VM as a job and wait for it; None if the VM is busy"""
+    if job_manager.active_job_for(vm['id']):
+        return None
+    job_id = job_manager.submit(
+        'compact', storage_manager.compact_vm, vm['id'],
+        instance_id=vm['id'], params={'name': vm['name'], 'reason': 'queue'}
+    )
+    return job_manager.wait(job_id)
+
+# Measures disk images and compacts stopped VMs that grew, at VSM_COMPACT_RATE_MB MB/s at most
+storage_manager = StorageManager(
+    get_db_connection, host_registry.driver, compact_stopped_vm,
+    interval=float(os.environ.get('VSM_STORAGE_INTERVAL', 60)),
+    measure_batch=int(os.environ.get('VSM_STORAGE_MEASURE_BATCH', 50)),
+    max_age=float(os.environ.get('VSM_STORAGE_MAX_AGE', 3600)),
+    rate_mb=float(os.environ.get('VSM_COMPACT_RATE_MB', 50)),
+    min_growth_mb=int(os.environ.get('VSM_COMPACT_MIN_GROWTH_MB', 1024)),
+    min_interval=float(os.environ.get('VSM_COMPACT_MIN_INTERVAL', 86400)),
+    compact=os.environ.get('VSM_COMPACT', '1') != '0'
+)
+
+# 'linked' clones share the source's disks through a snapshot: seconds instead of minutes
+CLONE_MODES = ('full', 'linked')
+CLONE_MODE = os.environ.get('VSM_CLONE_MODE', 'full')
+CLONE_SNAPSHOT = os.environ.get('VSM_CLONE_SNAPSHOT', 'vsm-base')
+
+def linked_clones_of(conn, id):
+    """Linked clones whose disks still sit on top of this VM's snapshot"""
+    return conn.execute(
+        "SELECT id, name FROM instances WHERE parent_id = ? AND clone_type = 'linked' ORDER BY id",
+        (id,)
+    ).fetchall()
+
+def clone_vm_job(id, source_name, new_name, mode='full', host_id=None):
+    """Background job: clone a VM on its own host and copy its database records"""
+    print(f"Cloning VM: {source_name} -> {new_name} ({mode} clone)")
+    driver = host_registry.driver(host_id)
+    
+    result = driver.clone(source_name, new_name, linked=(mode == 'linked'), snapshot=CLONE_SNAPSHOT)
+    
+    if not result['success'] and mode == 'linked':
+        # A full copy is slower but needs no snapshot support from the source
+        print(f"Linked clone failed, making a full clone instead: {result.get('stderr') or result.get('message')}")
+        mode = 'full'
+        result = driver.clone(source_name, new_name)
+    
+    if not result['success']:
+        return result
+    
+    new_uuid = result['uuid']
+    
+    conn = get_db_connection()
+    source_vm = conn.execute('SELECT * FROM instances WHERE id = ?', (id,)).fetchone()
+    if not source_vm:
+        return {'success': False, 'message': f'Source server {id} was deleted during the clone',
+                'vm_uuid': new_uuid}
+    
+    # Insert cloned VM into database
+    cursor = conn.execute(
+        '''INSERT INTO instances (name, os_type, cpu_cores, ram_size, storage_size, vm_uuid, status,
+                                  parent_id, clone_type, host_id) 
+           VALUES (?, ?, ?, ?, ?, ?, 'stopped', ?, ?, ?)''',
+        (new_name, source_vm['os_type'], source_vm['cpu_cores'], 
+         source_vm['ram_size'], source_vm['storage_size'], new_uuid, id, mode, host_id)
+    )
+    new_id = cursor.lastrowid
+    
+    # Copy services from source VM; only what is on its disk came along
+    services = conn.execute(
+        'SELECT service_name FROM services WHERE instance_id = ? AND status = ?',
+        (id, 'installed')
+    ).fetchall()
     
-    elif action == 'delete':
-        result = run_shell_script('destroy_vm.sh', vm['name'])
+    for service in services:
+        conn.execute(
+            'INSERT INTO services (instance_id, service_name) VALUES (?, ?)',
+            (new_id, service['service_name'])
+        )
+    
+    # Copy users from source VM
+    users = conn.execute(
+        'SELECT username, has_sudo FROM vm_users WHERE instance_id = ? AND status = ?',
+        (id, 'created')
+    ).fetchall()
+    
+    for user in users:
+        conn.execute(
+            'INSERT INTO vm_users (instance_id, username, has_sudo) VALUES (?, ?, ?)',
+            (new_id, user['username'], user['has_sudo'])
+        )
+    
+    conn.commit()
+    
+    return {'success': True, 'instance_id': new_id, 'vm_uuid': new_uuid, 'clone_type': mode,
+            'stdout': result['stdout']}
+
+def perform_bulk_action(action, vm):
+    """Run one VM of a bulk action; starts and resumes first wait for host capacity"""
+    if action not in ADMITTED_ACTIONS:
+        return perform_vm_action(action, vm['name'], vm['host_id'], vm['id'])
+    with scheduler.admission(action, vm['id'], vm['cpu_cores'], vm['ram_size'],
+                             priority=vm['priority'], owner=vm['owner'], host_id=vm['host_id']):
+        result = perform_vm_action(action, vm['name'], vm['host_id'])
+        # Record it before the capacity is released, or the next start would reuse it
         if result['success']:
-            conn.execute('DELETE FROM instances WHERE id = ?', (id,))
-            conn.commit()
-            flash(f'Server "{vm["name"]}" deleted successfully!', 'success')
+            record_vm_actions(action, [vm['id']])
+        return result
+
+# Parallel lifecycle actions for many VMs, with a concurrency limit per action
+bulk_runner = BulkRunner(
+    perform_bulk_action,
+    limits={
+        'start': int(os.environ.get('VSM_BULK_START_LIMIT', 4)),
+        'stop': int(os.environ.get('VSM_BULK_STOP_LIMIT', 8)),
+        'suspend': int(os.environ.get('VSM_BULK_SUSPEND_LIMIT', 4)),
+        'resume': int(os.environ.get('VSM_BULK_RESUME_LIMIT', 4)),
+        'delete': int(os.environ.get('VSM_BULK_DELETE_LIMIT', 2)),
+    }
+)
+
+def bulk_action_job(action, vms):
+    """Background job: run an action on many VMs and report per-VM results"""
+    results = bulk_runner.run(action, vms)
+    if action not in ADMITTED_ACTIONS:
+        record_vm_actions(action, [r['id'] for r in results if r['success']])
+    
+    failed = [r for r in results if not r['success']]
+    summary = {
+        'success': not failed,
+        'action': action,
+        'total': len(results),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'results': results
+    }
+    if failed:
+        summary['message'] = f'{len(failed)} of {len(results)} VMs failed to {action}'
+    return summary
+
+@app.route('/api/vms/bulk', methods=['POST'])
+def bulk_vm_action():
+    """Start, stop, suspend, resume or delete many VMs: {"action", "ids" or "filter", "wait"}"""
+    body = request.get_json(silent=True) or {}
+    action = body.get('action')
+    if action not in VM_ACTIONS:
+        return jsonify({'error': f'action must be one of: {", ".join(VM_ACTIONS)}'}), 400
+    
+    ids = body.get('ids')
+    selection = body.get('filter') or {}
+    if ids is None and not selection:
+        return jsonify({'error': 'Provide "ids" or a "filter" (status, os)'}), 400
+    if ids is not None and not all(isinstance(id, int) for id in ids):
+        return jsonify({'error': '"ids" must be a list of integers'}), 400
+    priority = body.get('priority', 'normal')
+    if priority not in PRIORITIES:
+        return jsonify({'error': f'priority must be one of: {", ".join(PRIORITIES)}'}), 400
+    
+    def as_list(value):
+        return [value] if isinstance(value, str) else value
+    
+    conn = get_db_connection()
+    vms = select_instances(
+        conn, ids=ids,
+        statuses=as_list(selection.get('status')),
+        os_types=as_list(selection.get('os'))
+    )
+    
+    # Leave out VMs another job is already working on
+    selected, skipped = [], []
+    for vm in vms:
+        active = job_manager.active_job_for(vm['id'])
+        children = linked_clones_of(conn, vm['id']) if action == 'delete' else []
+        if active:
+            skipped.append({'id': vm['id'], 'name': vm['name'], 'success': False,
+                            'error': f'busy with job #{active["id"]} ({active["kind"]})'})
+        elif children:
+            skipped.append({'id': vm['id'], 'name': vm['name'], 'success': False,
+                            'error': f'base of {len(children)} linked clone(s)'})
         else:
-            error_msg = result.get('stderr') or result.get('message') or result.get('stdout') or 'Unknown error'
-            print(f"Delete failed: {result}")
-            flash(f'Error deleting server: {error_msg}', 'error')
+            selected.append({'id': vm['id'], 'name': vm['name'], 'cpu_cores': vm['cpu_cores'],
+                             'ram_size': vm['ram_size'], 'host_id': vm['host_id'],
+                             'priority': priority, 'owner': request.remote_addr})
+    if ids is not None:
+        found = {vm['id'] for vm in vms}
+        skipped.extend({'id': id, 'success': False, 'error': 'VM not found'} for id in ids if id not in found)
     
-    else:
-        flash('Invalid action!', 'error')
+    if not selected:
+        return jsonify({'error': 'No VMs to act on', 'skipped': skipped}), 404
+    
+    job_id = job_manager.submit(
+        f'bulk_{action}', bulk_action_job, action, selected,
+        params={'action': action, 'ids': [vm['id'] for vm in selected]}
+    )
     
-    conn.close()
-    return redirect(url_for('index'))
+    if body.get('wait'):
+        job = job_manager.wait(job_id)
+        return jsonify(dict(job, skipped=skipped))
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('job_status', job_id=job_id),
+        'count': len(selected),
+        'skipped': skipped
+    }), 202
 
 @app.route('/vm/clone/<int:id>', methods=['POST'])
 def clone_vm(id):
     """Clone an existing VM"""
     new_name = request.form.get('new_name', '').strip()
+    mode = request.form.get('mode', CLONE_MODE)
     
     if not new_name:
         flash('New server name is required!', 'error')
         return redirect(url_for('index'))
     
+    if mode not in CLONE_MODES:
+        flash(f'Clone mode must be one of: {", ".join(CLONE_MODES)}', 'error')
+        return redirect(url_for('index'))
+    
     conn = get_db_connection()
     source_vm = conn.execute('SELECT * FROM instances WHERE id = ?', (id,)).fetchone()
     
     if not source_vm:
         flash('Source server not found!', 'error')
-        conn.close()
         return redirect(url_for('index'))
     
     # Check if new name already exists
     existing = conn.execute('SELECT id FROM instances WHERE name = ?', (new_name,)).fetchone()
     if existing:
         flash(f'Server with name "{new_name}" already exists!', 'error')
-        conn.close()
         return redirect(url_for('index'))
     
-    try:
-        print(f"Cloning VM: {source_vm['name']} -> {new_name}")
-        
-        # Call clone script
-        result = run_shell_script('clone_vm.sh', source_vm['name'], new_name)
-        
+    # VirtualBox cannot clone a VM that is being started, stopped or deleted
+    active = job_manager.active_job_for(id)
+    if active:
+        return busy_response(source_vm, active, url_for('index'))
+    
+    job_id = job_manager.submit(
+        'clone', clone_vm_job, id, source_vm['name'], new_name, mode, source_vm['host_id'],
+        instance_id=id, params={'source': source_vm['name'], 'new_name': new_name, 'mode': mode}
+    )
+    return job_queued_response(
+        job_id, f'Server "{source_vm["name"]}" is being cloned to "{new_name}"', url_for('index')
+    )
+
+def flatten_vm_job(id, vm_ref, host_id=None):
+    """Background job: make a linked clone standalone"""
+    result = host_registry.driver(host_id).flatten(vm_ref)
+    if result['success']:
+        conn = get_db_connection()
+        conn.execute("UPDATE instances SET clone_type = 'full' WHERE id = ?", (id,))
+        conn.commit()
+    return result
+
+@app.route('/vm/<int:id>/flatten', methods=['POST'])
+def flatten_vm(id):
+    """Copy a linked clone's disks so it no longer depends on its base VM"""
+    conn = get_db_connection()
+    vm = conn.execute('SELECT * FROM instances WHERE id = ?', (id,)).fetchone()
+    
+    if not vm:
+        flash('Server not found!', 'error')
+        return redirect(url_for('index'))
+    
+    if vm['clone_type'] != 'linked':
+        flash(f'Server "{vm["name"]}" is not a linked clone', 'error')
+        return redirect(url_for('vm_details', id=id))
+    
+    active = job_manager.active_job_for(id)
+    if active:
+        return busy_response(vm, active, url_for('vm_details', id=id))
+    
+    job_id = job_manager.submit(
+        'flatten', flatten_vm_job, id, vm['vm_uuid'] or vm['name'], vm['host_id'],
+        instance_id=id, params={'name': vm['name']}
+    )
+    return job_queued_response(job_id, f'Server "{vm["name"]}" is being flattened', url_for('vm_details', id=id))
+
+# Scheduler owner of the jobs fleet applies submit
+FLEET_OWNER = 'fleet'
+
+def wait_fleet_job(job_id, jobs):
+    """Fleet apply: wait for one step's job and return its result dict"""
+    jobs.append(job_id)
+    job = job_manager.wait(job_id)
+    return job['result'] or {'success': False, 'message': job['error'] or 'Job did not finish'}
+
+def create_fleet_vm(vm, jobs):
+    """Fleet apply: reserve, place and create one VM the way the create form does"""
+    host_id = scheduler.place(vm['cpu'], vm['ram'])
+    scheduler.validate(vm['cpu'], vm['ram'], 'normal', host_id)
+    image = image_catalog.default_for(vm['os'])
+    conn = get_db_connection()
+    cursor = conn.execute(
+        '''INSERT INTO instances (name, os_type, cpu_cores, ram_size, storage_size, status, image_id, host_id)
+           VALUES (?, ?, ?, ?, ?, 'creating', ?, ?)''',
+        (vm['name'], vm['os'], vm['cpu'], vm['ram'], vm['storage'], image['id'] if image else None, host_id)
+    )
+    instance_id = cursor.lastrowid
+    conn.commit()
+    # Services and users are queued afterwards, with the rest of the diff
+    job_id = submit_admitted(
+        'create', create_vm_job,
+        instance_id, vm['name'], vm['os'], vm['cpu'], vm['ram'], vm['storage'],
+        [], None, None, False, image['path'] if image else None, True, host_id,
+        instance_id=instance_id, cpu_cores=vm['cpu'], ram_size=vm['ram'], host_id=host_id, owner=FLEET_OWNER,
+        params={'name': vm['name'], 'os_type': vm['os'], 'cpu': vm['cpu'], 'ram': vm['ram'],
+                'storage': vm['storage'], 'image_id': image['id'] if image else None,
+                'host': host_registry.name_of(host_id), 'reason': 'fleet'}
+    )
+    return wait_fleet_job(job_id, jobs)
+
+# Linked clones of one source all need its snapshot; they are taken one at a time
+clone_source_locks = {}
+
+def clone_fleet_vm(vm, jobs):
+    """Fleet apply: clone one VM from its clone_of source"""
+    conn = get_db_connection()
+    source = conn.execute('SELECT * FROM instances WHERE name = ?', (vm['clone_of'],)).fetchone()
+    if not source:
+        return {'success': False, 'message': f'Clone source {vm["clone_of"]} does not exist'}
+    lock = clone_source_locks.setdefault(source['id'], threading.Lock())
+    with lock:
+        active = job_manager.active_job_for(source['id'])
+        if active:
+            return {'success': False, 'message': f'Clone source {source["name"]} is busy with job #{active["id"]}'}
+        job_id = job_manager.submit(
+            'clone', clone_vm_job, source['id'], source['name'], vm['name'], vm['clone_mode'], source['host_id'],
+            instance_id=source['id'],
+            params={'source': source['name'], 'new_name': vm['name'], 'mode': vm['clone_mode'], 'reason': 'fleet'}
+        )
+        return wait_fleet_job(job_id, jobs)
+
+def apply_fleet_vm(vm):
+    """Fleet apply: create or clone one VM, then queue, power and provision what its spec still lacks
+
+    Every step is a job of its own, so the VM shows as busy while it runs;
+    starts, resumes and creates wait for host capacity in the scheduler.
+    """
+    conn = get_db_connection()
+    row = conn.execute('SELECT id FROM instances WHERE name = ?', (vm['name'],)).fetchone()
+    if row and job_manager.active_job_for(row['id']):
+        return {'success': False, 'id': row['id'], 'message': f'{vm["name"]} is busy with another job'}
+    change = fleet.diff(conn, vm)
+    steps, jobs = [], []
+    if change['action'] in ('create', 'clone'):
+        result = create_fleet_vm(vm, jobs) if change['action'] == 'create' else clone_fleet_vm(vm, jobs)
         if not result['success']:
-            error_msg = result.get('stderr') or result.get('message') or 'Unknown error'
-            flash(f'Error cloning server: {error_msg}', 'error')
-            conn.close()
-            return redirect(url_for('index'))
-        
-        # Extract UUID from output
-        stdout_lines = result['stdout'].split('\n')
-        new_uuid = stdout_lines[-1].strip() if stdout_lines else None
+            return dict(result, steps=steps, jobs=jobs)
+        steps.append(change['action'])
+        # A clone brings its source's services and users along
+        change = fleet.diff(conn, vm)
+    elif change['action'] == 'none':
+        return {'success': True, 'id': change['id'], 'steps': [], 'jobs': [], 'message': 'Up to date'}
+
+    row = conn.execute('SELECT * FROM instances WHERE name = ?', (vm['name'],)).fetchone()
+    queued = fleet.queue_items(conn, provisioner, row['id'], vm, change)
+
+    # Guest commands need a running VM, whatever power state the spec wants in the end
+    power_up = change['state'] if change['state'] in ADMITTED_ACTIONS else None
+    if queued and not power_up:
+        power_up = fleet.STATE_ACTIONS['running'].get(row['status'])
+    if power_up:
+        result = wait_fleet_job(submit_admitted(
+            power_up, vm_action_job, power_up, row['id'], row['name'], row['host_id'],
+            instance_id=row['id'], cpu_cores=row['cpu_cores'], ram_size=row['ram_size'], host_id=row['host_id'],
+            owner=FLEET_OWNER, params={'name': row['name'], 'reason': 'fleet'}
+        ), jobs)
+        if not result['success']:
+            return dict(result, id=row['id'], steps=steps, jobs=jobs)
+        steps.append(power_up)
+
+    result = {'success': True}
+    if queued:
+        result = wait_fleet_job(submit_provision(
+            [row['id']], instance_id=row['id'], params={'name': row['name'], 'reason': 'fleet'}, owner=FLEET_OWNER
+        ), jobs)
+        steps.append('provision')
+
+    if vm['state'] == 'stopped' and (power_up or change['state'] == 'stop'):
+        stopped = wait_fleet_job(job_manager.submit(
+            'stop', vm_action_job, 'stop', row['id'], row['name'], row['host_id'],
+            instance_id=row['id'], params={'name': row['name'], 'reason': 'fleet'}
+        ), jobs)
+        if not stopped['success']:
+            return dict(stopped, id=row['id'], steps=steps, jobs=jobs)
+        steps.append('stop')
+    return dict(result, id=row['id'], steps=steps, jobs=jobs)
+
+# Fleet specs apply VMs in dependency order, VSM_FLEET_CONCURRENCY at a time
+fleet_runner = fleet.FleetRunner(apply_fleet_vm, max_parallel=int(os.environ.get('VSM_FLEET_CONCURRENCY', 8)))
+
+def fleet_apply_job(spec):
+    """Background job: apply a fleet spec and report per-VM results
+
+    Each VM's steps run as jobs of their own; this one only waits for them.
+    """
+    results = fleet_runner.run(spec)
+    failed = [r for r in results if not r['success']]
+    summary = {
+        'success': not failed,
+        'total': len(results),
+        'changed': sum(1 for r in results if r.get('steps')),
+        'failed': len(failed),
+        'results': results
+    }
+    if failed:
+        summary['message'] = f'{len(failed)} of {len(results)} VMs failed to apply'
+    return summary
+
+# Held from the running-apply check in fleet_apply until its job is queued
+fleet_apply_lock = threading.Lock()
+
+def read_fleet_spec():
+    """The spec in the request body: JSON, or YAML with a YAML content type"""
+    fmt = 'yaml' if request.mimetype in ('application/yaml', 'application/x-yaml', 'text/yaml') else 'json'
+    return fleet.load_spec(request.get_data(as_text=True), fmt)
+
+@app.route('/api/fleet/plan', methods=['POST'])
+def fleet_plan():
+    """What applying a fleet spec would change; nothing is changed"""
+    try:
+        spec = read_fleet_spec()
+        return jsonify(fleet.plan(get_db_connection(), spec, busy=job_manager.active_job_for))
+    except fleet.SpecError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/fleet/apply', methods=['POST'])
+def fleet_apply():
+    """Apply a fleet spec as one job; ?wait=1 answers when it is done"""
+    # The apply job waits for its VMs' jobs; two at once could hold every worker.
+    # Checking and submitting under one lock keeps two requests from both passing.
+    with fleet_apply_lock:
+        running = [job for job in job_manager.list(active_only=True, limit=1000) if job['kind'] == 'fleet_apply']
+        if running:
+            return jsonify({'error': f'Fleet apply job #{running[0]["id"]} is still running',
+                            'job_id': running[0]['id']}), 409
+        try:
+            spec = read_fleet_spec()
+            plan = fleet.plan(get_db_connection(), spec, busy=job_manager.active_job_for)
+        except fleet.SpecError as e:
+            return jsonify({'error': str(e)}), 400
+        if not plan['to_change']:
+            return jsonify(dict(plan, message='Nothing to change'))
         
-        # Insert cloned VM into database
-        cursor = conn.execute(
-            '''INSERT INTO instances (name, os_type, cpu_cores, ram_size, storage_size, vm_uuid, status) 
-               VALUES (?, ?, ?, ?, ?, ?, 'stopped')''',
-            (new_name, source_vm['os_type'], source_vm['cpu_cores'], 
-             source_vm['ram_size'], source_vm['storage_size'], new_uuid)
+        # Passwords stay out of the job's params
+        job_id = job_manager.submit(
+            'fleet_apply', fleet_apply_job, spec,
+            params={'vms': len(spec['vms']), 'to_change': plan['to_change'], 'summary': plan['summary']}
         )
-        new_id = cursor.lastrowid
-        
-        # Copy services from source VM
-        services = conn.execute(
-            'SELECT service_name FROM services WHERE instance_id = ?',
-            (id,)
-        ).fetchall()
-        
-        for service in services:
-            conn.execute(
-                'INSERT INTO services (instance_id, service_name) VALUES (?, ?)',
-                (new_id, service['service_name'])
-            )
-        
-        # Copy users from source VM
-        users = conn.execute(
-            'SELECT username, has_sudo FROM vm_users WHERE instance_id = ?',
-            (id,)
-        ).fetchall()
-        
-        for user in users:
-            conn.execute(
-                'INSERT INTO vm_users (instance_id, username, has_sudo) VALUES (?, ?, ?)',
-                (new_id, user['username'], user['has_sudo'])
-            )
-        
-        conn.commit()
-        flash(f'Server "{source_vm["name"]}" cloned to "{new_name}" successfully!', 'success')
-        
-    except Exception as e:
-        print(f"Exception in clone_vm: {str(e)}")
-        flash(f'Error cloning server: {str(e)}', 'error')
-    finally:
-        conn.close()
-    
-    return redirect(url_for('index'))
+    if request.args.get('wait') == '1':
+        return jsonify(dict(plan, job=job_manager.wait(job_id)))
+    return jsonify(dict(plan, job_id=job_id, status='queued',
+                        status_url=url_for('job_status', job_id=job_id))), 202
 
 @app.route('/vm/details/<int:id>')
 def vm_details(id):
@@ -412,7 +1073,6 @@ def vm_details(id):
     
     if vm is None:
         flash('Server not found!', 'error')
-        conn.close()
         return redirect(url_for('index'))
     
     # Get services for this VM
@@ -427,16 +1087,20 @@ def vm_details(id):
         (id,)
     ).fetchall()
     
-    conn.close()
+    parent = conn.execute('SELECT id, name FROM instances WHERE id = ?', (vm['parent_id'],)).fetchone() \
+        if vm['parent_id'] else None
+    children = linked_clones_of(conn, id)
+    disk = storage_manager.vm_usage(id)
     
-    return render_template('details.html', vm=vm, services=services, users=users)
+    return render_template('details.html', vm=vm, services=services, users=users,
+                           parent=parent, linked_clones=children, host_name=host_registry.name_of(vm['host_id']),
+                           disk=disk)
 
 @app.route('/vm/monitor/<int:id>')
 def vm_monitor(id):
     """Real-time monitoring page for a VM"""
     conn = get_db_connection()
     vm = conn.execute('SELECT * FROM instances WHERE id = ?', (id,)).fetchone()
-    conn.close()
     
     if vm is None:
         flash('Server not found!', 'error')
@@ -448,24 +1112,133 @@ def vm_monitor(id):
 def vm_stats(id):
     """Get real-time VM statistics"""
     conn = get_db_connection()
-    vm = conn.execute('SELECT * FROM instances WHERE id = ?', (id,)).fetchone()
-    conn.close()
+    vm = conn.execute('SELECT name FROM instances WHERE id = ?', (id,)).fetchone()
     
     if not vm:
         return jsonify({'error': 'VM not found'}), 404
     
-    # Call monitoring script
-    result = run_shell_script('get_vm_stats.sh', vm['name'])
+    try:
+        stats = stats_collector.get(vm['name'])
+    except RuntimeError as e:
+        return jsonify({'error': 'Failed to get stats', 'message': str(e)})
     
-    if result['success']:
-        try:
-            import json
-            stats = json.loads(result['stdout'])
-            return jsonify(stats)
-        except:
-            return jsonify({'error': 'Failed to parse stats', 'output': result['stdout']})
-    else:
-        return jsonify({'error': 'Failed to get stats', 'message': result.get('stderr', 'Unknown error')})
+    if stats is None:
+        return jsonify({'error': 'Failed to get stats', 'message': 'VM not found'})
+    return jsonify(stats)
+
+@app.route('/api/vm/<int:id>/info')
+def vm_info(id):
+    """VirtualBox's view of a VM (cached briefly by the driver)"""
+    conn = get_db_connection()
+    vm = conn.execute('SELECT name, vm_uuid, host_id FROM instances WHERE id = ?', (id,)).fetchone()
+    if not vm:
+        return jsonify({'error': 'VM not found in database'}), 404
+    
+    info = driver_for(vm).info(vm['vm_uuid'] or vm['name'])
+    if not info:
+        return jsonify({'error': 'VM not found in VirtualBox'}), 404
+    return jsonify(info.to_dict())
+
+@app.route('/api/vm/<int:id>/stats/history')
+def vm_stats_history(id):
+    """Get recorded metrics for a VM, e.g. ?range=10m or ?range=1d&series=cpu,memory"""
+    conn = get_db_connection()
+    vm = conn.execute('SELECT name FROM instances WHERE id = ?', (id,)).fetchone()
+    
+    if not vm:
+        return jsonify({'error': 'VM not found'}), 404
+    
+    # Make sure the collector is sampling at full rate so the history keeps growing
+    stats_collector.ensure_started()
+    stats_collector.touch()
+    
+    seconds = parse_range(request.args.get('range'))
+    series = request.args.get('series')
+    history = metrics_store.history(vm['name'], seconds, series.split(',') if series else None)
+    return jsonify(dict(history, vm=vm['name']))
+
+def event_stream_response(topic):
+    """Stream stats events for one VM (or all of them when topic is None)"""
+    stats_collector.ensure_started()
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+    
+    return Response(
+        stats_events.stream(topic, last_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/vm/<int:id>/stats/stream')
+def vm_stats_stream(id):
+    """Server-Sent Events stream of VM statistics"""
+    conn = get_db_connection()
+    vm = conn.execute('SELECT name FROM instances WHERE id = ?', (id,)).fetchone()
+    
+    if not vm:
+        return jsonify({'error': 'VM not found'}), 404
+    return event_stream_response(vm['name'])
+
+@app.route('/api/stats/stream')
+def fleet_stats_stream():
+    """Server-Sent Events stream of statistics for every VM"""
+    return event_stream_response(None)
+
+@app.route('/api/stats')
+def fleet_stats():
+    """Get statistics for every VM in one response"""
+    try:
+        sampled_at, stats = stats_collector.get_all()
+    except RuntimeError as e:
+        return jsonify({'error': 'Failed to get stats', 'message': str(e)}), 503
+    
+    conn = get_db_connection()
+    vms = conn.execute('SELECT id, name FROM instances').fetchall()
+    
+    fleet = {}
+    for vm in vms:
+        fleet[vm['id']] = dict(stats.get(vm['name']) or {'status': 'missing'}, name=vm['name'])
+    return jsonify({'sampled_at': sampled_at, 'vms': fleet})
+
+def provision_job(ids):
+    """Background job: apply pending services and users to one or more VMs"""
+    results = provisioner.provision(ids)
+    if len(results) == 1:
+        return results[0]
+    
+    failed = [r for r in results if not r['success']]
+    summary = {'success': not failed, 'total': len(results), 'failed': len(failed), 'results': results}
+    if failed:
+        summary['message'] = f'{len(failed)} of {len(results)} VMs failed to provision'
+    return summary
+
+def submit_provision(ids, instance_id=None, params=None, owner=None):
+    """Queue a provision job; suspended VMs among ids are resumed by admitted jobs first
+
+    Guest commands need a running VM. The resumes wait for host capacity in
+    the scheduler and the provision job is dispatched once they are done,
+    so no job worker ever waits for admission.
+    """
+    conn = get_db_connection()
+    placeholders = ', '.join('?' for _ in ids)
+    suspended = conn.execute(
+        f"SELECT id, name, host_id, cpu_cores, ram_size FROM instances WHERE status = 'suspended' AND id IN ({placeholders})",
+        list(ids)
+    ).fetchall()
+    resumes = []
+    for vm in suspended:
+        print(f"Resuming {vm['name']} on demand")
+        resumes.append(submit_admitted(
+            'resume', vm_action_job, 'resume', vm['id'], vm['name'], vm['host_id'],
+            instance_id=vm['id'], cpu_cores=vm['cpu_cores'], ram_size=vm['ram_size'], host_id=vm['host_id'],
+            params={'name': vm['name'], 'reason': 'provision'}, owner=owner
+        ))
+    job_id = job_manager.enqueue('provision', instance_id=instance_id, params=params)
+    job_manager.dispatch_after(job_id, 'provision', provision_job, (ids,), resumes)
+    return job_id
 
 @app.route('/vm/<int:id>/install_service', methods=['POST'])
 def install_service(id):
@@ -481,24 +1254,15 @@ def install_service(id):
     
     if not vm:
         flash('Server not found!', 'error')
-        conn.close()
         return redirect(url_for('index'))
     
-    # Call script to install service
-    result = run_shell_script('install_service.sh', vm['name'], service_name)
-    
-    if result['success']:
-        conn.execute(
-            'INSERT INTO services (instance_id, service_name) VALUES (?, ?)',
-            (id, service_name)
-        )
-        conn.commit()
-        flash(f'Service "{service_name}" installed successfully!', 'success')
-    else:
-        flash(f'Error installing service: {result.get("stderr", result.get("message"))}', 'error')
+    provisioner.queue_service(conn, id, service_name)
+    conn.commit()
     
-    conn.close()
-    return redirect(url_for('vm_details', id=id))
+    job_id = submit_provision([id], instance_id=id, params={'name': vm['name'], 'service_name': service_name})
+    return job_queued_response(
+        job_id, f'Service "{service_name}" is being installed', url_for('vm_details', id=id)
+    )
 
 @app.route('/vm/<int:id>/create_user', methods=['POST'])
 def create_user(id):
@@ -516,38 +1280,277 @@ def create_user(id):
     
     if not vm:
         flash('Server not found!', 'error')
-        conn.close()
         return redirect(url_for('index'))
     
-    # Call script to create user
-    result = run_shell_script('manage_users.sh', vm['name'], username, password, 'yes' if has_sudo else 'no')
+    # The provisioner keeps the password in memory only, never in the database
+    provisioner.queue_user(conn, id, username, password, has_sudo)
+    conn.commit()
     
-    if result['success']:
-        conn.execute(
-            'INSERT INTO vm_users (instance_id, username, has_sudo) VALUES (?, ?, ?)',
-            (id, username, has_sudo)
+    job_id = submit_provision(
+        [id], instance_id=id, params={'name': vm['name'], 'username': username, 'has_sudo': has_sudo}
+    )
+    return job_queued_response(
+        job_id, f'User "{username}" is being created', url_for('vm_details', id=id)
+    )
+
+@app.route('/api/provision', methods=['POST'])
+def provision_vms():
+    """Apply pending items: {"ids": [...]} (default: every VM with pending work), "retry_failed", "wait"}"""
+    body = request.get_json(silent=True) or {}
+    ids = body.get('ids')
+    if ids is not None and not all(isinstance(id, int) for id in ids):
+        return jsonify({'error': '"ids" must be a list of integers'}), 400
+    
+    if ids and body.get('retry_failed'):
+        provisioner.retry_failed(ids)
+    if ids is None:
+        ids = provisioner.pending_instances()
+    if not ids:
+        return jsonify({'error': 'Nothing to provision'}), 404
+    
+    job_id = submit_provision(ids, instance_id=ids[0] if len(ids) == 1 else None, params={'ids': ids})
+    if body.get('wait'):
+        return jsonify(job_manager.wait(job_id))
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('job_status', job_id=job_id),
+        'count': len(ids)
+    }), 202
+
+@app.route('/api/reconcile', methods=['GET', 'POST'])
+def reconcile():
+    """Drift between VirtualBox and the database; POST runs a cycle first"""
+    if request.method == 'POST':
+        reconciler.reconcile_once()
+    return jsonify(reconciler.drift())
+
+@app.route('/api/pool')
+def pool_status():
+    """Warm pool targets with their ready and provisioning counts"""
+    return jsonify(warm_pool.status())
+
+@app.route('/api/hibernation', methods=['GET', 'POST'])
+def hibernation():
+    """Idle policy settings and the VMs it would suspend now; POST suspends them"""
+    queued = hibernator.check_once() if request.method == 'POST' else None
+    body = dict(hibernator.status(), idle=hibernator.candidates() if hibernator.enabled else [])
+    if queued is not None:
+        body['queued'] = queued
+    return jsonify(body)
+
+@app.route('/api/balloon', methods=['GET', 'POST'])
+def balloon():
+    """Controller settings and the memory held by balloons per VM, host and fleet; POST runs a cycle"""
+    resized = balloon_controller.check_once() if request.method == 'POST' else None
+    reclaimed = balloon_controller.reclaimed()
+    for host in reclaimed['hosts']:
+        host['name'] = host_registry.name_of(host['host_id'])
+    body = dict(balloon_controller.status(), reclaimed=reclaimed)
+    if resized is not None:
+        body['resized'] = [{'id': id, 'from_mb': old, 'to_mb': new} for id, old, new in resized]
+    return jsonify(body)
+
+@app.route('/api/storage', methods=['GET', 'POST'])
+def storage():
+    """Disk space per host and fleet, what compaction could free and what was freed; POST runs a cycle"""
+    cycle = storage_manager.check_once() if request.method == 'POST' else None
+    usage = storage_manager.usage()
+    for host in usage['hosts']:
+        host['name'] = host_registry.name_of(host['host_id'])
+    body = dict(storage_manager.status(), usage=usage)
+    if cycle is not None:
+        body['cycle'] = cycle
+    return jsonify(body)
+
+@app.route('/api/vm/<int:id>/storage')
+def vm_storage(id):
+    """A VM's disk images as last measured; ?refresh=1 measures them first"""
+    conn = get_db_connection()
+    vm = conn.execute('SELECT id, name, storage_size FROM instances WHERE id = ?', (id,)).fetchone()
+    if not vm:
+        return jsonify({'error': 'Server not found'}), 404
+    if request.args.get('refresh') == '1':
+        storage_manager.measure(id)
+    return jsonify(dict(storage_manager.vm_usage(id), id=id, name=vm['name'], requested_mb=vm['storage_size']))
+
+@app.route('/api/vm/<int:id>/compact', methods=['POST'])
+def compact_vm(id):
+    """Compact a stopped VM's disk images now, ahead of the queue"""
+    conn = get_db_connection()
+    vm = conn.execute('SELECT * FROM instances WHERE id = ?', (id,)).fetchone()
+    if not vm:
+        return jsonify({'error': 'Server not found'}), 404
+    if vm['status'] != 'stopped':
+        return jsonify({'error': f'Server "{vm["name"]}" is {vm["status"]}; only stopped VMs are compacted'}), 409
+    active = job_manager.active_job_for(id)
+    if active:
+        return busy_response(vm, active, url_for('vm_details', id=id))
+    job_id = job_manager.submit(
+        'compact', storage_manager.compact_vm, id,
+        instance_id=id, params={'name': vm['name'], 'reason': 'manual'}
+    )
+    return job_queued_response(job_id, f'Server "{vm["name"]}" is being compacted', url_for('vm_details', id=id))
+
+@app.route('/api/vm/<int:id>/auto_suspend', methods=['POST'])
+def set_auto_suspend(id):
+    """Opt a VM in or out of idle hibernation: {"enabled": true|false}"""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body.get('enabled'), bool):
+        return jsonify({'error': '"enabled" must be true or false'}), 400
+    conn = get_db_connection()
+    cursor = conn.execute('UPDATE instances SET auto_suspend = ? WHERE id = ?', (int(body['enabled']), id))
+    conn.commit()
+    if not cursor.rowcount:
+        return jsonify({'error': 'Server not found'}), 404
+    return jsonify({'id': id, 'auto_suspend': body['enabled']})
+
+@app.route('/api/pool/targets', methods=['POST'])
+def set_pool_target():
+    """Create or update a warm pool target; set "target": 0 to drain a shape"""
+    body = request.get_json(silent=True) or {}
+    try:
+        shape = (
+            body['os_type'],
+            int(body['cpu_cores']),
+            int(body['ram_size']),
+            int(body['storage_size']),
+            body['golden_vm'],
+            int(body.get('target', 1))
         )
-        conn.commit()
-        flash(f'User "{username}" created successfully!', 'success')
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'os_type, cpu_cores, ram_size, storage_size and golden_vm are required'}), 400
+    
+    warm_pool.set_target(*shape)
+    return jsonify(warm_pool.status())
+
+@app.route('/api/images')
+def api_images():
+    """Catalog images (?os=Ubuntu, ?all=1 to include files that are gone)"""
+    return jsonify({
+        'images': image_catalog.list(request.args.get('os'), request.args.get('all') == '1'),
+        **image_catalog.status()
+    })
+
+@app.route('/api/images/<int:image_id>')
+def api_image(image_id):
+    image = image_catalog.get(image_id)
+    if not image:
+        return jsonify({'error': 'Image not found'}), 404
+    return jsonify(image)
+
+@app.route('/api/images/refresh', methods=['POST'])
+def refresh_images():
+    """Rescan the image directories now; new files are hashed in the same job"""
+    job_id = job_manager.submit('image_scan', image_catalog.refresh)
+    return job_queued_response(job_id, 'Image directories are being scanned', url_for('create'))
+
+@app.route('/api/hosts', methods=['GET', 'POST'])
+def api_hosts():
+    """List hosts, or register a node agent: {"name", "url"}"""
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        name = (body.get('name') or '').strip()
+        url = (body.get('url') or '').strip()
+        if not name or not url or name == 'local':
+            return jsonify({'error': 'Provide a "name" (not "local") and the agent "url"'}), 400
+        try:
+            host = host_registry.register(name, url)
+        except (ValueError, AgentError) as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(host), 201
+    usage = {h['host_id']: h for h in scheduler.status()['hosts']}
+    return jsonify({'hosts': [dict(h, capacity=usage.get(h['id'], {}).get('capacity'),
+                                   used=usage.get(h['id'], {}).get('used'))
+                              for h in host_registry.list()]})
+
+@app.route('/api/hosts/<int:host_id>', methods=['DELETE'])
+def remove_host(host_id):
+    """Forget a node agent that has no instances left"""
+    try:
+        host_registry.remove(host_id)
+    except KeyError:
+        return jsonify({'error': 'Host not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'success': True})
+
+@app.route('/api/scheduler')
+def scheduler_status():
+    """Host capacity and usage, admitted creates/starts and the admission queue"""
+    return jsonify(scheduler.status())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Script, VBoxManage, SQLite, request and job timings in Prometheus text format"""
+    return Response(telemetry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/jobs')
+def list_jobs():
+    """List recent background jobs, optionally for one VM"""
+    instance_id = request.args.get('instance_id', type=int)
+    active_only = request.args.get('active') in ('1', 'true', 'yes')
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify(job_manager.list(instance_id=instance_id, active_only=active_only, limit=limit))
+
+@app.route('/api/jobs/<int:job_id>/log')
+def job_log(job_id):
+    """Last lines of a job's log file as plain text, e.g. ?lines=500"""
+    lines = oplog.tail(job_id, min(request.args.get('lines', 200, type=int), 10000))
+    if lines is None:
+        return jsonify({'error': 'No log for this job'}), 404
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
+def finished_log_stream(job):
+    """SSE frames for a job that has already ended: its log file, then 'end'"""
+    for line in oplog.tail(job['id'], 1000) or []:
+        yield f'event: log\ndata: {json.dumps({"line": line, "stream": "file"})}\n\n'
+    yield f'event: end\ndata: {json.dumps({"status": job["status"], "error": job["error"]})}\n\n'
+
+@app.route('/api/jobs/<int:job_id>/log/stream')
+def job_log_stream(job_id):
+    """Server-Sent Events tail of a job's log: 'log', 'progress' and a final 'end' event"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['status'] in ACTIVE_STATES:
+        last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+        try:
+            last_id = int(last_id) if last_id else 0
+        except ValueError:
+            last_id = 0
+        # From 0 the stream replays what this job wrote before the client connected
+        stream = job_events.stream(job_id, last_id, until='end')
     else:
-        flash(f'Error creating user: {result.get("stderr", result.get("message"))}', 'error')
+        stream = finished_log_stream(job)
     
-    conn.close()
-    return redirect(url_for('vm_details', id=id))
+    return Response(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs/<int:job_id>')
+def job_status(job_id):
+    """Get the status and result of a background job"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'queued':
+        job['queue'] = scheduler.position(job_id)
+    return jsonify(job)
 
 if __name__ == '__main__':
-    # Create scripts directory if it doesn't exist
-    os.makedirs(SCRIPTS_DIR, exist_ok=True)
-    
     # Initialize database
     init_db()
+    job_manager.recover()
     
     print("=" * 50)
     print("Virtual Server Manager Started!")
     print("=" * 50)
     print("Access the application at: http://localhost:5000")
     print("Make sure VirtualBox is installed on your system")
-    print(f"Scripts directory: {SCRIPTS_DIR}")
     print("=" * 50)
     
     app.run(debug=True, port=5000)
\ No newline at end of file
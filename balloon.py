@@ -0,0 +1,159 @@
+import threading
+import time
+
+from metrics import covers
+
+
+class BalloonController:
+    """Hand memory that guests do not use back to the host through their balloons
+
+    Every `interval` seconds each running VM with Guest Additions (the
+    stats history has balloon_mb for it) is sized from the peak of its own
+    memory use over the last `window` seconds plus `headroom_percent`.
+    The balloon only grows once the VM has been sampled for the whole
+    window and the change is at least `step_mb`; it shrinks at once when
+    the guest has less than `low_percent` of its memory free. The band in
+    between is left alone, so a guest hovering around one figure does not
+    make the balloon pump. The guest always keeps `floor_mb` and the
+    balloon never takes more than `ceiling_percent` of its RAM.
+
+    instances.balloon_mb records the balloon of every running VM; the
+    scheduler counts ram_size - balloon_mb as in use.
+    """
+
+    def __init__(self, connect, store, driver_for, enabled=False, floor_mb=512, ceiling_percent=75.0,
+                 headroom_percent=25.0, low_percent=10.0, step_mb=128, window=300.0, interval=30.0):
+        self.connect = connect
+        self.store = store
+        self.driver_for = driver_for
+        self.enabled = enabled
+        self.floor_mb = floor_mb
+        self.ceiling_percent = ceiling_percent
+        self.headroom_percent = headroom_percent
+        self.low_percent = low_percent
+        self.step_mb = step_mb
+        self.window = window
+        self.interval = interval
+        self._last_check = None
+        self._resized = 0
+        self._error = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        """Start the controller thread if it is on and not running yet"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='vsm-balloon', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"Balloon controller error: {str(e)}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def limit(self, ram_mb):
+        """Largest balloon a VM with ram_mb of memory may have"""
+        return max(0, int(min(ram_mb * self.ceiling_percent / 100.0, ram_mb - self.floor_mb)))
+
+    def plan(self, row):
+        """(current, target) balloon in MB for one running VM, or None without guest figures"""
+        history = self.store.history(row['name'], self.window, ['memory_used_mb', 'balloon_mb'])
+        points = history['series']
+        balloons = [mb for mb in points['balloon_mb'] if mb is not None]
+        used = [mb for mb, balloon_mb in zip(points['memory_used_mb'], points['balloon_mb'])
+                if mb is not None and balloon_mb is not None]
+        if not balloons or not used:
+            return None
+
+        ram = int(row['ram_size'] or 0)
+        current = int(balloons[-1])
+        limit = self.limit(ram)
+        wanted = ram - max(used) * (1 + self.headroom_percent / 100.0)
+        target = max(0, min(int(wanted), limit))
+
+        available = ram - current
+        if available and (available - used[-1]) * 100.0 / available < self.low_percent:
+            return current, min(target, max(0, current - self.step_mb))   # memory pressure: shrink now
+        if current > limit:
+            return current, limit   # the limits were lowered
+        if target - current >= self.step_mb and row['settled'] and covers(history, self.window):
+            return current, target
+        return current, current
+
+    def check_once(self):
+        """Resize every balloon that is due; returns [(id, old_mb, new_mb)]"""
+        if not self.enabled:
+            return []
+        conn = self.connect()
+        # settled: running for at least the window, so its history is all from this boot
+        rows = conn.execute(
+            '''SELECT id, name, host_id, ram_size, balloon_mb,
+                      (status_changed_at IS NULL OR status_changed_at <= datetime('now', ?)) AS settled
+               FROM instances WHERE status = 'running' ''',
+            (f'-{int(self.window)} seconds',)
+        ).fetchall()
+        resized, recorded, errors = [], [], []
+        for row in rows:
+            planned = self.plan(row)
+            if planned is None:
+                continue
+            current, target = planned
+            if target != current:
+                result = self.driver_for(row['host_id']).set_balloon(row['name'], target)
+                if not result['success']:
+                    errors.append(f"{row['name']}: {result.get('stderr') or result.get('message')}")
+                    target = current
+                else:
+                    print(f"Balloon of {row['name']}: {current} -> {target} MB")
+                    resized.append((row['id'], current, target))
+            if target != row['balloon_mb']:
+                recorded.append((target, row['id']))
+        if recorded:
+            conn.executemany("UPDATE instances SET balloon_mb = ? WHERE id = ? AND status = 'running'", recorded)
+            conn.commit()
+        self._last_check = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._resized += len(resized)
+        self._error = '; '.join(errors) or None
+        return resized
+
+    def reclaimed(self):
+        """Memory held by balloons per running VM, per host and for the fleet"""
+        rows = self.connect().execute(
+            '''SELECT id, name, host_id, ram_size, balloon_mb FROM instances
+               WHERE status = 'running' AND balloon_mb > 0 ORDER BY balloon_mb DESC'''
+        ).fetchall()
+        hosts = {}
+        for row in rows:
+            hosts[row['host_id']] = hosts.get(row['host_id'], 0) + row['balloon_mb']
+        return {
+            'total_mb': sum(row['balloon_mb'] for row in rows),
+            'hosts': [{'host_id': host_id, 'reclaimed_mb': mb} for host_id, mb in hosts.items()],
+            'vms': [{'id': row['id'], 'name': row['name'], 'host_id': row['host_id'],
+                     'ram_size': row['ram_size'], 'reclaimed_mb': row['balloon_mb']} for row in rows],
+        }
+
+    def status(self):
+        return {
+            'enabled': self.enabled,
+            'floor_mb': self.floor_mb,
+            'ceiling_percent': self.ceiling_percent,
+            'headroom_percent': self.headroom_percent,
+            'low_percent': self.low_percent,
+            'step_mb': self.step_mb,
+            'window_seconds': self.window,
+            'interval_seconds': self.interval,
+            'last_check': self._last_check,
+            'resized_total': self._resized,
+            'error': self._error,
+        }
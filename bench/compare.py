@@ -0,0 +1,45 @@
+"""Compare two benchmark result files scenario by scenario
+
+    python bench/compare.py bench/results/before.json bench/results/after.json
+"""
+import json
+import sys
+
+METRICS = [
+    ('p50 ms', lambda s: s['latency']['p50_ms']),
+    ('p95 ms', lambda s: s['latency']['p95_ms']),
+    ('p99 ms', lambda s: s['latency']['p99_ms']),
+    ('req/s', lambda s: s['throughput_rps']),
+    ('spawns/req', lambda s: s['spawns_per_request']),
+    ('errors', lambda s: s['errors']),
+]
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return ''
+    return f'{(after - before) / before * 100:+.1f}%'
+
+
+def main(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print(f"before: {before.get('commit')} ({before['vms']} VMs)   after: {after.get('commit')} ({after['vms']} VMs)")
+    for scenario in after['scenarios']:
+        if scenario not in before['scenarios']:
+            continue
+        print(f"\n{scenario}")
+        for label, read in METRICS:
+            old = read(before['scenarios'][scenario])
+            new = read(after['scenarios'][scenario])
+            print(f"  {label:<12} {old!s:>10} -> {new!s:>10}  {change(old, new)}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(__doc__.strip())
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2])
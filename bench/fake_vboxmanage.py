@@ -0,0 +1,275 @@
+"""Stand-in for VBoxManage used by the benchmarks
+
+Implements the subset of commands the app calls, against a JSON state file,
+with configurable latency and failure injection. Configured by environment:
+
+    FAKE_VBOX_STATE              state file (required)
+    FAKE_VBOX_CALLS              append one line per invocation here
+    FAKE_VBOX_LATENCY_MS         delay before every command
+    FAKE_VBOX_LATENCY_JITTER_MS  extra random delay, 0..N ms
+    FAKE_VBOX_LATENCY_<CMD>_MS   per-command delay, e.g. FAKE_VBOX_LATENCY_CLONEVM_MS
+    FAKE_VBOX_FAIL_RATE          probability (0..1) that a command fails
+    FAKE_VBOX_FAIL_COMMANDS      commands that may fail (default: mutating ones)
+    FAKE_VBOX_HOST_CPUS          processors `list hostinfo` reports (default 8)
+    FAKE_VBOX_HOST_MEMORY_MB     memory `list hostinfo` reports (default 16384)
+    FAKE_VBOX_GUEST_ADDITIONS    0 leaves the Guest/RAM metrics out and guest properties unset,
+                                 as without Guest Additions
+    FAKE_VBOX_GUEST_RAM_USED_PERCENT  share of its memory each guest uses (default 25)
+    FAKE_VBOX_DISK_MB            size on disk `showmediuminfo` reports for an image
+                                 never compacted (default 2048); compacting keeps 60%
+"""
+import fcntl
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+MUTATING = {'createvm', 'modifyvm', 'storagectl', 'createmedium', 'storageattach', 'closemedium',
+            'startvm', 'controlvm', 'discardstate', 'unregistervm', 'clonevm', 'snapshot', 'modifymedium'}
+
+
+def env_float(name, default=0.0):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def fail(message, code=1):
+    sys.stderr.write(f'VBoxManage: error: {message}\n')
+    sys.exit(code)
+
+
+def option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args and args.index(name) + 1 < len(args) else default
+
+
+def find(state, ref):
+    if ref in state['vms']:
+        return ref
+    for name, vm in state['vms'].items():
+        if vm['uuid'] == ref:
+            return name
+    return None
+
+
+def print_long(name, vm):
+    print(f"Name:            {name}")
+    print(f"UUID:            {vm['uuid']}")
+    print(f"Memory size:     {vm['memory']}MB")
+    print(f"State:           {vm['state']} (since 2024-01-01T00:00:00.000000000)")
+    print()
+
+
+def main(args):
+    command = args[0] if args else ''
+
+    calls = os.environ.get('FAKE_VBOX_CALLS')
+    if calls:
+        with open(calls, 'a') as f:
+            f.write(' '.join(args[:2]) + '\n')
+
+    delay = env_float('FAKE_VBOX_LATENCY_MS') + random.uniform(0, env_float('FAKE_VBOX_LATENCY_JITTER_MS'))
+    delay += env_float(f'FAKE_VBOX_LATENCY_{command.upper()}_MS')
+    if delay:
+        time.sleep(delay / 1000.0)
+
+    fail_commands = os.environ.get('FAKE_VBOX_FAIL_COMMANDS')
+    fail_commands = set(fail_commands.split(',')) if fail_commands else MUTATING
+    if command in fail_commands and random.random() < env_float('FAKE_VBOX_FAIL_RATE'):
+        fail(f'injected failure for {command}')
+
+    path = os.environ['FAKE_VBOX_STATE']
+    with open(path, 'r+') as f:
+        # Readers share the file; anything that changes state holds it alone
+        fcntl.flock(f, fcntl.LOCK_EX if command in MUTATING else fcntl.LOCK_SH)
+        state = json.load(f)
+        changed = run(state, command, args)
+        if changed:
+            f.seek(0)
+            json.dump(state, f)
+            f.truncate()
+
+
+def run(state, command, args):
+    """Execute one command; returns True when the state has to be saved"""
+    vms = state['vms']
+
+    if command == 'list':
+        which = args[-1]
+        if which == 'hostinfo':
+            print(f"Processor online count: {os.environ.get('FAKE_VBOX_HOST_CPUS', 8)}")
+            print(f"Memory size: {os.environ.get('FAKE_VBOX_HOST_MEMORY_MB', 16384)} MByte")
+            return False
+        for name, vm in vms.items():
+            if which == 'vms' or vm['state'] == 'running':
+                if '-l' in args:
+                    print_long(name, vm)
+                else:
+                    print(f'"{name}" {{{vm["uuid"]}}}')
+        return False
+
+    if command == 'showvminfo':
+        name = find(state, args[1])
+        if not name:
+            fail(f"Could not find a registered machine named '{args[1]}'")
+        vm = vms[name]
+        folder = os.path.join(state.get('machine_folder', '/vms'), name)
+        print(f'name="{name}"')
+        print(f'UUID="{vm["uuid"]}"')
+        print(f'ostype="{vm.get("ostype", "Linux_64")}"')
+        print(f'CfgFile="{folder}/{name}.vbox"')
+        print(f'VMState="{vm["state"]}"')
+        print(f'memory={vm["memory"]}')
+        print(f'cpus={vm["cpus"]}')
+        print(f'"SATA Controller-0-0"="{folder}/{name}.vdi"')
+        return False
+
+    if command == 'metrics':
+        if args[1] == 'query':
+            print('Object          Metric                    Values')
+            print('--------------- ------------------------- ------')
+            for name, vm in vms.items():
+                if vm['state'] == 'running':
+                    print(f'{name} CPU/Load/User 12.50%')
+                    print(f'{name} CPU/Load/Kernel 2.50%')
+                    print(f'{name} RAM/Usage/Used {vm["memory"] * 512} kB')
+                    print(f'{name} Net/Rate/Rx 2048 B/s')
+                    print(f'{name} Net/Rate/Tx 1024 B/s')
+                    if os.environ.get('FAKE_VBOX_GUEST_ADDITIONS', '1') != '0':
+                        total = vm['memory'] * 1024
+                        used = total * env_float('FAKE_VBOX_GUEST_RAM_USED_PERCENT', 25) / 100
+                        balloon = vm.get('balloon', 0) * 1024
+                        print(f'{name} Guest/RAM/Usage/Total {total} kB')
+                        print(f'{name} Guest/RAM/Usage/Free {int(total - used - balloon)} kB')
+                        print(f'{name} Guest/RAM/Usage/Balloon {balloon} kB')
+        return False
+
+    if command == 'createvm':
+        name = option(args, '--name')
+        if name in vms:
+            fail(f"Machine settings file for '{name}' already exists")
+        vm_uuid = option(args, '--uuid') or str(uuid.uuid4())
+        vms[name] = {'uuid': vm_uuid, 'state': 'poweroff', 'memory': 1024, 'cpus': 1,
+                     'ostype': option(args, '--ostype', 'Linux_64')}
+        folder = os.path.join(state.get('machine_folder', '/vms'), name)
+        print(f"Virtual machine '{name}' is created and registered.")
+        print(f'UUID: {vm_uuid}')
+        print(f"Settings file: '{folder}/{name}.vbox'")
+        return True
+
+    if command in ('showmediuminfo', 'modifymedium'):
+        # `<command> disk <path>`: every VM has one image, <machine folder>/<name>/<name>.vdi
+        path = args[2] if len(args) > 2 else ''
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name not in vms:
+            fail(f"Could not find file for the medium '{path}'")
+        vm = vms[name]
+        size = vm.get('disk_mb', int(env_float('FAKE_VBOX_DISK_MB', 2048)))
+        if command == 'modifymedium':
+            if '--compact' in args:
+                vm['disk_mb'] = int(size * 0.6)
+                print('0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%')
+            if '--resize' in args:
+                if int(option(args, '--resize')) < vm.get('capacity_mb', 10240):
+                    fail('Shrinking is not yet supported for medium')
+                vm['capacity_mb'] = int(option(args, '--resize'))
+            return True
+        print(f'UUID:           {uuid.uuid5(uuid.NAMESPACE_URL, path)}')
+        print(f'Location:       {path}')
+        print('Storage format: VDI')
+        print('Format variant: dynamic default')
+        print(f"Capacity:       {vm.get('capacity_mb', 10240)} MBytes")
+        print(f'Size on disk:   {size} MBytes')
+        return False
+
+    if command in ('storagectl', 'createmedium', 'storageattach', 'closemedium', 'clonemedium', 'guestcontrol'):
+        # Accepted and ignored; the fake has no disks or guests
+        return False
+
+    if command == 'guestproperty':
+        # Only `guestproperty get <vm> <property>`: the Guest Additions set them while the VM runs
+        name = find(state, args[2]) if len(args) > 2 else None
+        if not name:
+            fail(f"Could not find a registered machine named '{args[2] if len(args) > 2 else ''}'")
+        additions = os.environ.get('FAKE_VBOX_GUEST_ADDITIONS', '1') != '0'
+        print('Value: 0' if additions and vms[name]['state'] == 'running' else 'No value set!')
+        return False
+
+    name = find(state, args[1]) if len(args) > 1 else None
+    if not name:
+        fail(f"Could not find a registered machine named '{args[1] if len(args) > 1 else ''}'")
+    vm = vms[name]
+
+    if command == 'modifyvm':
+        if '--memory' in args:
+            vm['memory'] = int(option(args, '--memory'))
+        if '--cpus' in args:
+            vm['cpus'] = int(option(args, '--cpus'))
+        if '--name' in args:
+            vms[option(args, '--name')] = vms.pop(name)
+        return True
+
+    if command == 'snapshot':
+        snapshots = vm.setdefault('snapshots', [])
+        if args[2] == 'list':
+            if not snapshots:
+                print('This machine does not have any snapshots')
+                sys.exit(1)
+            for n, snapshot in enumerate(snapshots):
+                print(f'SnapshotName{"-" + str(n) if n else ""}="{snapshot}"')
+            return False
+        if args[2] == 'take':
+            snapshots.append(args[3])
+            print('0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%')
+        return True
+
+    if command == 'clonevm':
+        new_name = option(args, '--name')
+        if new_name in vms:
+            fail(f"Machine settings file for '{new_name}' already exists")
+        snapshot = option(args, '--snapshot')
+        if snapshot and snapshot not in vm.get('snapshots', []):
+            fail(f"Could not find a snapshot named '{snapshot}'")
+        vms[new_name] = dict(vm, uuid=option(args, '--uuid') or str(uuid.uuid4()), state='poweroff', snapshots=[])
+        print('0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%')
+        print(f'Machine has been successfully cloned as "{new_name}"')
+        return True
+
+    if command == 'startvm':
+        if vm['state'] == 'running':
+            fail(f"The machine '{name}' is already locked for a session (or being unlocked)")
+        vm['state'] = 'running'
+        print(f'VM "{name}" has been successfully started.')
+        return True
+
+    if command == 'controlvm':
+        action = args[2] if len(args) > 2 else ''
+        if vm['state'] not in ('running', 'paused'):
+            fail(f"Machine '{name}' is not currently running")
+        if action == 'guestmemoryballoon':
+            vm['balloon'] = int(args[3])
+        vm['state'] = {'poweroff': 'poweroff', 'savestate': 'saved', 'pause': 'paused',
+                       'resume': 'running'}.get(action, vm['state'])
+        if vm['state'] == 'poweroff':
+            vm.pop('balloon', None)
+        return True
+
+    if command == 'discardstate':
+        if vm['state'] != 'saved':
+            fail(f"Machine '{name}' is not in the saved state")
+        vm['state'] = 'poweroff'
+        vm.pop('balloon', None)
+        return True
+
+    if command == 'unregistervm':
+        del vms[name]
+        return True
+
+    fail(f"Unknown command '{command}'")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
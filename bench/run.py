@@ -0,0 +1,360 @@
+"""Run load scenarios against the app with a fake VBoxManage on PATH
+
+    python bench/run.py --fleet 1k --concurrency 8 --requests 200
+    python bench/run.py --fleet 10 --scenarios create,clone --latency-ms 50 --fail-rate 0.05
+    python bench/run.py --fleet 1k --scenarios create --agents 2
+
+Each run seeds a fresh database and fake VirtualBox state in a temporary
+directory, serves the app on a local port and writes one JSON file to
+bench/results/ (compare two with bench/compare.py).
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+SCENARIOS = ['index', 'details', 'stats', 'create', 'clone']
+
+
+class SpawnCounter:
+    """Count every child process the app starts (VBoxManage, bash, ...)"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def install(self):
+        counter = self
+        original = subprocess.Popen
+
+        class CountingPopen(original):
+            def __init__(self, *args, **kwargs):
+                with counter._lock:
+                    counter.count += 1
+                super().__init__(*args, **kwargs)
+
+        subprocess.Popen = CountingPopen
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list, in the list's units"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    """p50/p95/p99/max/mean of latencies in seconds, reported in milliseconds"""
+    if not values:
+        return None
+    ms = [v * 1000 for v in values]
+    return {
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'max_ms': round(max(ms), 3),
+        'mean_ms': round(sum(ms) / len(ms), 3),
+    }
+
+
+def count_lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return sum(1 for _ in f)
+
+
+def install_fake_vboxmanage(workdir):
+    """Put a VBoxManage wrapper for fake_vboxmanage.py first on PATH"""
+    bin_dir = os.path.join(workdir, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    wrapper = os.path.join(bin_dir, 'VBoxManage')
+    with open(wrapper, 'w') as f:
+        f.write('#!/bin/sh\n')
+        f.write(f'exec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_vboxmanage.py")}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+
+
+def start_agents(count, workdir, env):
+    """Start `count` node agents on loopback ports, each with its own fake VirtualBox
+
+    Returns [(name, url, process)]; the caller registers and stops them.
+    """
+    agents = []
+    for i in range(1, count + 1):
+        name = f'agent-{i}'
+        state_path = os.path.join(workdir, f'{name}.json')
+        with open(state_path, 'w') as f:
+            json.dump({'machine_folder': os.path.join(workdir, name), 'vms': {}}, f)
+        process = subprocess.Popen(
+            [sys.executable, '-u', os.path.join(ROOT_DIR, 'agent.py'), '--port', '0', '--name', name],
+            cwd=ROOT_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+            env=dict(env, FAKE_VBOX_STATE=state_path),
+        )
+        line = process.stdout.readline().strip()
+        if ' listening on ' not in line:
+            process.kill()
+            sys.exit(f"Agent {name} did not start: {line or process.stdout.read()}")
+        # Keep draining the pipe so a chatty agent never blocks on a full buffer
+        threading.Thread(target=process.stdout.read, daemon=True).start()
+        agents.append((name, line.rsplit(' ', 1)[-1], process))
+    return agents
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as they are; the app redirects when a form action fails"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+opener = urllib.request.build_opener(NoRedirect)
+
+
+class Bench:
+    def __init__(self, app_module, base_url, vm_ids, spawns, calls_file):
+        self.app = app_module
+        self.base_url = base_url
+        self.vm_ids = vm_ids
+        self.spawns = spawns
+        self.calls_file = calls_file
+        self.rng = random.Random(7)
+        self._clone_sources = iter(())
+        self._lock = threading.Lock()
+
+    def request(self, path, data=None):
+        """Return (status, parsed JSON body or None)"""
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, headers={'Accept': 'application/json'})
+        try:
+            with opener.open(req, timeout=120) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            return status, None
+
+    def random_vm(self):
+        with self._lock:
+            return self.rng.choice(self.vm_ids)
+
+    def next_clone_source(self):
+        # Round robin, so concurrent clones rarely pick a VM that is already busy
+        with self._lock:
+            try:
+                return next(self._clone_sources)
+            except StopIteration:
+                self._clone_sources = iter(list(self.vm_ids))
+                return next(self._clone_sources)
+
+    def scenario_request(self, scenario):
+        """Issue one request; returns (status, job_id or None)"""
+        if scenario == 'index':
+            return self.request('/')[0], None
+        if scenario == 'details':
+            return self.request(f'/vm/details/{self.random_vm()}')[0], None
+        if scenario == 'stats':
+            return self.request(f'/api/vm/{self.random_vm()}/stats')[0], None
+        if scenario == 'create':
+            status, body = self.request('/create', {
+                'name': f'bench-new-{uuid.uuid4().hex[:10]}', 'os_type': 'Ubuntu',
+                'cpu': '1', 'ram': '1024', 'storage': '10000', 'services': ['nginx', 'git'],
+            })
+            return status, (body or {}).get('job_id')
+        if scenario == 'clone':
+            status, body = self.request(f'/vm/clone/{self.next_clone_source()}',
+                                        {'new_name': f'bench-clone-{uuid.uuid4().hex[:10]}'})
+            return status, (body or {}).get('job_id')
+        raise ValueError(f'Unknown scenario: {scenario}')
+
+    def run(self, scenario, total, concurrency):
+        spawns_before = self.spawns.count
+        calls_before = count_lines(self.calls_file)
+        latencies, completions, statuses, failed_jobs = [], [], {}, []
+
+        def one(_):
+            started = time.perf_counter()
+            status, job_id = self.scenario_request(scenario)
+            latency = time.perf_counter() - started
+            completion = None
+            if job_id:
+                # Background work is part of what create/clone cost
+                job = self.app.job_manager.wait(job_id)
+                completion = time.perf_counter() - started
+                if job['status'] != 'succeeded':
+                    failed_jobs.append(job_id)
+            return status, latency, completion
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for status, latency, completion in executor.map(one, range(total)):
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                latencies.append(latency)
+                if completion is not None:
+                    completions.append(completion)
+        elapsed = time.perf_counter() - started
+
+        errors = sum(n for status, n in statuses.items() if not (status.startswith('2') or status == '304'))
+        result = {
+            'requests': total,
+            'concurrency': concurrency,
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+            'status_codes': statuses,
+            'errors': errors,
+            'latency': summarize(latencies),
+            'spawns_per_request': round((self.spawns.count - spawns_before) / total, 3),
+            'vboxmanage_calls_per_request': round((count_lines(self.calls_file) - calls_before) / total, 3),
+        }
+        if completions:
+            result['completion'] = summarize(completions)
+            result['failed_jobs'] = len(failed_jobs)
+        return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fleet', default='1k', help='fleet size: 10, 1k, 10k or a number')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='requests per read scenario')
+    parser.add_argument('--write-requests', type=int, default=20, help='requests per create/clone scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='fake VBoxManage delay per call')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='extra random delay per call')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of mutating calls that fail')
+    parser.add_argument('--background-interval', type=float, default=3600,
+                        help='interval of the stats, reconcile and pool threads; high keeps them out of the numbers')
+    parser.add_argument('--agents', type=int, default=0,
+                        help='also start this many node agents on loopback, each with an empty fake VirtualBox')
+    parser.add_argument('--out', default=os.path.join(BENCH_DIR, 'results'), help='directory for the JSON result')
+    parser.add_argument('--verbose', action='store_true', help="show the app's own output")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    workdir = tempfile.mkdtemp(prefix='vsm-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    state_path = os.path.join(workdir, 'vbox.json')
+    calls_file = os.path.join(workdir, 'calls.log')
+
+    # Everything the app reads at import time has to be in place before
+    # db (imported by seed) or app are imported
+    install_fake_vboxmanage(workdir)
+    os.environ.update({
+        'VSM_DATABASE': db_path,
+        'VSM_LOG_DIR': os.path.join(workdir, 'logs'),
+        'FAKE_VBOX_STATE': state_path,
+        'FAKE_VBOX_CALLS': calls_file,
+        'FAKE_VBOX_LATENCY_MS': str(args.latency_ms),
+        'FAKE_VBOX_LATENCY_JITTER_MS': str(args.jitter_ms),
+        'FAKE_VBOX_FAIL_RATE': str(args.fail_rate),
+        'VSM_STATS_INTERVAL': str(args.background_interval),
+        'VSM_RECONCILE_INTERVAL': str(args.background_interval),
+        'VSM_POOL_INTERVAL': str(args.background_interval),
+        # The seeded fleet is far bigger than any real host; keep admission
+        # control from queueing every create
+        'VSM_HOST_CPUS': str(10 ** 6),
+        'VSM_HOST_RAM_MB': str(10 ** 9),
+        'VSM_BOOT_STAGGER': '0',
+        'VSM_BOOT_CONCURRENCY': str(args.concurrency),
+    })
+    import db
+    import seed
+    if os.path.abspath(db.DATABASE) != db_path:
+        sys.exit(f"Refusing to run: the app would use {db.DATABASE}, not the benchmark database")
+
+    vm_count = seed.seed(seed.fleet_size(args.fleet), db_path, state_path)
+    print(f"Seeded {vm_count} VMs in {workdir}")
+
+    spawns = SpawnCounter()
+    spawns.install()
+
+    console = sys.stdout
+    if not args.verbose:
+        # The app prints every job and script; keep only the summaries
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        sys.stdout = open(os.devnull, 'w')
+
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    app_module.init_db()
+    agents = start_agents(args.agents, workdir, dict(os.environ, FAKE_VBOX_HOST_CPUS=str(10 ** 6),
+                                                      FAKE_VBOX_HOST_MEMORY_MB=str(10 ** 9)))
+    for name, url, _ in agents:
+        app_module.host_registry.register(name, url)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    vm_ids = list(range(1, vm_count + 1))
+    bench = Bench(app_module, base_url, vm_ids, spawns, calls_file)
+
+    # Let the background threads start and take their first samples
+    bench.request('/')
+    app_module.stats_collector.refresh()
+    app_module.reconciler.reconcile_once()
+
+    results = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'fleet': args.fleet,
+        'vms': vm_count,
+        'agents': args.agents,
+        'fake_vboxmanage': {'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'fail_rate': args.fail_rate},
+        'scenarios': {},
+    }
+    for scenario in scenarios:
+        total = args.write_requests if scenario in ('create', 'clone') else args.requests
+        print(f"Running {scenario}: {total} requests, concurrency {args.concurrency}...", file=console)
+        outcome = bench.run(scenario, total, args.concurrency)
+        results['scenarios'][scenario] = outcome
+        latency = outcome['latency']
+        print(f"  p50 {latency['p50_ms']} ms  p95 {latency['p95_ms']} ms  p99 {latency['p99_ms']} ms  "
+              f"{outcome['throughput_rps']} req/s  {outcome['spawns_per_request']} spawns/req  "
+              f"{outcome['errors']} errors", file=console)
+
+    server.shutdown()
+    for _, _, process in agents:
+        process.terminate()
+    os.makedirs(args.out, exist_ok=True)
+    out_file = os.path.join(args.out, f"{time.strftime('%Y%m%d-%H%M%S')}-{args.fleet}.json")
+    with open(out_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out_file}", file=console)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Seed a benchmark database and matching fake VirtualBox state
+
+    python bench/seed.py --vms 1000 --db /tmp/bench.db --state /tmp/vbox.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+FLEETS = {'10': 10, '1k': 1000, '10k': 10000}
+
+OS_TYPES = [('Ubuntu', 'Ubuntu_64'), ('Debian', 'Debian_64'), ('CentOS', 'RedHat_64')]
+SERVICES = ['nginx', 'apache', 'mysql', 'postgresql', 'docker', 'git', 'python3', 'nodejs']
+
+
+def fleet_size(fleet):
+    """Accept 10 / 1k / 10k or a plain number"""
+    return FLEETS.get(fleet) or int(fleet)
+
+
+def seed(count, db_path, state_path, running_ratio=0.3, seed_value=42):
+    """Create db_path with `count` instances and the fake VirtualBox state for them"""
+    rng = random.Random(seed_value)
+    for path in (db_path, db_path + '-wal', db_path + '-shm', state_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    conn = db.connect(db_path)
+    db.migrate(conn)
+
+    vms = {}
+    instances, services, users = [], [], []
+    for i in range(count):
+        name = f'bench-vm-{i:05d}'
+        os_type, vbox_type = rng.choice(OS_TYPES)
+        cpus = rng.choice([1, 2, 4])
+        memory = rng.choice([512, 1024, 2048, 4096])
+        running = rng.random() < running_ratio
+        vm_uuid = str(uuid.UUID(int=rng.getrandbits(128)))
+        # Spread creation times so keyset pages have realistic ordering
+        created_at = f'2024-{1 + i * 12 // max(count, 1):02d}-01 00:00:{i % 60:02d}'
+        instances.append((i + 1, name, os_type, cpus, memory, 10000,
+                          'running' if running else 'stopped', vm_uuid, created_at))
+        for service in rng.sample(SERVICES, rng.randint(0, 3)):
+            services.append((i + 1, service))
+        if rng.random() < 0.5:
+            users.append((i + 1, f'user{i}', rng.random() < 0.5))
+        vms[name] = {'uuid': vm_uuid, 'state': 'running' if running else 'poweroff',
+                     'memory': memory, 'cpus': cpus, 'ostype': vbox_type}
+
+    conn.executemany(
+        '''INSERT INTO instances (id, name, os_type, cpu_cores, ram_size, storage_size, status, vm_uuid, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        instances
+    )
+    conn.executemany('INSERT INTO services (instance_id, service_name) VALUES (?, ?)', services)
+    conn.executemany('INSERT INTO vm_users (instance_id, username, has_sudo) VALUES (?, ?, ?)', users)
+    conn.commit()
+    conn.close()
+
+    with open(state_path, 'w') as f:
+        json.dump({'machine_folder': os.path.join(os.path.dirname(state_path), 'vms'), 'vms': vms}, f)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vms', default='1k', help='fleet size: 10, 1k, 10k or a number')
+    parser.add_argument('--db', required=True, help='SQLite database to create')
+    parser.add_argument('--state', required=True, help='fake VBoxManage state file to create')
+    parser.add_argument('--running', type=float, default=0.3, help='share of VMs that are running')
+    args = parser.parse_args()
+
+    count = seed(fleet_size(args.vms), args.db, args.state, args.running)
+    print(f"Seeded {count} VMs into {args.db} and {args.state}")
+
+
+if __name__ == '__main__':
+    main()
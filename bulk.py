@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import oplog
+
+# Default parallelism per action; deletes are the heaviest on the host disk
+DEFAULT_LIMITS = {'start': 4, 'stop': 8, 'delete': 2}
+
+
+class BulkRunner:
+    """Run one lifecycle action against many VMs on a bounded thread pool
+
+    Each action has its own concurrency limit, shared by every bulk request
+    in the process, so a mass delete cannot starve a mass start.
+    """
+
+    def __init__(self, perform, limits=None, max_workers=16):
+        # perform(action, vm) runs the action for one VM and returns a
+        # run_shell_script()-style result dict
+        self.perform = perform
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self._semaphores = {action: threading.BoundedSemaphore(limit)
+                            for action, limit in self.limits.items()}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='vsm-bulk')
+
+    def _run_one(self, action, vm):
+        with self._semaphores[action]:
+            try:
+                result = self.perform(action, vm)
+            except Exception as e:
+                result = {'success': False, 'message': str(e)}
+        entry = {'id': vm['id'], 'name': vm['name'], 'success': bool(result.get('success'))}
+        if not entry['success']:
+            entry['error'] = result.get('stderr') or result.get('message') or result.get('stdout') or 'Unknown error'
+        return entry
+
+    def run(self, action, vms):
+        """Run action for every VM; returns one result per VM, in input order
+
+        A failure for one VM is recorded in its result and never stops the rest.
+        """
+        if action not in self._semaphores:
+            raise ValueError(f'Unsupported bulk action: {action}')
+        run_one = oplog.bind(self._run_one)
+        futures = [self._executor.submit(run_one, action, vm) for vm in vms]
+        return [future.result() for future in futures]
@@ -0,0 +1,153 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import telemetry
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Absolute by default so the app works from any working directory
+DATABASE = os.environ.get('VSM_DATABASE', os.path.join(BASE_DIR, 'database.db'))
+MIGRATIONS_DIR = os.path.join(BASE_DIR, 'migrations')
+
+# Applied to every connection. journal_mode=WAL is stored in the database
+# file itself; the others only last for the connection.
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+]
+
+MIGRATION_FILE_RE = re.compile(r'^(\d+)_.*\.sql$')
+
+_local = threading.local()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that reports every statement and commit to telemetry
+
+    execute() returns once SQLite has produced the first row, so for large
+    SELECTs the time spent in fetchall() is not included.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            telemetry.record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            telemetry.record_query(sql, time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            telemetry.record_query('SCRIPT', time.perf_counter() - started)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            telemetry.record_query('COMMIT', time.perf_counter() - started)
+
+
+def connect(path=None):
+    """Open a new configured connection; most code should use get_connection()"""
+    conn = sqlite3.connect(path or DATABASE, timeout=5, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    """Return this thread's connection, opening it on first use
+
+    The connection is reused for the lifetime of the thread, so callers must
+    not close it. Call release() when a unit of work is done.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
+
+
+def release():
+    """Roll back anything the current thread left uncommitted"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def close_connection():
+    """Close this thread's connection (e.g. before the thread exits)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def list_migrations():
+    """Return [(version, path)] for every file in migrations/, in order"""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+
+def _columns(conn, table):
+    return [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _upgrade_legacy_schema(conn):
+    """Bring databases created from the old schema.sql in line with migration 1
+
+    schema.sql named the foreign key column vm_id and had no vm_uuid column.
+    """
+    for table in ('services', 'vm_users'):
+        if 'vm_id' in _columns(conn, table):
+            conn.execute(f'ALTER TABLE {table} RENAME COLUMN vm_id TO instance_id')
+    columns = _columns(conn, 'instances')
+    if columns and 'vm_uuid' not in columns:
+        conn.execute('ALTER TABLE instances ADD COLUMN vm_uuid TEXT')
+    conn.commit()
+
+
+def migrate(conn=None):
+    """Apply pending migrations; returns the schema version afterwards"""
+    conn = conn or get_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version == 0:
+        _upgrade_legacy_schema(conn)
+
+    for number, path in list_migrations():
+        if number <= version:
+            continue
+        with open(path) as f:
+            script = f.read()
+        print(f"Applying migration {os.path.basename(path)}")
+        try:
+            # executescript() commits first, so the transaction is explicit;
+            # user_version is transactional and moves with the schema change
+            conn.executescript(f'BEGIN IMMEDIATE;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        version = number
+    return version
@@ -0,0 +1,94 @@
+import collections
+import json
+import threading
+import time
+
+
+class EventBroadcaster:
+    """Fan samples out to any number of Server-Sent Events subscribers
+
+    Every published event is serialized once and kept in a bounded backlog,
+    so a reconnecting client can send Last-Event-ID and receive what it
+    missed. Event ids start from the current time in milliseconds, which
+    keeps them increasing across application restarts.
+    """
+
+    def __init__(self, backlog=2000, keepalive=15.0):
+        self.keepalive = keepalive
+        self._events = collections.deque(maxlen=backlog)
+        self._next_id = int(time.time() * 1000)
+        self._subscribers = 0
+        self._cond = threading.Condition()
+
+    @property
+    def subscribers(self):
+        """Streams open right now"""
+        return self._subscribers
+
+    def publish(self, topic, data, event='stats'):
+        """Record an event for `topic` (a VM name) and wake every subscriber"""
+        payload = json.dumps(data, default=str)
+        with self._cond:
+            event_id = self._next_id
+            self._next_id += 1
+            self._events.append((event_id, topic, event, payload))
+            self._cond.notify_all()
+        return event_id
+
+    def _after(self, last_id, topic):
+        return [e for e in self._events if e[0] > last_id and (topic is None or e[1] == topic)]
+
+    def _snapshot(self, topic):
+        """Newest event per topic plus the newest id overall"""
+        newest = {}
+        for event in self._events:
+            if topic is None or event[1] == topic:
+                newest[event[1]] = event
+        last_id = self._events[-1][0] if self._events else 0
+        return sorted(newest.values()), last_id
+
+    def stream(self, topic=None, last_id=None, retry_ms=3000, until=None):
+        """Generate SSE frames for one subscriber until the client goes away
+
+        Without a Last-Event-ID the stream opens with the newest event for
+        every matching topic, so a new page shows current values at once.
+        The stream also ends after sending an event of type `until`.
+        """
+        with self._cond:
+            self._subscribers += 1
+        try:
+            yield from self._stream(topic, last_id, retry_ms, until)
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    def _stream(self, topic, last_id, retry_ms, until):
+        if last_id is None:
+            with self._cond:
+                initial, last_id = self._snapshot(topic)
+        else:
+            initial = []
+
+        yield f'retry: {retry_ms}\n\n'
+        for event_id, _, event, payload in initial:
+            yield f'id: {event_id}\nevent: {event}\ndata: {payload}\n\n'
+            if event == until:
+                return
+
+        while True:
+            with self._cond:
+                pending = self._after(last_id, topic)
+                if not pending:
+                    self._cond.wait(self.keepalive)
+                    pending = self._after(last_id, topic)
+
+            if not pending:
+                # Comment frame keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                continue
+
+            for event_id, _, event, payload in pending:
+                last_id = event_id
+                yield f'id: {event_id}\nevent: {event}\ndata: {payload}\n\n'
+                if event == until:
+                    return
@@ -0,0 +1,299 @@
+import json
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import oplog
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Desired power state of a VM; leaving it out keeps whatever state the VM is in
+POWER_STATES = ('running', 'stopped')
+
+# Status a VM is in -> lifecycle action that brings it to the wanted power state
+STATE_ACTIONS = {
+    'running': {'stopped': 'start', 'suspended': 'resume'},
+    'stopped': {'running': 'stop', 'suspended': 'stop'},
+}
+
+CLONE_MODES = ('full', 'linked')
+
+# "web-{n}" with "count": 3 -> web-1, web-2, web-3
+COUNT_RE = re.compile(r'\{n(?::(?P<width>\d+))?\}')
+
+
+class SpecError(ValueError):
+    """Raised for a fleet spec that cannot be planned"""
+
+
+def load_spec(text, fmt='json'):
+    """Parse a JSON (or, with PyYAML installed, YAML) fleet spec into normalize()'s form"""
+    if fmt == 'yaml':
+        if yaml is None:
+            raise SpecError('YAML specs need PyYAML (pip install pyyaml); send the spec as JSON instead')
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise SpecError(f'Invalid YAML: {e}')
+    else:
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise SpecError(f'Invalid JSON: {e}')
+    return normalize(data)
+
+
+def _positive_int(entry, key):
+    value = entry.get(key)
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise SpecError(f'{entry.get("name")}: "{key}" must be a positive integer')
+    return value
+
+
+def _expand(entry):
+    """One spec entry -> the VM names it stands for"""
+    count = entry.get('count')
+    if count is None:
+        return [entry['name']]
+    if isinstance(count, bool) or not isinstance(count, int) or count <= 0:
+        raise SpecError(f'{entry["name"]}: "count" must be a positive integer')
+    if not COUNT_RE.search(entry['name']):
+        raise SpecError(f'{entry["name"]}: a name with "count" needs a {{n}} placeholder')
+    return [COUNT_RE.sub(lambda m: str(n).zfill(int(m.group('width') or 0)), entry['name'])
+            for n in range(1, count + 1)]
+
+
+def normalize(data):
+    """Check a spec and expand it into {'vms': [...], 'concurrency': n or None}
+
+    A spec is {"defaults": {...}, "concurrency": n, "vms": [...]}. Each VM
+    entry has name, os, cpu, ram and storage (or clone_of, a VM in the spec
+    or the database, to copy those from), optional services, users
+    ([{username, password, sudo}]), state (running or stopped) and
+    depends_on (names of VMs or of entries with a count). Keys in defaults
+    apply to every entry that does not set them.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('vms'), list):
+        raise SpecError('A fleet spec is an object with a "vms" list')
+    defaults = data.get('defaults') or {}
+    if not isinstance(defaults, dict):
+        raise SpecError('"defaults" must be an object')
+    concurrency = data.get('concurrency')
+    if concurrency is not None and (isinstance(concurrency, bool) or not isinstance(concurrency, int)
+                                    or concurrency <= 0):
+        raise SpecError('"concurrency" must be a positive integer')
+
+    vms, groups = [], {}
+    for raw in data['vms']:
+        if not isinstance(raw, dict) or not isinstance(raw.get('name'), str) or not raw['name'].strip():
+            raise SpecError('Every VM needs a "name"')
+        entry = dict(defaults, **raw)
+        entry['name'] = entry['name'].strip()
+
+        clone_of = entry.get('clone_of')
+        if clone_of is not None and not isinstance(clone_of, str):
+            raise SpecError(f'{entry["name"]}: "clone_of" must be a VM name')
+        mode = entry.get('clone_mode', 'full')
+        if mode not in CLONE_MODES:
+            raise SpecError(f'{entry["name"]}: "clone_mode" must be one of: {", ".join(CLONE_MODES)}')
+        shape = {}
+        if not clone_of:
+            if not isinstance(entry.get('os'), str):
+                raise SpecError(f'{entry["name"]}: "os" is required unless the VM is a clone')
+            shape = {'os': entry['os'], 'cpu': _positive_int(entry, 'cpu'), 'ram': _positive_int(entry, 'ram'),
+                     'storage': _positive_int(entry, 'storage')}
+
+        services = entry.get('services') or []
+        if not isinstance(services, list) or not all(isinstance(s, str) and s for s in services):
+            raise SpecError(f'{entry["name"]}: "services" must be a list of service names')
+        users = []
+        for user in entry.get('users') or []:
+            if not isinstance(user, dict) or not user.get('username') or not user.get('password'):
+                raise SpecError(f'{entry["name"]}: every user needs a "username" and a "password"')
+            users.append({'username': str(user['username']), 'password': str(user['password']),
+                          'sudo': bool(user.get('sudo', False))})
+        state = entry.get('state')
+        if state is not None and state not in POWER_STATES:
+            raise SpecError(f'{entry["name"]}: "state" must be one of: {", ".join(POWER_STATES)}')
+        depends_on = entry.get('depends_on') or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+
+        names = _expand(entry)
+        groups[entry['name']] = names
+        for name in names:
+            vms.append(dict(shape, name=name, clone_of=clone_of, clone_mode=mode, services=list(dict.fromkeys(services)),
+                            users=users, state=state, depends_on=list(depends_on)))
+
+    seen = set()
+    for vm in vms:
+        if vm['name'] in seen:
+            raise SpecError(f'{vm["name"]} appears twice in the spec')
+        seen.add(vm['name'])
+    for vm in vms:
+        # A clone waits for its source when the source is part of the spec too
+        needs = vm['depends_on'] + ([vm['clone_of']] if vm['clone_of'] in seen else [])
+        resolved = []
+        for name in needs:
+            if name not in seen and name not in groups:
+                raise SpecError(f'{vm["name"]} depends on {name}, which is not in the spec')
+            resolved.extend(groups.get(name, [name]) if name not in seen else [name])
+        vm['depends_on'] = [name for name in dict.fromkeys(resolved) if name != vm['name']]
+    order(vms)
+    return {'vms': vms, 'concurrency': concurrency}
+
+
+def order(vms):
+    """VM names in an order where every VM comes after what it depends on; SpecError on a cycle"""
+    pending = {vm['name']: set(vm['depends_on']) for vm in vms}
+    ordered = []
+    while pending:
+        ready = [name for name, needs in pending.items() if not needs]
+        if not ready:
+            raise SpecError(f'Dependency cycle between {", ".join(sorted(pending))}')
+        for name in ready:
+            del pending[name]
+            ordered.append(name)
+        for needs in pending.values():
+            needs.difference_update(ready)
+    return ordered
+
+
+def diff(conn, vm, busy=False):
+    """What it takes to bring one VM in line with its spec entry
+
+    Returns {name, id, action, services, users, state, drift}: action is
+    create, clone, update or none; services and users are what to queue
+    (missing, or only failed so far); state is the lifecycle action the
+    power state needs; drift lists shape differences apply cannot change.
+    Pending items count as on their way only while busy (a job is working
+    on the VM); otherwise nothing will ever run them, so they are queued again.
+    """
+    row = conn.execute('SELECT * FROM instances WHERE name = ?', (vm['name'],)).fetchone()
+    change = {'name': vm['name'], 'id': row['id'] if row else None, 'services': [], 'users': [],
+              'state': None, 'drift': {}}
+    if row is None:
+        change['action'] = 'clone' if vm['clone_of'] else 'create'
+        change['services'] = list(vm['services'])
+        change['users'] = [user['username'] for user in vm['users']]
+        change['state'] = 'start' if vm['state'] == 'running' else None
+        return change
+
+    services = {}
+    for item in conn.execute('SELECT service_name, status FROM services WHERE instance_id = ?', (row['id'],)):
+        services.setdefault(item['service_name'], set()).add(item['status'])
+    users = {}
+    for item in conn.execute('SELECT username, status FROM vm_users WHERE instance_id = ?', (row['id'],)):
+        users.setdefault(item['username'], set()).add(item['status'])
+    # Anything but a failure (or a stale pending item) is there or on its way
+    missing = {'failed'} if busy else {'failed', 'pending'}
+    change['services'] = [name for name in vm['services'] if not services.get(name, missing) - missing]
+    change['users'] = [user['username'] for user in vm['users']
+                       if not users.get(user['username'], missing) - missing]
+    if vm['state']:
+        change['state'] = STATE_ACTIONS[vm['state']].get(row['status'])
+    if not vm['clone_of']:
+        for key, column in (('os', 'os_type'), ('cpu', 'cpu_cores'), ('ram', 'ram_size'), ('storage', 'storage_size')):
+            if str(row[column]) != str(vm[key]):
+                change['drift'][key] = {'have': row[column], 'want': vm[key]}
+    change['action'] = 'update' if change['services'] or change['users'] or change['state'] else 'none'
+    return change
+
+
+def queue_items(conn, provisioner, instance_id, vm, change):
+    """Queue the services and users diff() found missing; returns how many were queued"""
+    # Failed and stale pending rows are replaced by the new ones
+    for name in change['services']:
+        conn.execute("DELETE FROM services WHERE instance_id = ? AND service_name = ? AND status IN ('failed', 'pending')",
+                     (instance_id, name))
+        provisioner.queue_service(conn, instance_id, name)
+    for user in vm['users']:
+        if user['username'] in change['users']:
+            conn.execute("DELETE FROM vm_users WHERE instance_id = ? AND username = ? AND status IN ('failed', 'pending')",
+                         (instance_id, user['username']))
+            provisioner.queue_user(conn, instance_id, user['username'], user['password'], user['sudo'])
+    conn.commit()
+    return len(change['services']) + len(change['users'])
+
+
+def plan(conn, spec, busy=None):
+    """Every VM's diff in dependency order, with totals; nothing is changed
+
+    busy(instance_id) tells whether a job is working on a VM (see diff).
+    """
+    ordered = order(spec['vms'])
+    by_name = {vm['name']: vm for vm in spec['vms']}
+    changes = []
+    for name in ordered:
+        vm = by_name[name]
+        row = conn.execute('SELECT id FROM instances WHERE name = ?', (name,)).fetchone()
+        change = diff(conn, vm, busy=bool(row and busy and busy(row['id'])))
+        if vm['clone_of'] and vm['clone_of'] not in by_name and change['action'] == 'clone':
+            if not conn.execute('SELECT id FROM instances WHERE name = ?', (vm['clone_of'],)).fetchone():
+                raise SpecError(f'{name}: clone source {vm["clone_of"]} is neither in the spec nor in the database')
+        change['depends_on'] = vm['depends_on']
+        changes.append(change)
+    counts = {}
+    for change in changes:
+        counts[change['action']] = counts.get(change['action'], 0) + 1
+    spec_names = set(by_name)
+    others = [row['name'] for row in conn.execute('SELECT name FROM instances ORDER BY name')
+              if row['name'] not in spec_names]
+    return {
+        'changes': changes,
+        'summary': counts,
+        'to_change': sum(1 for change in changes if change['action'] != 'none'),
+        'drift': [change['name'] for change in changes if change['drift']],
+        'not_in_spec': others,
+    }
+
+
+class FleetRunner:
+    """Apply a fleet spec as a dependency graph on a bounded thread pool
+
+    Each VM runs as soon as everything it depends on has finished, at most
+    `concurrency` at a time per apply and `max_parallel` across all applies
+    in the process. A VM whose dependency failed is skipped, never tried.
+    """
+
+    def __init__(self, apply_vm, max_parallel=8):
+        # apply_vm(vm) brings one spec VM in line and returns a result dict
+        self.apply_vm = apply_vm
+        self.max_parallel = max_parallel
+        self._slots = threading.BoundedSemaphore(max_parallel)
+
+    def _run_one(self, vm):
+        with self._slots:
+            try:
+                result = self.apply_vm(vm)
+            except Exception as e:
+                result = {'success': False, 'message': str(e)}
+        return dict(result, name=vm['name'], success=bool(result.get('success')))
+
+    def run(self, spec, concurrency=None):
+        """Apply every VM of a normalized spec; returns one result per VM, in dependency order"""
+        vms = {vm['name']: vm for vm in spec['vms']}
+        waiting = {name: set(vm['depends_on']) for name, vm in vms.items()}
+        results = {}
+        run_one = oplog.bind(self._run_one)
+        workers = min(concurrency or spec.get('concurrency') or self.max_parallel, self.max_parallel)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vsm-fleet') as pool:
+            running = {}
+            while waiting or running:
+                for name in [name for name, needs in waiting.items() if not needs - set(results)]:
+                    del waiting[name]
+                    failed = [dep for dep in vms[name]['depends_on'] if not results[dep]['success']]
+                    if failed:
+                        results[name] = {'name': name, 'success': False, 'skipped': True,
+                                         'message': f'Skipped: {", ".join(failed)} failed'}
+                    else:
+                        running[pool.submit(run_one, vms[name])] = name
+                if not running:
+                    continue  # skips made more VMs ready
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return [results[name] for name in order(spec['vms'])]
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from metrics import covers
+
+
+class IdleHibernator:
+    """Suspend running VMs that have been idle for `idle_seconds`
+
+    A VM is idle when every CPU sample of the window is below
+    `cpu_percent` and its network traffic stays below `net_bps` bytes per
+    second, judged from the history the stats collector keeps (`store`,
+    a metrics.MetricsStore). VMs without history for the whole window,
+    VMs that have been running for less than the window and VMs with
+    auto_suspend = 0 are never suspended. The idle VMs using the most
+    memory go first, at most `limit` per cycle. suspend(vm) queues the
+    actual work and returns a job id, or None if the VM is busy.
+    """
+
+    def __init__(self, connect, store, suspend, idle_seconds=0, cpu_percent=5.0, net_bps=10240.0,
+                 interval=60.0, limit=4):
+        self.connect = connect
+        self.store = store
+        self.suspend = suspend
+        self.idle_seconds = idle_seconds
+        self.cpu_percent = cpu_percent
+        self.net_bps = net_bps
+        self.interval = interval
+        self.limit = limit
+        self._last_check = None
+        self._suspended = 0
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.idle_seconds > 0
+
+    def ensure_started(self):
+        """Start the idle check thread if the policy is on and it is not running yet"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='vsm-hibernate', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"Idle hibernation error: {str(e)}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def idle_usage(self, name):
+        """Memory in use (MB) if the VM was idle for the whole window, else None"""
+        history = self.store.history(name, self.idle_seconds, ['cpu', 'memory_used_mb', 'net_rx', 'net_tx'])
+        if not covers(history, self.idle_seconds):
+            return None  # not sampled for long enough to tell
+        points = history['series']
+        if any(cpu is None or cpu >= self.cpu_percent for cpu in points['cpu']):
+            return None
+        if any((rx or 0) + (tx or 0) >= self.net_bps for rx, tx in zip(points['net_rx'], points['net_tx'])):
+            return None
+        used = [mb for mb in points['memory_used_mb'] if mb is not None]
+        return used[-1] if used else 0
+
+    def candidates(self):
+        """Running VMs that are idle now, the ones holding the most memory first"""
+        rows = self.connect().execute(
+            '''SELECT id, name, host_id, ram_size FROM instances
+               WHERE status = 'running' AND auto_suspend = 1
+                 AND (status_changed_at IS NULL OR status_changed_at <= datetime('now', ?))''',
+            (f'-{int(self.idle_seconds)} seconds',)
+        ).fetchall()
+        idle = []
+        for row in rows:
+            used = self.idle_usage(row['name'])
+            if used is not None:
+                idle.append(dict(row, memory_used_mb=used))
+        idle.sort(key=lambda vm: (vm['memory_used_mb'], vm['ram_size'] or 0), reverse=True)
+        return idle
+
+    def check_once(self):
+        """Queue suspends for idle VMs; returns the ids that were queued"""
+        if not self.enabled:
+            return []
+        queued = []
+        for vm in self.candidates():
+            if len(queued) >= self.limit:
+                break
+            if self.suspend(vm) is not None:
+                print(f"Idle hibernation: suspending {vm['name']} "
+                      f"(idle for {int(self.idle_seconds / 60)} min, {vm['memory_used_mb']} MB in use)")
+                queued.append(vm['id'])
+        self._last_check = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._suspended += len(queued)
+        return queued
+
+    def status(self):
+        return {
+            'enabled': self.enabled,
+            'idle_seconds': self.idle_seconds,
+            'cpu_percent': self.cpu_percent,
+            'net_bps': self.net_bps,
+            'interval_seconds': self.interval,
+            'limit': self.limit,
+            'last_check': self._last_check,
+            'suspended_total': self._suspended,
+        }
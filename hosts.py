@@ -0,0 +1,337 @@
+import hmac
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+import oplog
+import telemetry
+from vbox import QUERY_COMMANDS, VBoxDriver, command_label
+
+ONLINE = 'online'
+OFFLINE = 'offline'
+
+# The agent's run timeout is the command's; the HTTP call waits this much longer
+TIMEOUT_MARGIN = 30
+
+
+class AgentError(Exception):
+    """Raised when an agent cannot be reached or answers with an error"""
+
+
+def check_token(expected, header):
+    """Constant-time check of an 'Authorization: Bearer <token>' header"""
+    if not expected:
+        return True
+    scheme, _, token = (header or '').partition(' ')
+    return scheme == 'Bearer' and hmac.compare_digest(token.encode(), expected.encode())
+
+
+class AgentClient:
+    """JSON over keep-alive HTTP to one node agent
+
+    Idle connections are kept (up to pool_size) and reused, so a call costs
+    one request instead of a TCP handshake each time. A reused connection
+    the agent has closed in the meantime is retried once on a fresh one.
+    """
+
+    def __init__(self, url, token=None, timeout=10.0, pool_size=4):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'Agent URL must look like http://host:port, got {url!r}')
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout):
+        cls = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+        return cls(self._host, self._port, timeout=timeout)
+
+    def request(self, method, path, body=None, timeout=None):
+        """Send one request; returns the decoded JSON body or raises AgentError"""
+        timeout = timeout or self.timeout
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        payload = json.dumps(body).encode() if body is not None else None
+
+        for attempt in range(2):
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect(timeout)
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                # The agent closed an idle connection before reading the request; a
+                # request it may have started on is never sent twice
+                if reused and attempt == 0 and isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError)):
+                    continue
+                raise AgentError(f'{self.url}: {e}')
+
+            if response.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    if len(self._idle) < self.pool_size:
+                        self._idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+
+            try:
+                decoded = json.loads(data) if data else {}
+            except ValueError:
+                raise AgentError(f'{self.url}{path}: HTTP {response.status}, not JSON')
+            if response.status >= 400:
+                raise AgentError(f'{self.url}{path}: HTTP {response.status}: {decoded.get("error", "")}')
+            return decoded
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class RemoteDriver(VBoxDriver):
+    """VBoxDriver whose VBoxManage calls run on a node agent
+
+    Every driver method works unchanged on top of run(). Output of
+    non-query commands is copied into the current job's log when the
+    command returns; it is not streamed while the command runs.
+    """
+
+    def __init__(self, client, host_name, cache_ttl=5.0):
+        super().__init__(cache_ttl=cache_ttl)
+        self.client = client
+        self.host_name = host_name
+
+    def run(self, args, timeout=30, files=None):
+        args = [str(arg) for arg in args]
+        label = command_label(args)
+        op = oplog.current()
+        if op and args[0] not in QUERY_COMMANDS:
+            shown = f'VBoxManage {label}' if args[0] == 'guestcontrol' else 'VBoxManage ' + ' '.join(args)
+            op.write(f'$ [{self.host_name}] {shown}')
+
+        started = time.perf_counter()
+        try:
+            body = {'args': args, 'timeout': timeout}
+            if files:
+                body['files'] = files   # written to 0600 temp files on the agent's host
+            result = self.client.request('POST', '/vboxmanage', body, timeout=timeout + TIMEOUT_MARGIN)
+        except AgentError as e:
+            telemetry.AGENT_SECONDS.observe(time.perf_counter() - started, host=self.host_name, outcome='failure')
+            telemetry.AGENT_FAILURES.inc(host=self.host_name)
+            return {'success': False, 'message': f'Host {self.host_name} is unreachable',
+                    'stderr': str(e), 'stdout': ''}
+        telemetry.AGENT_SECONDS.observe(time.perf_counter() - started, host=self.host_name,
+                                        outcome='success' if result.get('success') else 'failure')
+
+        if op and args[0] not in QUERY_COMMANDS:
+            for stream in ('stdout', 'stderr'):
+                for line in (result.get(stream) or '').splitlines():
+                    marker = oplog.PROGRESS_RE.match(line)
+                    if marker:
+                        op.step(marker.group('step'))
+                    else:
+                        op.write(line, stream)
+        return result
+
+
+class HostRegistry:
+    """The VirtualBox hosts the dashboard drives
+
+    The local VirtualBox is host None (instances.host_id NULL) unless
+    include_local is off. Node agents are rows in the hosts table. A
+    background thread asks every agent for /health each `interval` seconds
+    and marks it online or offline; only online hosts get new VMs, and an
+    offline host's VMs are left alone by the reconciler until it is back.
+    """
+
+    def __init__(self, connect, local_driver, token=None, include_local=True, interval=15.0,
+                 timeout=10.0, pool_size=4):
+        self.connect = connect
+        self.local_driver = local_driver
+        self.token = token
+        self.include_local = include_local
+        self.interval = interval
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._hosts = {}     # id -> row dict, as of the last load or health check
+        self._drivers = {}   # id -> RemoteDriver
+        self._loaded = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        """Start the health check thread if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='vsm-hosts', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"Host registry error: {str(e)}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _load(self):
+        rows = self.connect().execute('SELECT * FROM hosts ORDER BY id').fetchall()
+        with self._lock:
+            self._hosts = {row['id']: dict(row) for row in rows}
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._load()
+
+    def _client(self, url):
+        return AgentClient(url, token=self.token, timeout=self.timeout, pool_size=self.pool_size)
+
+    def driver(self, host_id):
+        """Driver for the host a VM lives on; None is the local VirtualBox"""
+        if host_id is None:
+            return self.local_driver
+        self._ensure_loaded()
+        with self._lock:
+            host = self._hosts.get(host_id)
+            if host is None:
+                raise KeyError(f'Unknown host {host_id}')
+            driver = self._drivers.get(host_id)
+            if driver is None or driver.client.url != host['url']:
+                driver = self._drivers[host_id] = RemoteDriver(self._client(host['url']), host['name'])
+            return driver
+
+    def drivers(self):
+        """{host_id: driver} of every host that is up, for fleet-wide sweeps"""
+        drivers = {None: self.local_driver} if self.include_local else {}
+        for host_id in self.online_ids():
+            drivers[host_id] = self.driver(host_id)
+        return drivers
+
+    def online_ids(self):
+        self._ensure_loaded()
+        with self._lock:
+            return [id for id, host in self._hosts.items() if host['status'] == ONLINE]
+
+    def resources(self, host_id):
+        """(cpus, ram_mb) an agent reported, or None if it never has"""
+        self._ensure_loaded()
+        with self._lock:
+            host = self._hosts.get(host_id)
+        if not host or not host['cpus'] or not host['ram_mb']:
+            return None
+        return host['cpus'], host['ram_mb']
+
+    def name_of(self, host_id):
+        if host_id is None:
+            return 'local'
+        self._ensure_loaded()
+        with self._lock:
+            host = self._hosts.get(host_id)
+        return host['name'] if host else f'host-{host_id}'
+
+    def register(self, name, url):
+        """Add (or re-point) an agent after checking that it answers; returns its row"""
+        client = self._client(url)
+        try:
+            health = client.request('GET', '/health')
+        finally:
+            client.close()
+        conn = self.connect()
+        conn.execute(
+            '''INSERT INTO hosts (name, url, cpus, ram_mb, status, last_seen)
+               VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+               ON CONFLICT (name) DO UPDATE SET
+                   url = excluded.url, cpus = excluded.cpus, ram_mb = excluded.ram_mb,
+                   status = excluded.status, error = NULL, last_seen = excluded.last_seen''',
+            (name, url, health.get('cpus'), health.get('ram_mb'), ONLINE)
+        )
+        conn.commit()
+        self._load()
+        row = conn.execute('SELECT * FROM hosts WHERE name = ?', (name,)).fetchone()
+        print(f"Registered host {name} at {url} ({health.get('cpus')} CPUs, {health.get('ram_mb')} MB)")
+        return dict(row)
+
+    def remove(self, host_id):
+        """Forget an agent; KeyError if unknown, ValueError while instances still live on it"""
+        conn = self.connect()
+        if not conn.execute('SELECT id FROM hosts WHERE id = ?', (host_id,)).fetchone():
+            raise KeyError(f'Unknown host {host_id}')
+        count = conn.execute('SELECT COUNT(*) FROM instances WHERE host_id = ?', (host_id,)).fetchone()[0]
+        if count:
+            raise ValueError(f'Host {self.name_of(host_id)} still has {count} instance(s)')
+        conn.execute('DELETE FROM hosts WHERE id = ?', (host_id,))
+        conn.commit()
+        with self._lock:
+            driver = self._drivers.pop(host_id, None)
+        if driver:
+            driver.client.close()
+        self._load()
+
+    def check_once(self):
+        """Ask every agent for /health and store what changed"""
+        self._load()
+        with self._lock:
+            hosts = list(self._hosts.values())
+        updates = []
+        for host in hosts:
+            try:
+                health = self.driver(host['id']).client.request('GET', '/health')
+            except AgentError as e:
+                if host['status'] != OFFLINE:
+                    print(f"Host {host['name']} is offline: {str(e)}")
+                updates.append((OFFLINE, str(e), host['cpus'], host['ram_mb'], None, host['id']))
+                continue
+            if host['status'] != ONLINE:
+                print(f"Host {host['name']} is online")
+            updates.append((ONLINE, None, health.get('cpus'), health.get('ram_mb'), 1, host['id']))
+        if updates:
+            conn = self.connect()
+            conn.executemany(
+                '''UPDATE hosts SET status = ?, error = ?, cpus = ?, ram_mb = ?,
+                       last_seen = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE last_seen END
+                   WHERE id = ?''',
+                updates
+            )
+            conn.commit()
+            self._load()
+
+    def list(self):
+        """Host rows with their instance counts, the local host first"""
+        self._ensure_loaded()
+        counts = {row['host_id']: row['count'] for row in self.connect().execute(
+            'SELECT host_id, COUNT(*) AS count FROM instances GROUP BY host_id'
+        )}
+        hosts = []
+        if self.include_local:
+            hosts.append({'id': None, 'name': 'local', 'url': None, 'status': ONLINE,
+                          'instances': counts.get(None, 0)})
+        with self._lock:
+            rows = list(self._hosts.values())
+        hosts.extend(dict(row, instances=counts.get(row['id'], 0)) for row in rows)
+        return hosts
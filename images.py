@@ -0,0 +1,201 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+# Where installer ISOs are looked for unless VSM_IMAGE_DIRS names other folders
+DEFAULT_DIRECTORIES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'isos')]
+
+IMAGE_EXTENSIONS = ('.iso',)
+
+# ubuntu-24.04.1-live-server-amd64.iso, debian-12.5.0-amd64-netinst.iso,
+# CentOS-Stream-9-latest-x86_64-dvd1.iso, alpine-virt-3.19.1-x86_64.iso
+OS_NAMES = {'ubuntu': 'Ubuntu', 'debian': 'Debian', 'centos': 'CentOS', 'alpine': 'Alpine'}
+OS_RE = re.compile(r'^(?P<os>ubuntu|debian|centos|alpine)', re.IGNORECASE)
+VERSION_RE = re.compile(r'\d+(?:\.\d+)*')
+
+# Lightweight image used for any OS that has none of its own
+FALLBACK_OS = 'Alpine'
+
+HASH_CHUNK = 1024 * 1024
+
+
+def identify(filename):
+    """(os_type, version) guessed from an image's file name; either may be None"""
+    match = OS_RE.match(filename)
+    if not match:
+        return None, None
+    version = VERSION_RE.search(filename, match.end())
+    return OS_NAMES[match.group('os').lower()], version.group(0) if version else None
+
+
+def version_key(version):
+    return tuple(int(part) for part in version.split('.')) if version else ()
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageCatalog:
+    """Installer images found in the image directories, kept in the images table
+
+    A scan lists each directory once and only looks at files whose size or
+    mtime differs from the stored row, so rescanning a large downloads
+    folder costs one directory listing. New and changed files are hashed
+    after the listing has been committed; they can be used before their
+    checksum is known. Files that disappear are marked unavailable rather
+    than deleted, so instances keep pointing at the image they came from.
+    Creates read the catalog only and never touch the filesystem.
+    """
+
+    def __init__(self, connect, directories=None, interval=600.0):
+        self.connect = connect
+        self.directories = list(directories or DEFAULT_DIRECTORIES)
+        self.interval = interval
+        self._last_scan = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        """Start the scan thread if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='vsm-images', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Ask the scan thread to run now instead of at the next interval"""
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Image catalog error: {str(e)}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _walk(self):
+        """(path, stat) of every image file directly inside the image directories"""
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue  # not every configured folder exists on every host
+            for entry in entries:
+                if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    try:
+                        if entry.is_file():
+                            yield os.path.abspath(entry.path), entry.stat()
+                    except OSError:
+                        continue
+
+    def refresh(self):
+        """Scan the directories and hash new files; returns what changed"""
+        with self._scan_lock:
+            started = time.monotonic()
+            conn = self.connect()
+            known = {row['path']: row for row in conn.execute(
+                'SELECT id, path, size, mtime, available FROM images'
+            )}
+            seen = set()
+            added = updated = 0
+            for path, stat in self._walk():
+                seen.add(path)
+                row = known.get(path)
+                if row and row['size'] == stat.st_size and row['mtime'] == stat.st_mtime:
+                    if not row['available']:
+                        conn.execute('UPDATE images SET available = 1 WHERE id = ?', (row['id'],))
+                        updated += 1
+                    continue
+                os_type, version = identify(os.path.basename(path))
+                conn.execute(
+                    '''INSERT INTO images (path, filename, size, mtime, os_type, version)
+                       VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (path) DO UPDATE SET
+                           size = excluded.size, mtime = excluded.mtime, sha256 = NULL,
+                           os_type = excluded.os_type, version = excluded.version,
+                           available = 1, scanned_at = CURRENT_TIMESTAMP''',
+                    (path, os.path.basename(path), stat.st_size, stat.st_mtime, os_type, version)
+                )
+                if row:
+                    updated += 1
+                else:
+                    added += 1
+            gone = [row['id'] for path, row in known.items() if row['available'] and path not in seen]
+            conn.executemany('UPDATE images SET available = 0 WHERE id = ?', [(id,) for id in gone])
+            conn.commit()
+
+            hashed = self._hash_pending(conn)
+            self._last_scan = {
+                'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'seconds': round(time.monotonic() - started, 3),
+                'added': added, 'updated': updated, 'removed': len(gone), 'hashed': hashed,
+            }
+            if added or updated or gone:
+                print(f"Image catalog: {added} added, {updated} updated, {len(gone)} removed, {hashed} hashed")
+            return {'success': True, 'stdout': '', 'stderr': '', 'message': 'Image catalog refreshed',
+                    **self._last_scan}
+
+    def _hash_pending(self, conn):
+        """Checksum images that have none yet; one commit per file"""
+        rows = conn.execute(
+            'SELECT id, path, size, mtime FROM images WHERE sha256 IS NULL AND available = 1'
+        ).fetchall()
+        hashed = 0
+        for row in rows:
+            try:
+                digest = sha256_of(row['path'])
+                stat = os.stat(row['path'])
+            except OSError as e:
+                print(f"Image catalog: cannot hash {row['path']}: {str(e)}")
+                continue
+            # A file still being downloaded changes under us; hash it on the next scan
+            if stat.st_size != row['size'] or stat.st_mtime != row['mtime']:
+                continue
+            conn.execute(
+                'UPDATE images SET sha256 = ? WHERE id = ? AND size = ? AND mtime = ?',
+                (digest, row['id'], row['size'], row['mtime'])
+            )
+            conn.commit()
+            hashed += 1
+        return hashed
+
+    def list(self, os_type=None, include_missing=False):
+        """Catalog rows, newest version first within each OS"""
+        sql = 'SELECT * FROM images WHERE 1 = 1'
+        params = []
+        if os_type:
+            sql += ' AND os_type = ?'
+            params.append(os_type)
+        if not include_missing:
+            sql += ' AND available = 1'
+        rows = [dict(row) for row in self.connect().execute(sql, params)]
+        rows.sort(key=lambda r: (version_key(r['version']), r['mtime']), reverse=True)
+        rows.sort(key=lambda r: r['os_type'] or '~')
+        return rows
+
+    def get(self, image_id):
+        row = self.connect().execute('SELECT * FROM images WHERE id = ?', (image_id,)).fetchone()
+        return dict(row) if row else None
+
+    def default_for(self, os_type):
+        """Newest available image for an OS, else the newest fallback image, else None"""
+        for candidate in (os_type, FALLBACK_OS):
+            images = self.list(candidate)
+            if images:
+                return images[0]
+        return None
+
+    def status(self):
+        return {'directories': self.directories, 'interval_seconds': self.interval,
+                'last_scan': self._last_scan}
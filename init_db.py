@@ -1,21 +1,22 @@
-import sqlite3
+import db
 
 def init_db():
-    connection = sqlite3.connect('database.db')
+    connection = db.get_connection()
     
-    with open('schema.sql') as f:
-        connection.executescript(f.read())
+    # Schema lives in migrations/; this applies whatever is still pending
+    version = db.migrate(connection)
     
     cur = connection.cursor()
     
     # Optional: Insert a dummy VM to test the display later
-    cur.execute("INSERT INTO instances (name, os_type, cpu_cores, ram_size, storage_size, status) VALUES (?, ?, ?, ?, ?, ?)",
-                ('Test-Server-01', 'Ubuntu', 2, 2048, 20, 'stopped')
-                )
+    if cur.execute("SELECT COUNT(*) FROM instances").fetchone()[0] == 0:
+        cur.execute("INSERT INTO instances (name, os_type, cpu_cores, ram_size, storage_size, status) VALUES (?, ?, ?, ?, ?, ?)",
+                    ('Test-Server-01', 'Ubuntu', 2, 2048, 20, 'stopped')
+                    )
     
     connection.commit()
-    connection.close()
-    print("Database initialized successfully! 'database.db' created.")
+    db.close_connection()
+    print(f"Database initialized successfully! '{db.DATABASE}' is at schema version {version}.")
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    init_db()
@@ -0,0 +1,89 @@
+import base64
+import json
+
+# Columns a client may ask for with ?fields=
+LISTABLE_FIELDS = [
+    'id', 'name', 'os_type', 'cpu_cores', 'ram_size', 'storage_size',
+    'ip_address', 'status', 'vm_uuid', 'created_at', 'host_id', 'status_changed_at',
+    'auto_suspend', 'balloon_mb',
+]
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just past `row` in (created_at, id) order"""
+    raw = json.dumps([row['created_at'], row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return created_at, int(id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+
+
+def change_version(conn, *names):
+    """Sum of the change counters for the given tables (see migration 0003)"""
+    placeholders = ', '.join('?' for _ in names)
+    row = conn.execute(
+        f'SELECT COALESCE(SUM(version), 0) FROM change_counters WHERE name IN ({placeholders})',
+        names
+    ).fetchone()
+    return row[0]
+
+
+def list_instances(conn, cursor=None, limit=DEFAULT_PAGE_SIZE, statuses=None, os_types=None, fields=None):
+    """Return (rows, next_cursor) for one page of instances, newest first
+
+    Pages are addressed by keyset on (created_at, id), so the cost of a page
+    does not grow with how deep into the list it is.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    fields = [f for f in (fields or LISTABLE_FIELDS) if f in LISTABLE_FIELDS]
+    # The cursor is built from these even when the caller did not ask for them
+    columns = list(dict.fromkeys(fields + ['created_at', 'id']))
+
+    query = f'SELECT {", ".join(columns)} FROM instances WHERE 1 = 1'
+    params = []
+    if statuses:
+        query += f' AND status IN ({", ".join("?" for _ in statuses)})'
+        params.extend(statuses)
+    if os_types:
+        query += f' AND os_type IN ({", ".join("?" for _ in os_types)})'
+        params.extend(os_types)
+    if cursor:
+        query += ' AND (created_at, id) < (?, ?)'
+        params.extend(decode_cursor(cursor))
+    # One extra row tells us whether there is a next page
+    query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+
+    rows = conn.execute(query, params).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    page = [{field: row[field] for field in fields} for row in rows[:limit]]
+    return page, next_cursor
+
+
+def select_instances(conn, ids=None, statuses=None, os_types=None):
+    """Return the instances matching explicit ids and/or status and OS filters"""
+    query = 'SELECT * FROM instances WHERE 1 = 1'
+    params = []
+    if ids is not None:
+        query += f' AND id IN ({", ".join("?" for _ in ids)})'
+        params.extend(ids)
+    if statuses:
+        query += f' AND status IN ({", ".join("?" for _ in statuses)})'
+        params.extend(statuses)
+    if os_types:
+        query += f' AND os_type IN ({", ".join("?" for _ in os_types)})'
+        params.extend(os_types)
+    return conn.execute(query + ' ORDER BY id', params).fetchall()
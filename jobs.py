@@ -0,0 +1,244 @@
+import json
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import oplog
+import telemetry
+
+# Job lifecycle states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class JobManager:
+    """Run slow VM operations on a bounded worker pool and persist their state"""
+
+    def __init__(self, connect, max_workers=4):
+        # connect() returns the calling thread's sqlite3 connection (with
+        # row_factory = sqlite3.Row); connections are reused, never closed here
+        self.connect = connect
+        self.max_workers = max_workers
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Create the worker pool on first use"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='vsm-job'
+                )
+            return self._executor
+
+    def recover(self):
+        """Fail jobs that were left queued or running by a previous process"""
+        conn = self.connect()
+        cursor = conn.execute(
+            '''UPDATE jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+               WHERE status IN (?, ?)''',
+            (FAILED, 'Interrupted by application restart', QUEUED, RUNNING)
+        )
+        conn.commit()
+        if cursor.rowcount:
+            print(f"Marked {cursor.rowcount} interrupted job(s) as failed")
+
+    def submit(self, kind, func, *args, instance_id=None, params=None):
+        """Queue func(*args) as a background job and return the new job id
+
+        func must return a dict with at least a 'success' key, the same shape
+        run_shell_script() returns. Anything in params is stored with the job,
+        so never put secrets such as passwords there.
+        """
+        job_id = self.enqueue(kind, instance_id=instance_id, params=params)
+        self.dispatch(job_id, kind, func, args)
+        return job_id
+
+    def enqueue(self, kind, instance_id=None, params=None):
+        """Record a queued job that starts only when dispatch() is called
+
+        For jobs that first wait for something else, such as host capacity.
+        wait() already blocks on them.
+        """
+        conn = self.connect()
+        cursor = conn.execute(
+            'INSERT INTO jobs (kind, instance_id, params, status) VALUES (?, ?, ?, ?)',
+            (kind, instance_id, json.dumps(params or {}), QUEUED)
+        )
+        job_id = cursor.lastrowid
+        conn.commit()
+
+        with self._lock:
+            self._futures[job_id] = Future()
+        print(f"Queued job #{job_id}: {kind} (instance: {instance_id})")
+        return job_id
+
+    def dispatch(self, job_id, kind, func, args=(), on_done=None):
+        """Run a job recorded by enqueue() on the worker pool
+
+        on_done() is called once the worker is through with the job, however
+        it ended; also when recording the job as running failed and func
+        never ran.
+        """
+        with self._lock:
+            placeholder = self._futures[job_id]
+        future = self._get_executor().submit(self._run, job_id, kind, func, args)
+        future.add_done_callback(lambda f: self._finish(job_id, placeholder, f, on_done))
+
+    def dispatch_after(self, job_id, kind, func, args=(), after=()):
+        """Dispatch a job recorded by enqueue() once the jobs in after have finished
+
+        Nothing waits on a worker in the meantime; the job is dispatched from
+        whichever thread finishes the last of them.
+        """
+        with self._lock:
+            pending = [self._futures[id] for id in after if id in self._futures]
+        if not pending:
+            self.dispatch(job_id, kind, func, args)
+            return
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self.dispatch(job_id, kind, func, args)
+
+        for future in pending:
+            future.add_done_callback(done)
+
+    def fail(self, job_id, error):
+        """Fail a job recorded by enqueue() that will never be dispatched"""
+        result = {'success': False, 'message': error}
+        self._update(
+            job_id,
+            '''UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+               WHERE id = ? AND status = ?''',
+            (FAILED, json.dumps(result), error, job_id, QUEUED)
+        )
+        with self._lock:
+            placeholder = self._futures.pop(job_id, None)
+        if placeholder is not None and not placeholder.done():
+            placeholder.set_result(result)
+        print(f"Job #{job_id} {FAILED}: {error}")
+
+    def _finish(self, job_id, placeholder, future, on_done=None):
+        if on_done is not None:
+            try:
+                on_done()
+            except Exception as e:
+                print(f"Cleanup after job #{job_id} failed: {str(e)}")
+        if future.exception() is not None:
+            placeholder.set_exception(future.exception())
+        else:
+            placeholder.set_result(future.result())
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _update(self, job_id, sql, params):
+        conn = self.connect()
+        conn.execute(sql, params)
+        conn.commit()
+
+    def _run(self, job_id, kind, func, args):
+        """Worker body: run the job and record its outcome"""
+        self._update(
+            job_id,
+            'UPDATE jobs SET status = ?, started_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (RUNNING, job_id)
+        )
+
+        # Scripts and VBoxManage calls made by this thread stream into the job's log
+        op = oplog.begin(job_id)
+        op.write(f'Job #{job_id} started: {kind}')
+        telemetry.JOBS_IN_FLIGHT.inc(kind=kind)
+        started = time.perf_counter()
+        try:
+            result = func(*args) or {'success': True}
+        except Exception as e:
+            print(f"EXCEPTION in job #{job_id}: {str(e)}")
+            print(traceback.format_exc())
+            op.write(traceback.format_exc().rstrip())
+            result = {'success': False, 'message': str(e)}
+        finally:
+            telemetry.JOBS_IN_FLIGHT.dec(kind=kind)
+            # Drop whatever the job left uncommitted on this worker's connection
+            conn = self.connect()
+            if conn.in_transaction:
+                conn.rollback()
+
+        if result.get('success'):
+            status, error = SUCCEEDED, None
+        else:
+            status = FAILED
+            error = result.get('stderr') or result.get('message') or result.get('stdout') or 'Unknown error'
+
+        seconds = time.perf_counter() - started
+        telemetry.JOB_SECONDS.observe(seconds, kind=kind, status=status)
+        telemetry.log_if_slow('job', f'#{job_id} {kind}', seconds)
+
+        self._update(
+            job_id,
+            '''UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+               WHERE id = ?''',
+            (status, json.dumps(result, default=str), error, job_id)
+        )
+        oplog.end(op, status, error)
+        print(f"Job #{job_id} {status}")
+        return result
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job submitted by this process finishes, then return it"""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout=timeout)
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Return a job as a plain dict, or None if it does not exist"""
+        conn = self.connect()
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+        job = _job_to_dict(row)
+        job['progress'] = oplog.progress_of(job_id)
+        return job
+
+    def list(self, instance_id=None, active_only=False, limit=50):
+        """Return the most recent jobs, newest first"""
+        query = 'SELECT * FROM jobs WHERE 1 = 1'
+        params = []
+        if instance_id is not None:
+            query += ' AND instance_id = ?'
+            params.append(instance_id)
+        if active_only:
+            query += ' AND status IN (?, ?)'
+            params.extend(ACTIVE_STATES)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+
+        conn = self.connect()
+        rows = conn.execute(query, params).fetchall()
+        return [_job_to_dict(row) for row in rows]
+
+    def active_job_for(self, instance_id):
+        """Return the queued or running job for an instance, if there is one"""
+        jobs = self.list(instance_id=instance_id, active_only=True, limit=1)
+        return jobs[0] if jobs else None
+
+
+def _job_to_dict(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params']) if job.get('params') else {}
+    job['result'] = json.loads(job['result']) if job.get('result') else None
+    return job
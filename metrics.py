@@ -0,0 +1,209 @@
+import math
+import re
+import threading
+import time
+from array import array
+
+# VirtualBox performance metrics collected for every running VM.
+# Guest/* counters need Guest Additions; the host-side ones always work.
+SETUP_METRICS = 'CPU/Load,RAM/Usage,Disk/Usage,Net/Rate,Guest/CPU/Load,Guest/RAM/Usage'
+QUERY_METRICS = [
+    'CPU/Load/User', 'CPU/Load/Kernel',
+    'RAM/Usage/Used',
+    'Disk/Usage/Used',
+    'Net/Rate/Rx', 'Net/Rate/Tx',
+    'Guest/CPU/Load/User', 'Guest/CPU/Load/Kernel',
+    'Guest/RAM/Usage/Total', 'Guest/RAM/Usage/Free', 'Guest/RAM/Usage/Balloon',
+]
+
+# Series kept in history for every VM
+# balloon_mb is only known with Guest Additions, and so marks memory_used_mb as the guest's own figure
+SERIES = ['cpu', 'memory', 'memory_used_mb', 'disk_used_mb', 'net_rx', 'net_tx', 'balloon_mb']
+
+# (resolution in seconds, number of points): 1 s for 10 minutes, 1 min for a day
+RAW_TIER = (1, 600)
+MINUTE_TIER = (60, 1440)
+
+# "vm name      CPU/Load/User      12.00%"
+QUERY_LINE_RE = re.compile(r'^(?P<object>.+?)\s+(?P<metric>[A-Za-z]+(?:/[A-Za-z:]+)+)\s+(?P<values>.+)$')
+VALUE_RE = re.compile(r'^(?P<number>-?[\d.]+)\s*(?P<unit>.*)$')
+
+
+def parse_metrics_query(output):
+    """Parse `VBoxManage metrics query` output into {object: {metric: value}}
+
+    Values are converted to plain numbers: percentages stay percentages,
+    kB and MB become MB and rates stay in bytes per second.
+    """
+    results = {}
+    for line in output.splitlines():
+        match = QUERY_LINE_RE.match(line.strip())
+        if not match or match.group('object').startswith('---') or match.group('object') == 'Object':
+            continue
+        # Several samples come back comma separated; the last one is newest
+        last = match.group('values').split(',')[-1].strip()
+        value = VALUE_RE.match(last)
+        if not value:
+            continue
+        number = float(value.group('number'))
+        unit = value.group('unit').strip()
+        if unit == 'kB':
+            number = number / 1024
+        elif unit == 'GB':
+            number = number * 1024
+        results.setdefault(match.group('object'), {})[match.group('metric')] = number
+    return results
+
+
+def derive_stats(raw, memory_mb=None):
+    """Turn raw VirtualBox counters for one VM into the stats the UI shows"""
+    if 'Guest/CPU/Load/User' in raw:
+        cpu = raw['Guest/CPU/Load/User'] + raw.get('Guest/CPU/Load/Kernel', 0)
+    elif 'CPU/Load/User' in raw:
+        cpu = raw['CPU/Load/User'] + raw.get('CPU/Load/Kernel', 0)
+    else:
+        cpu = None
+
+    total = raw.get('Guest/RAM/Usage/Total')
+    balloon = raw.get('Guest/RAM/Usage/Balloon')
+    if total:
+        # Memory handed to the balloon is not free in the guest, but not used by it either
+        used_mb = total - raw.get('Guest/RAM/Usage/Free', 0) - (balloon or 0)
+    else:
+        total = memory_mb
+        used_mb = raw.get('RAM/Usage/Used')
+    memory = round(100.0 * used_mb / total, 1) if used_mb is not None and total else None
+
+    return {
+        'cpu': round(min(cpu, 100.0), 1) if cpu is not None else None,
+        'memory': memory,
+        'memory_used_mb': round(used_mb) if used_mb is not None else None,
+        'disk_used_mb': raw.get('Disk/Usage/Used'),
+        'net_rx': raw.get('Net/Rate/Rx'),
+        'net_tx': raw.get('Net/Rate/Tx'),
+        'balloon_mb': round(balloon) if balloon is not None and total else None,
+    }
+
+
+def parse_range(value, default=600, maximum=86400):
+    """Parse a history range such as '90', '10m', '6h' or '1d' into seconds"""
+    match = re.match(r'^(\d+)\s*([smhd]?)$', (value or '').strip())
+    if not match:
+        return default
+    seconds = int(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+    return max(1, min(seconds, maximum))
+
+
+def covers(history, seconds, slack=30):
+    """True if a history() result has points from (about) the start of the last `seconds`"""
+    times = history['series']['t']
+    return bool(times) and times[0] <= time.time() - seconds + max(2 * history['resolution'], slack)
+
+
+class RingSeries:
+    """Fixed-size ring of timestamps plus one float column per series"""
+
+    def __init__(self, capacity, names):
+        self.capacity = capacity
+        self.times = array('q', [0]) * capacity
+        self.columns = {name: array('f', [0.0]) * capacity for name in names}
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, values):
+        for name, column in self.columns.items():
+            value = values.get(name)
+            column[self.head] = math.nan if value is None else value
+        self.times[self.head] = int(timestamp)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def last_time(self):
+        return self.times[(self.head - 1) % self.capacity] if self.count else None
+
+    def since(self, start, names):
+        """Return {'t': [...], name: [...]} for points at or after start, oldest first"""
+        first = (self.head - self.count) % self.capacity
+        indexes = [(first + i) % self.capacity for i in range(self.count)]
+        indexes = [i for i in indexes if self.times[i] >= start]
+        series = {'t': [self.times[i] for i in indexes]}
+        for name in names:
+            column = self.columns[name]
+            series[name] = [None if math.isnan(column[i]) else round(column[i], 2) for i in indexes]
+        return series
+
+
+class VMHistory:
+    """Raw and per-minute tiers for one VM, downsampled as samples arrive"""
+
+    def __init__(self):
+        self.raw = RingSeries(RAW_TIER[1], SERIES)
+        self.minutes = RingSeries(MINUTE_TIER[1], SERIES)
+        self._bucket = None
+        self._sums = {}
+        self._counts = {}
+
+    def record(self, timestamp, values):
+        # Keep at most one raw point per second
+        if self.raw.last_time() != int(timestamp):
+            self.raw.append(timestamp, values)
+
+        bucket = int(timestamp) // MINUTE_TIER[0]
+        if self._bucket is not None and bucket != self._bucket:
+            self._flush_minute()
+        self._bucket = bucket
+        for name in SERIES:
+            value = values.get(name)
+            if value is not None:
+                self._sums[name] = self._sums.get(name, 0.0) + value
+                self._counts[name] = self._counts.get(name, 0) + 1
+
+    def _flush_minute(self):
+        means = {name: self._sums[name] / self._counts[name] for name in self._sums}
+        self.minutes.append(self._bucket * MINUTE_TIER[0], means)
+        self._sums = {}
+        self._counts = {}
+
+
+class MetricsStore:
+    """In-memory time-series history for every VM, keyed by VM name"""
+
+    def __init__(self):
+        self._vms = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, values, timestamp=None):
+        timestamp = timestamp or time.time()
+        with self._lock:
+            history = self._vms.get(name)
+            if history is None:
+                history = self._vms[name] = VMHistory()
+            history.record(timestamp, values)
+
+    def forget(self, names):
+        """Drop history for VMs that no longer exist"""
+        with self._lock:
+            for name in names:
+                self._vms.pop(name, None)
+
+    def names(self):
+        with self._lock:
+            return list(self._vms)
+
+    def history(self, name, seconds, series=None):
+        """Return the points of the last `seconds` at the coarsest tier that covers them"""
+        series = [s for s in (series or SERIES) if s in SERIES]
+        if seconds <= RAW_TIER[0] * RAW_TIER[1]:
+            resolution, tier = RAW_TIER[0], 'raw'
+        else:
+            resolution, tier = MINUTE_TIER[0], 'minutes'
+
+        start = time.time() - seconds
+        with self._lock:
+            history = self._vms.get(name)
+            if history is None:
+                points = {'t': []}
+                points.update({s: [] for s in series})
+            else:
+                points = getattr(history, tier).since(start, series)
+        return {'range': seconds, 'resolution': resolution, 'series': points}
@@ -0,0 +1,50 @@
+-- Baseline schema: the tables app.py used to create in init_db()
+
+-- INSTANCES table - stores VM information
+CREATE TABLE IF NOT EXISTS instances (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    os_type TEXT NOT NULL,
+    cpu_cores INTEGER DEFAULT 1,
+    ram_size INTEGER DEFAULT 1024,
+    storage_size INTEGER DEFAULT 10000,
+    ip_address TEXT,
+    status TEXT DEFAULT 'stopped',
+    vm_uuid TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- SERVICES table - stores installed services
+CREATE TABLE IF NOT EXISTS services (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    instance_id INTEGER NOT NULL,
+    service_name TEXT NOT NULL,
+    status TEXT DEFAULT 'installed',
+    installed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (instance_id) REFERENCES instances (id) ON DELETE CASCADE
+);
+
+-- VM_USERS table - stores users on VMs
+CREATE TABLE IF NOT EXISTS vm_users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    instance_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    has_sudo BOOLEAN DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (instance_id) REFERENCES instances (id) ON DELETE CASCADE
+);
+
+-- JOBS table - background operations (create, clone, start, ...)
+-- instance_id is not a foreign key: job history outlives deleted VMs
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    instance_id INTEGER,
+    params TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    result TEXT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
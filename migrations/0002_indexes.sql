@@ -0,0 +1,12 @@
+-- Foreign keys were never enforced before this version, so deletes left
+-- services and users behind. Remove them before enforcement starts.
+DELETE FROM services WHERE instance_id NOT IN (SELECT id FROM instances);
+DELETE FROM vm_users WHERE instance_id NOT IN (SELECT id FROM instances);
+
+-- vm_details(), clone_vm() and the cascades filter on instance_id
+CREATE INDEX IF NOT EXISTS idx_services_instance ON services (instance_id);
+CREATE INDEX IF NOT EXISTS idx_vm_users_instance ON vm_users (instance_id);
+
+-- Job lookups: active job per VM and the recent/active job lists
+CREATE INDEX IF NOT EXISTS idx_jobs_instance_status ON jobs (instance_id, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
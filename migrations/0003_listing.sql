@@ -0,0 +1,40 @@
+-- Change counters bumped by triggers; the dashboard and /api/vms use them
+-- as ETags so an unchanged fleet can be answered with 304 Not Modified
+CREATE TABLE IF NOT EXISTS change_counters (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO change_counters (name, version) VALUES ('instances', 0);
+INSERT OR IGNORE INTO change_counters (name, version) VALUES ('jobs', 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_instances_insert AFTER INSERT ON instances
+BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'instances';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_instances_update AFTER UPDATE ON instances
+BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'instances';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_instances_delete AFTER DELETE ON instances
+BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'instances';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_jobs_insert AFTER INSERT ON jobs
+BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'jobs';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_jobs_update AFTER UPDATE ON jobs
+BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'jobs';
+END;
+
+-- Keyset pagination walks (created_at, id) newest first, optionally
+-- within one status or OS
+CREATE INDEX IF NOT EXISTS idx_instances_created ON instances (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_instances_status_created ON instances (status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_instances_os_created ON instances (os_type, created_at, id);
@@ -0,0 +1,29 @@
+-- Warm pool: ready, stopped VMs per shape, cloned from a golden image so
+-- create() can rename one instead of building a VM from scratch
+
+-- How many ready VMs to keep for each (OS, CPU, RAM, disk) shape
+CREATE TABLE IF NOT EXISTS warm_pool_targets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    os_type TEXT NOT NULL,
+    cpu_cores INTEGER NOT NULL,
+    ram_size INTEGER NOT NULL,
+    storage_size INTEGER NOT NULL,
+    golden_vm TEXT NOT NULL,
+    target INTEGER NOT NULL DEFAULT 1,
+    last_requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (os_type, cpu_cores, ram_size, storage_size)
+);
+
+-- Pool members; a row is removed once its VM becomes an instance
+CREATE TABLE IF NOT EXISTS warm_pool_vms (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target_id INTEGER NOT NULL,
+    vm_name TEXT NOT NULL UNIQUE,
+    vm_uuid TEXT,
+    state TEXT NOT NULL DEFAULT 'provisioning', -- provisioning, ready, claimed
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ready_at TIMESTAMP,
+    FOREIGN KEY (target_id) REFERENCES warm_pool_targets (id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_warm_pool_vms_target_state ON warm_pool_vms (target_id, state, ready_at);
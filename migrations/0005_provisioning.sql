@@ -0,0 +1,11 @@
+-- Per-item state for batched guest provisioning (see provisioning.py)
+-- services.status:  pending -> installed | failed
+-- vm_users.status:  pending -> created | failed
+-- Rows written before this migration keep the old implicit 'installed'/'created'
+ALTER TABLE services ADD COLUMN error TEXT;
+ALTER TABLE vm_users ADD COLUMN status TEXT DEFAULT 'created';
+ALTER TABLE vm_users ADD COLUMN error TEXT;
+
+-- The provisioner only ever looks for pending items
+CREATE INDEX IF NOT EXISTS idx_services_pending ON services (instance_id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_vm_users_pending ON vm_users (instance_id) WHERE status = 'pending';
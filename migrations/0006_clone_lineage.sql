@@ -0,0 +1,10 @@
+-- Clone lineage (see VBoxDriver.clone and flatten)
+-- clone_type: NULL for VMs that were created, 'full' or 'linked' for clones
+-- parent_id:  the VM a clone was made from; a linked clone's disks are
+--             differencing images on top of a snapshot of its parent
+--             (deleting a parent is refused while linked clones exist)
+ALTER TABLE instances ADD COLUMN parent_id INTEGER REFERENCES instances (id) ON DELETE SET NULL;
+ALTER TABLE instances ADD COLUMN clone_type TEXT;
+
+-- "Does this VM still have linked clones?" is asked before every delete
+CREATE INDEX IF NOT EXISTS idx_instances_parent ON instances (parent_id) WHERE parent_id IS NOT NULL;
@@ -0,0 +1,20 @@
+-- Installer image catalog (see images.py)
+-- Filled by scanning the image directories; a row is re-read only when the
+-- file's size or mtime changes. sha256 is NULL until the file has been hashed.
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT,
+    os_type TEXT,              -- Ubuntu, Debian, CentOS, Alpine or NULL if unrecognised
+    version TEXT,
+    available INTEGER NOT NULL DEFAULT 1,  -- 0 once the file is gone; kept for instances.image_id
+    scanned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_images_os ON images (os_type, available);
+
+-- The image a VM was installed from (NULL for clones and warm pool VMs)
+ALTER TABLE instances ADD COLUMN image_id INTEGER REFERENCES images (id) ON DELETE SET NULL;
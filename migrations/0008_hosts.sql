@@ -0,0 +1,17 @@
+-- VirtualBox hosts driven through node agents (see hosts.py and agent.py)
+-- The dashboard's own VirtualBox is not a row: its instances have host_id NULL
+CREATE TABLE IF NOT EXISTS hosts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    cpus INTEGER,
+    ram_mb INTEGER,
+    status TEXT NOT NULL DEFAULT 'online', -- online, offline
+    error TEXT,
+    last_seen TIMESTAMP,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE instances ADD COLUMN host_id INTEGER REFERENCES hosts (id);
+
+CREATE INDEX IF NOT EXISTS idx_instances_host ON instances (host_id);
@@ -0,0 +1,12 @@
+-- Suspend/resume through saved state (see hibernation.py)
+-- status_changed_at: when status last changed; the idle policy only looks
+--                    at VMs that have been running for its whole window
+-- auto_suspend:      0 keeps a VM out of idle hibernation
+ALTER TABLE instances ADD COLUMN status_changed_at TIMESTAMP;
+ALTER TABLE instances ADD COLUMN auto_suspend INTEGER NOT NULL DEFAULT 1;
+
+CREATE TRIGGER IF NOT EXISTS trg_instances_status_changed AFTER UPDATE OF status ON instances
+WHEN NEW.status IS NOT OLD.status
+BEGIN
+    UPDATE instances SET status_changed_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+END;
@@ -0,0 +1,11 @@
+-- Memory balloons (see balloon.py)
+-- balloon_mb: memory the balloon currently holds inside a running guest;
+--             the scheduler counts ram_size - balloon_mb as in use. A
+--             balloon does not survive a power off, so it drops to 0 with it.
+ALTER TABLE instances ADD COLUMN balloon_mb INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER IF NOT EXISTS trg_instances_balloon_reset AFTER UPDATE OF status ON instances
+WHEN NEW.status IS NOT 'running' AND NEW.balloon_mb != 0
+BEGIN
+    UPDATE instances SET balloon_mb = 0 WHERE id = NEW.id;
+END;
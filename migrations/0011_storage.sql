@@ -0,0 +1,31 @@
+-- Disk images and the space they take on the host (see storage.py)
+-- size_mb is measured with showmediuminfo; storage_size on instances stays
+-- the size that was asked for. compacted_size_mb is the size right after
+-- the last compaction, so size_mb - compacted_size_mb is what the image has
+-- grown since.
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    instance_id INTEGER NOT NULL REFERENCES instances (id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    medium_uuid TEXT,
+    capacity_mb INTEGER,
+    size_mb INTEGER,
+    compacted_size_mb INTEGER,
+    measured_at TIMESTAMP,
+    compacted_at TIMESTAMP,
+    UNIQUE (instance_id, path)
+);
+
+-- Host disk space given back by deleting VMs and compacting images; rows
+-- outlive their instance, so there is no foreign key
+CREATE TABLE IF NOT EXISTS storage_reclaimed (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,  -- destroy, compact
+    instance_id INTEGER,
+    name TEXT NOT NULL,
+    host_id INTEGER,
+    freed_mb INTEGER NOT NULL,
+    reclaimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_storage_reclaimed_at ON storage_reclaimed (reclaimed_at);
@@ -0,0 +1,285 @@
+import codecs
+import collections
+import os
+import re
+import subprocess
+import threading
+import time
+
+# One log file per job: logs/job-<id>.log, rotated to .1, .2, ... at LOG_MAX_BYTES
+LOG_DIR = os.environ.get('VSM_LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+LOG_MAX_BYTES = int(os.environ.get('VSM_LOG_MAX_BYTES', 1024 * 1024))
+LOG_BACKUPS = int(os.environ.get('VSM_LOG_BACKUPS', 3))
+
+# Output lines a process result keeps in memory; the log file has all of them
+TAIL_LINES = 200
+
+# Lines starting with this are markers for the app ("VSM-ITEM ...", "VSM-PROGRESS ...")
+# and are kept in the result even when the tail has moved past them
+MARKER_PREFIX = 'VSM-'
+MAX_MARKERS = 1000
+
+# Longer lines are split, so a process that never writes a newline stays bounded too
+MAX_LINE = 64 * 1024
+
+# vbox.VBoxDriver reports its create/clone/destroy milestones with progress(); a
+# process whose output is streamed can do the same with: echo "VSM-PROGRESS disk created"
+PROGRESS_RE = re.compile(r'^VSM-PROGRESS\s+(?P<step>.+?)\s*$')
+
+# VBoxManage prints "0%...10%...20%..." without newlines while it works
+PERCENT_RE = re.compile(r'(?:^|\.\.\.)(\d{1,3})%')
+
+_local = threading.local()
+_active = {}
+_listeners = []
+_lock = threading.Lock()
+
+
+def log_path(job_id, directory=None):
+    return os.path.join(directory or LOG_DIR, f'job-{job_id}.log')
+
+
+def add_listener(func):
+    """Call func(job_id, event, data) for every 'log', 'progress' and 'end' event"""
+    _listeners.append(func)
+
+
+def _notify(job_id, event, data):
+    for listener in _listeners:
+        try:
+            listener(job_id, event, data)
+        except Exception as e:
+            print(f"Operation log listener error: {str(e)}")
+
+
+class OperationLog:
+    """Size-rotated log file of one job, plus the job's latest progress marker"""
+
+    def __init__(self, job_id, directory=None, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        self.job_id = job_id
+        self.path = log_path(job_id, directory)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.progress = None
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8', errors='replace')
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{n}'):
+                os.replace(f'{self.path}.{n}', f'{self.path}.{n + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write(self, line, stream='app'):
+        """Append one line and publish it as a 'log' event"""
+        at = time.strftime('%Y-%m-%d %H:%M:%S')
+        text = f'{at} [{stream}] {line}\n'
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open()
+                elif self._size + len(text) > self.max_bytes:
+                    self._rotate()
+                self._file.write(text)
+                self._file.flush()
+                self._size += len(text)
+            except OSError as e:
+                print(f"Cannot write {self.path}: {str(e)}")
+        _notify(self.job_id, 'log', {'line': line, 'stream': stream, 'at': at})
+
+    def step(self, step, percent=None):
+        """Record a progress marker such as 'disk created' or ('cloning', 40)"""
+        self.progress = {'step': step, 'percent': percent, 'at': time.strftime('%Y-%m-%d %H:%M:%S')}
+        self.write(f'{step} ({percent}%)' if percent is not None else step, 'progress')
+        _notify(self.job_id, 'progress', dict(self.progress))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def begin(job_id):
+    """Open the log of a job and make it current for this thread"""
+    op = OperationLog(job_id)
+    with _lock:
+        _active[job_id] = op
+    _local.op = op
+    return op
+
+
+def end(op, status, error=None):
+    """Close a job's log once its final status is stored; ends every live tail"""
+    op.write(f'Job {status}' + (f': {error}' if error else ''))
+    op.close()
+    with _lock:
+        _active.pop(op.job_id, None)
+    if getattr(_local, 'op', None) is op:
+        _local.op = None
+    _notify(op.job_id, 'end', {'status': status, 'error': error})
+
+
+def current():
+    """The log of the job running on this thread, or None"""
+    return getattr(_local, 'op', None)
+
+
+def progress_of(job_id):
+    """Latest progress marker of a running job, or None"""
+    with _lock:
+        op = _active.get(job_id)
+    return dict(op.progress) if op and op.progress else None
+
+
+def bind(func):
+    """Wrap func so it logs to the caller's job when run on another thread"""
+    op = current()
+    if op is None:
+        return func
+
+    def bound(*args, **kwargs):
+        previous = current()
+        _local.op = op
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.op = previous
+    return bound
+
+
+def log(line):
+    """Write a line to the current job's log (printed when there is none)"""
+    op = current()
+    if op:
+        op.write(line)
+    else:
+        print(line)
+
+
+def progress(step, percent=None):
+    """Report a milestone of the current job; a no-op outside jobs"""
+    op = current()
+    if op:
+        op.step(step, percent)
+
+
+def tail(job_id, lines=200):
+    """Last lines of a job's log file, or None if the job never wrote one"""
+    try:
+        with open(log_path(job_id), encoding='utf-8', errors='replace') as f:
+            return [line.rstrip('\n') for line in collections.deque(f, maxlen=lines)]
+    except FileNotFoundError:
+        return None
+
+
+class OutputTail:
+    """The last `limit` lines of a stream plus its marker lines, in order"""
+
+    def __init__(self, limit=TAIL_LINES):
+        self._lines = collections.deque(maxlen=limit)
+        self._markers = collections.deque(maxlen=MAX_MARKERS)
+        self.count = 0
+
+    def add(self, line):
+        self._lines.append((self.count, line))
+        if line.startswith(MARKER_PREFIX):
+            self._markers.append((self.count, line))
+        self.count += 1
+
+    def text(self):
+        first = self._lines[0][0] if self._lines else self.count
+        lines = [line for n, line in self._markers if n < first]
+        omitted = first - len(lines)
+        if omitted:
+            lines.append(f'[{omitted} earlier lines omitted, see the job log]')
+        lines.extend(line for _, line in self._lines)
+        return '\n'.join(lines).strip()
+
+
+def _pump(pipe, stream, output, op):
+    """Read one pipe as it is written and hand each line to the job log"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ''
+    percent = -1
+    for chunk in iter(lambda: pipe.read1(8192), b''):
+        pending += decoder.decode(chunk)
+        *lines, pending = re.split(r'\r\n|\r|\n', pending)
+        if len(pending) > MAX_LINE:
+            lines.append(pending)
+            pending = ''
+        # Percentages can arrive before the line they are on is complete
+        found = [int(p) for text in lines + [pending] for p in PERCENT_RE.findall(text) if int(p) <= 100]
+        if op and found and max(found) > percent:
+            percent = max(found)
+            op.step(op.progress['step'] if op.progress else 'working', percent)
+        for line in lines:
+            output.add(line)
+            marker = PROGRESS_RE.match(line)
+            if not op:
+                print(f"{stream}: {line}")
+            elif marker:
+                op.step(marker.group('step'))
+            else:
+                op.write(line, stream)
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        output.add(pending)
+        if op:
+            op.write(pending, stream)
+        else:
+            print(f"{stream}: {pending}")
+    pipe.close()
+
+
+def run_process(argv, timeout, cwd=None, display=None):
+    """Run argv, streaming its output line by line into the current job's log
+
+    Returns {'returncode', 'stdout', 'stderr', 'timed_out'} where stdout and
+    stderr hold at most TAIL_LINES lines each plus marker lines, however much
+    the process writes. display is what gets logged instead of argv (leave
+    secrets out of it). Raises OSError if the process cannot be started.
+    """
+    op = current()
+    if op:
+        op.write(f'$ {display or " ".join(str(arg) for arg in argv)}')
+    process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=cwd)
+    outputs = {'stdout': OutputTail(), 'stderr': OutputTail()}
+    readers = [
+        threading.Thread(target=_pump, args=(getattr(process, name), name, output, op), daemon=True)
+        for name, output in outputs.items()
+    ]
+    for reader in readers:
+        reader.start()
+
+    timed_out = False
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        timed_out = True
+    for reader in readers:
+        # A leftover grandchild can hold the pipe open; do not wait on it forever
+        reader.join(5)
+
+    if op:
+        op.write('Timed out' if timed_out else f'Exit code {process.returncode}')
+    return {
+        'returncode': process.returncode,
+        'stdout': outputs['stdout'].text(),
+        'stderr': outputs['stderr'].text(),
+        'timed_out': timed_out
+    }
@@ -0,0 +1,329 @@
+import re
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import oplog
+from vbox import VBoxDriver
+
+# Item states in the services and vm_users tables (see migration 0005)
+PENDING = 'pending'
+INSTALLED = 'installed'
+CREATED = 'created'
+FAILED = 'failed'
+
+# service name -> (apt packages, systemd units), as the old install_service.sh had them.
+# nodejs comes from the distribution so it can join the single apt transaction.
+SERVICE_CATALOG = {
+    'nginx': (['nginx'], ['nginx']),
+    'apache': (['apache2'], ['apache2']),
+    'mysql': (['mysql-server'], ['mysql']),
+    'postgresql': (['postgresql'], ['postgresql']),
+    'docker': (['docker.io'], ['docker']),
+    'git': (['git'], []),
+    'python3': (['python3', 'python3-pip'], []),
+    'nodejs': (['nodejs'], []),
+}
+
+# The plan prints one of these per item so a single session reports them all
+MARKER = 'VSM-ITEM'
+MARKER_RE = re.compile(rf'^{MARKER} (service|user) (\d+) (ok|failed)$', re.MULTILINE)
+
+MASKED_PASSWORD = '********'
+
+# Placeholder args the driver swaps for 0600 temp files holding these secrets
+PASSWORD_FILE = '{password_file}'
+SCRIPT_FILE = '{script_file}'
+
+
+def service_packages(service_name):
+    """(packages, units) for a service; unknown names install the package of that name"""
+    return SERVICE_CATALOG.get(service_name, ([service_name], []))
+
+
+def _report(kind, item_id, condition):
+    return f'if {condition}; then echo "{MARKER} {kind} {item_id} ok"; else echo "{MARKER} {kind} {item_id} failed"; fi'
+
+
+def build_script(services, users, passwords):
+    """Render one shell script that provisions every pending item of a VM
+
+    All packages go into one apt-get transaction; each service then only has
+    to enable its units, and each user is created on its own so one bad
+    username does not fail the rest. passwords maps vm_users ids to passwords.
+    """
+    lines = [
+        'export DEBIAN_FRONTEND=noninteractive',
+        'SUDO=; [ "$(id -u)" -eq 0 ] || SUDO="sudo -n"',
+    ]
+
+    packages = []
+    for service in services:
+        packages.extend(service_packages(service['service_name'])[0])
+    packages = list(dict.fromkeys(packages))
+    if packages:
+        install = ' '.join(shlex.quote(p) for p in packages)
+        lines.append(
+            f'if $SUDO apt-get update -q && $SUDO apt-get install -y -q {install}; '
+            f'then PKG_OK=1; else PKG_OK=0; fi'
+        )
+    for service in services:
+        steps = ['[ "$PKG_OK" = 1 ]']
+        steps.extend(f'$SUDO systemctl enable --now {shlex.quote(unit)}'
+                     for unit in service_packages(service['service_name'])[1])
+        lines.append(_report('service', service['id'], ' && '.join(steps)))
+
+    for user in users:
+        name = shlex.quote(user['username'])
+        credentials = shlex.quote(f"{user['username']}:{passwords.get(user['id'], '')}")
+        steps = [
+            f'{{ id -u {name} >/dev/null 2>&1 || $SUDO useradd -m -s /bin/bash {name}; }}',
+            f'printf "%s\\n" {credentials} | $SUDO chpasswd',
+        ]
+        if user['has_sudo']:
+            steps.append(f'$SUDO usermod -aG sudo {name}')
+        home = shlex.quote(f"/home/{user['username']}/.ssh")
+        steps.extend([
+            f'$SUDO mkdir -p {home}',
+            f'$SUDO chown {name}:{name} {home}',
+            f'$SUDO chmod 700 {home}',
+        ])
+        lines.append(_report('user', user['id'], ' && '.join(steps)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def parse_markers(output):
+    """Return {(kind, id): ok?} for every item the plan reported on"""
+    return {(kind, int(item_id)): outcome == 'ok' for kind, item_id, outcome in MARKER_RE.findall(output)}
+
+
+class Provisioner:
+    """Apply pending services and users to VMs, one script per VM
+
+    Routes only insert 'pending' rows; provision() collects everything
+    pending for a VM into one plan, copies it to the guest and runs it as
+    one script, and records each item's outcome. That takes three
+    guestcontrol calls (mktemp, copyto, run), each logging in on its own:
+    VBoxManage cannot feed the script to the guest over stdin, and neither
+    the script nor the guest password may travel in argv. Several
+    VMs are provisioned in parallel. Without guest credentials the plan is
+    printed instead of run, like the old install_service.sh simulation.
+    """
+
+    def __init__(self, connect, guest_user=None, guest_password=None,
+                 guest_password_file=None, max_parallel=4, timeout=1800, driver=None, driver_for=None,
+                 boot_timeout=300):
+        self.connect = connect
+        self.driver = driver or VBoxDriver()
+        # host_id -> driver of the host a VM lives on (see hosts.HostRegistry.driver)
+        self.driver_for = driver_for or (lambda host_id: self.driver)
+        self.guest_user = guest_user
+        self.guest_password = guest_password
+        self.guest_password_file = guest_password_file
+        self.timeout = timeout
+        self.boot_timeout = boot_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='vsm-provision')
+        # Passwords stay in memory until the user exists on the guest
+        self._passwords = {}
+        self._vm_locks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def simulated(self):
+        return not self.guest_user
+
+    def queue_service(self, conn, instance_id, service_name):
+        """Insert a pending service; the caller commits"""
+        conn.execute(
+            'INSERT INTO services (instance_id, service_name, status) VALUES (?, ?, ?)',
+            (instance_id, service_name, PENDING)
+        )
+
+    def queue_user(self, conn, instance_id, username, password, has_sudo):
+        """Insert a pending user and keep its password for the next run; the caller commits"""
+        cursor = conn.execute(
+            'INSERT INTO vm_users (instance_id, username, has_sudo, status) VALUES (?, ?, ?, ?)',
+            (instance_id, username, has_sudo, PENDING)
+        )
+        with self._lock:
+            self._passwords[cursor.lastrowid] = password
+
+    def pending_instances(self):
+        """Ids of VMs with anything left to provision"""
+        conn = self.connect()
+        rows = conn.execute(
+            '''SELECT instance_id FROM services WHERE status = ?
+               UNION SELECT instance_id FROM vm_users WHERE status = ?''',
+            (PENDING, PENDING)
+        ).fetchall()
+        return [row['instance_id'] for row in rows]
+
+    def retry_failed(self, instance_ids):
+        """Put failed items of these VMs back to pending"""
+        conn = self.connect()
+        placeholders = ', '.join('?' for _ in instance_ids)
+        for table in ('services', 'vm_users'):
+            conn.execute(
+                f'UPDATE {table} SET status = ?, error = NULL WHERE status = ? AND instance_id IN ({placeholders})',
+                [PENDING, FAILED] + list(instance_ids)
+            )
+        conn.commit()
+
+    def provision(self, instance_ids):
+        """Provision several VMs in parallel; returns one result per VM, in input order"""
+        # Each VM's session still logs to the job that asked for it
+        provision_one = oplog.bind(self._provision_safely)
+        futures = [self._executor.submit(provision_one, id) for id in instance_ids]
+        return [future.result() for future in futures]
+
+    def _provision_safely(self, instance_id):
+        try:
+            return self.provision_vm(instance_id)
+        except Exception as e:
+            print(f"Provisioning error for instance {instance_id}: {str(e)}")
+            return {'success': False, 'instance_id': instance_id, 'message': str(e)}
+
+    def _vm_lock(self, instance_id):
+        with self._lock:
+            return self._vm_locks.setdefault(instance_id, threading.Lock())
+
+    def provision_vm(self, instance_id):
+        """Run every pending item of one VM with a single script on the guest"""
+        # Items queued while a run is in flight wait for the next run
+        with self._vm_lock(instance_id):
+            conn = self.connect()
+            vm = conn.execute('SELECT id, name, host_id FROM instances WHERE id = ?', (instance_id,)).fetchone()
+            if not vm:
+                return {'success': False, 'instance_id': instance_id, 'message': 'VM not found'}
+
+            services = conn.execute(
+                'SELECT * FROM services WHERE instance_id = ? AND status = ? ORDER BY id',
+                (instance_id, PENDING)
+            ).fetchall()
+            users = conn.execute(
+                'SELECT * FROM vm_users WHERE instance_id = ? AND status = ? ORDER BY id',
+                (instance_id, PENDING)
+            ).fetchall()
+
+            outcomes = {}
+            with self._lock:
+                passwords = {u['id']: self._passwords[u['id']] for u in users if u['id'] in self._passwords}
+            for user in users:
+                if user['id'] not in passwords:
+                    # The password only ever lived in memory of an earlier process
+                    outcomes[('user', user['id'])] = (False, 'Password no longer available; create the user again')
+            users = [u for u in users if u['id'] in passwords]
+
+            result = {'success': True, 'instance_id': instance_id, 'name': vm['name'], 'stdout': '', 'stderr': ''}
+            if services or users:
+                session = self._run_plan(self.driver_for(vm['host_id']), vm['name'], services, users, passwords)
+                result.update(stdout=session.get('stdout', ''), stderr=session.get('stderr', ''))
+                reported = parse_markers(session.get('stdout', ''))
+                # A session that never got going leaves its items pending for a retry
+                finished = bool(reported) or session.get('success')
+                for kind, rows in (('service', services), ('user', users)):
+                    for row in rows:
+                        if (kind, row['id']) in reported:
+                            ok = reported[(kind, row['id'])]
+                            outcomes[(kind, row['id'])] = (ok, None if ok else f'{kind} step failed on the guest')
+                        elif finished:
+                            outcomes[(kind, row['id'])] = (False, 'No result reported by the guest')
+                if not finished:
+                    result['success'] = False
+                    result['message'] = session.get('message') or 'Guest session failed'
+
+            self._record(conn, outcomes)
+            with self._lock:
+                for (kind, item_id), (ok, _) in outcomes.items():
+                    if kind == 'user':
+                        self._passwords.pop(item_id, None)
+
+            failed = sum(1 for ok, _ in outcomes.values() if not ok)
+            result['services'] = {s['service_name']: self._state('service', s['id'], outcomes) for s in services}
+            result['users'] = {u['username']: self._state('user', u['id'], outcomes) for u in users}
+            result['provisioned'] = len(outcomes) - failed
+            result['failed'] = failed
+            if failed:
+                result['success'] = False
+                result.setdefault('message', f'{failed} item(s) failed to provision on {vm["name"]}')
+            print(f"Provisioned {vm['name']}: {result['provisioned']} ok, {failed} failed")
+            return result
+
+    def _state(self, kind, item_id, outcomes):
+        if (kind, item_id) not in outcomes:
+            return PENDING
+        if outcomes[(kind, item_id)][0]:
+            return INSTALLED if kind == 'service' else CREATED
+        return FAILED
+
+    def _record(self, conn, outcomes):
+        """Write every item's outcome in one transaction"""
+        services, users = [], []
+        for (kind, item_id), (ok, error) in outcomes.items():
+            if kind == 'service':
+                services.append((INSTALLED if ok else FAILED, error, item_id))
+            else:
+                users.append((CREATED if ok else FAILED, error, item_id))
+        conn.executemany(
+            'UPDATE services SET status = ?, error = ?, installed_at = CURRENT_TIMESTAMP WHERE id = ?',
+            services
+        )
+        conn.executemany('UPDATE vm_users SET status = ?, error = ? WHERE id = ?', users)
+        conn.commit()
+
+    def _run_plan(self, driver, vm_name, services, users, passwords):
+        if self.simulated:
+            masked = {id: MASKED_PASSWORD for id in passwords}
+            oplog.log(f"Provisioning {vm_name} (simulated; set VSM_GUEST_USER to run on the guest)")
+            oplog.log("Commands that would run on the VM:")
+            for line in build_script(services, users, masked).splitlines():
+                oplog.log(line)
+            reported = [f'{MARKER} service {s["id"]} ok' for s in services]
+            reported.extend(f'{MARKER} user {u["id"]} ok' for u in users)
+            return {'success': True, 'stdout': '\n'.join(reported), 'stderr': ''}
+
+        # A VM that was just started needs its Guest Additions up first; until
+        # then nothing runs and every item stays pending for a retry
+        if not driver.wait_for_guest(vm_name, self.boot_timeout):
+            return {'success': False, 'stdout': '', 'stderr': '',
+                    'message': f'Guest Additions on {vm_name} did not answer within {self.boot_timeout} s; '
+                               'is the VM running with an installed OS?'}
+
+        # Passwords never go into VBoxManage's argv, where any local user could
+        # read them: they travel in 0600 temp files (see vbox.run_vboxmanage).
+        # The script is copied into a private directory on the guest, and
+        # removes it when it starts. That is three guestcontrol sessions
+        # rather than one, but still one script and one apt transaction.
+        files = {SCRIPT_FILE: 'rm -rf "$(dirname "$0")"\n' + build_script(services, users, passwords)}
+        login = ['--username', self.guest_user]
+        password = self._guest_login_password()
+        if password is not None:
+            files[PASSWORD_FILE] = password
+            login += ['--passwordfile', PASSWORD_FILE]
+        secrets = {PASSWORD_FILE: password} if password is not None else None
+
+        made = driver.run(['guestcontrol', vm_name, 'run', '--exe', '/bin/mktemp'] + login +
+                          ['--wait-stdout', '--', 'mktemp', '-d'], files=secrets)
+        directory = made['stdout'].strip().splitlines()[-1] if made['success'] and made['stdout'].strip() else ''
+        if not directory.startswith('/'):
+            return {'success': False, 'message': 'Could not create a private directory on the guest',
+                    'stdout': made.get('stdout', ''), 'stderr': made.get('stderr', '')}
+        target = f'{directory}/provision.sh'
+        copied = driver.run(['guestcontrol', vm_name, 'copyto'] + login + [SCRIPT_FILE, target],
+                            timeout=120, files=files)
+        if not copied['success']:
+            return dict(copied, message='Could not copy the provisioning script to the guest')
+
+        args = ['guestcontrol', vm_name, 'run', '--exe', '/bin/sh'] + login
+        args += ['--wait-stdout', '--wait-stderr', '--timeout', str(self.timeout * 1000),
+                 '--', '/bin/sh', target]
+        oplog.log(f"Provisioning {vm_name}: {len(services)} service(s), {len(users)} user(s) with one script")
+        return driver.run(args, timeout=self.timeout + 30, files=secrets)
+
+    def _guest_login_password(self):
+        """Password of the guest account, read from VSM_GUEST_PASSWORD_FILE when one is set"""
+        if self.guest_password_file:
+            with open(self.guest_password_file) as f:
+                return f.read().rstrip('\n')
+        return self.guest_password
@@ -0,0 +1,199 @@
+import threading
+import time
+
+from instances import change_version
+from jobs import ACTIVE_STATES
+from vbox import parse_vm_list
+
+# Rows in these states belong to whoever is changing them
+TRANSITIONAL_STATUSES = ('creating',)
+MISSING = 'missing'
+
+
+class Reconciler:
+    """Keep instances.status in line with what VirtualBox reports
+
+    Each cycle costs two VBoxManage calls (`list vms` and `list runningvms`)
+    however many VMs exist. The result is diffed against the previous
+    cycle, and only rows whose status actually changed are written, in one
+    transaction. The instance rows are re-read only when the instances
+    change counter moves. VMs that VirtualBox has but the database does
+    not, or the other way round, are reported by drift().
+
+    drivers() returns {host_id: driver} for every host to sweep (see
+    hosts.HostRegistry.drivers); the VMs of a host that is not in it or
+    does not answer keep their status until it is back.
+    """
+
+    def __init__(self, connect, driver, interval=10.0, drivers=None):
+        self.connect = connect
+        self.driver = driver
+        self.drivers = drivers or (lambda: {None: driver})
+        self.interval = interval
+        self._snapshot = {}     # uuid -> observed status from the last cycle
+        self._rows = None       # instance rows as of _rows_version
+        self._rows_version = None
+        self._drift = {'unmanaged': [], 'missing': []}
+        self._checked_at = None
+        self._updated = 0
+        self._error = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._cycle_lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        """Start the reconcile thread if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='vsm-reconcile', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Ask the reconcile thread to run now instead of at the next interval"""
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.reconcile_once()
+            except Exception as e:
+                print(f"Reconciler error: {str(e)}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _observe(self):
+        """Return ({uuid: (name, 'running'|'stopped', host_id)}, checked host ids), or None if no host answered"""
+        observed = {}
+        checked = set()
+        errors = []
+        for host_id, driver in self.drivers().items():
+            listed = driver.run(['list', 'vms'])
+            running = driver.run(['list', 'runningvms'])
+            failed = next((result for result in (listed, running) if not result['success']), None)
+            if failed:
+                error = failed.get('stderr') or failed.get('message')
+                errors.append(error)
+                print(f"Reconciler: VirtualBox query failed on {getattr(driver, 'host_name', 'local')}: {error}")
+                continue
+            checked.add(host_id)
+            running_uuids = set(parse_vm_list(running['stdout']).values())
+            for name, vm_uuid in parse_vm_list(listed['stdout']).items():
+                observed[vm_uuid] = (name, 'running' if vm_uuid in running_uuids else 'stopped', host_id)
+        self._error = '; '.join(errors) or None
+        if errors and not checked:
+            return None
+        return observed, checked
+
+    def _load_rows(self, conn):
+        """Instance rows, re-read only when the instances table has changed"""
+        version = change_version(conn, 'instances')
+        changed = version != self._rows_version
+        if changed:
+            self._rows = conn.execute('SELECT id, name, vm_uuid, status, host_id FROM instances').fetchall()
+            self._rows_version = version
+        return self._rows, changed
+
+    def _ignored_names(self, conn):
+        """Warm pool members and golden images are VirtualBox VMs on purpose"""
+        names = {row['vm_name'] for row in conn.execute('SELECT vm_name FROM warm_pool_vms')}
+        names.update(row['golden_vm'] for row in conn.execute('SELECT golden_vm FROM warm_pool_targets'))
+        return names
+
+    def reconcile_once(self):
+        """Run one cycle; returns the number of rows updated"""
+        with self._cycle_lock:
+            observation = self._observe()
+            if observation is None:
+                return 0
+            observed, checked = observation
+
+            conn = self.connect()
+            rows, rows_changed = self._load_rows(conn)
+            by_uuid = {row['vm_uuid']: row for row in rows if row['vm_uuid']}
+            by_name = {row['name']: row for row in rows}
+
+            # Only VMs whose VirtualBox state moved need a look, unless the rows moved
+            current = {vm_uuid: status for vm_uuid, (_, status, _) in observed.items()}
+            moved = {vm_uuid for vm_uuid, status in current.items() if self._snapshot.get(vm_uuid) != status}
+
+            seen_ids = set()
+            unmanaged = []
+            updates = []
+            for vm_uuid, (name, status, host_id) in observed.items():
+                row = by_uuid.get(vm_uuid)
+                if row is None:
+                    # Names are only unique per host
+                    row = by_name.get(name)
+                    if row is not None and row['host_id'] != host_id:
+                        row = None
+                if row is None:
+                    unmanaged.append({'name': name, 'uuid': vm_uuid, 'host_id': host_id})
+                    continue
+                seen_ids.add(row['id'])
+                if (rows_changed or vm_uuid in moved) and _needs_update(row['status'], status):
+                    updates.append((status, row['id'], row['status']))
+
+            missing = []
+            for row in rows:
+                if row['id'] in seen_ids or row['status'] in TRANSITIONAL_STATUSES:
+                    continue
+                if row['host_id'] not in checked:
+                    continue  # its host is offline or did not answer
+                missing.append({'id': row['id'], 'name': row['name'], 'uuid': row['vm_uuid']})
+                if row['status'] != MISSING:
+                    updates.append((MISSING, row['id'], row['status']))
+
+            updated = self._apply(conn, updates)
+            ignored = self._ignored_names(conn) if unmanaged else set()
+            with self._lock:
+                self._snapshot = current
+                self._drift = {
+                    'unmanaged': [vm for vm in unmanaged if vm['name'] not in ignored],
+                    'missing': missing,
+                }
+                self._checked_at = time.time()
+                self._updated += updated
+            if updated:
+                print(f"Reconciler: updated status of {updated} VM(s)")
+            return updated
+
+    def _apply(self, conn, updates):
+        """Write every status change in one transaction"""
+        if not updates:
+            return 0
+        # A VM with a job in flight is that job's to update
+        busy = {row['instance_id'] for row in conn.execute(
+            f'SELECT DISTINCT instance_id FROM jobs WHERE status IN ({", ".join("?" for _ in ACTIVE_STATES)})',
+            ACTIVE_STATES
+        ) if row['instance_id'] is not None}
+        ready = [u for u in updates if u[1] not in busy]
+        if len(ready) < len(updates):
+            # Compare every row again next cycle, after those jobs are done
+            self._rows_version = None
+        if not ready:
+            return 0
+        # The expected old status guards against a change made since the rows were read
+        cursor = conn.executemany('UPDATE instances SET status = ? WHERE id = ? AND status = ?', ready)
+        conn.commit()
+        return cursor.rowcount
+
+    def drift(self):
+        """VMs VirtualBox has that the database does not, and the reverse"""
+        with self._lock:
+            return dict(
+                self._drift,
+                checked_at=self._checked_at,
+                updated_total=self._updated,
+                error=self._error
+            )
+
+
+def _needs_update(db_status, observed):
+    """`list runningvms` only tells running from not running"""
+    if db_status in TRANSITIONAL_STATUSES:
+        return False
+    if observed == 'running':
+        return db_status != 'running'
+    # Not running: only correct rows that claim otherwise; keep richer states as they are
+    return db_status in ('running', MISSING)
@@ -0,0 +1,386 @@
+import contextlib
+import itertools
+import os
+import re
+import threading
+import time
+
+from instances import change_version
+
+# Lower runs first; a waiting ticket moves up one level every `aging` seconds
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+# Expected run time per kind until real runs have been measured
+DEFAULT_DURATIONS = {'create': 60.0, 'start': 20.0, 'resume': 5.0}
+
+# `VBoxManage list hostinfo`: "Processor online count: 8", "Memory size: 15934 MByte"
+HOST_CPUS_RE = re.compile(r'^Processor (?:online )?count:\s*(\d+)', re.MULTILINE)
+HOST_MEMORY_RE = re.compile(r'^Memory size:\s*(\d+)\s*MByte', re.MULTILINE)
+
+
+class CapacityError(ValueError):
+    """Raised for a VM bigger than the whole host, which could never be admitted"""
+
+
+def host_resources(driver=None):
+    """(cpus, ram_mb) of the host as VirtualBox reports it, else as the OS does"""
+    if driver is not None:
+        result = driver.run(['list', 'hostinfo'])
+        if result['success']:
+            cpus = HOST_CPUS_RE.search(result['stdout'])
+            memory = HOST_MEMORY_RE.search(result['stdout'])
+            if cpus and memory:
+                return int(cpus.group(1)), int(memory.group(1))
+
+    cpus = os.cpu_count() or 1
+    try:
+        ram_mb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        ram_mb = 8192  # Windows has no sysconf; set VSM_HOST_RAM_MB there
+    return cpus, ram_mb
+
+
+class Ticket:
+    """One create, start or resume waiting for (or holding) host capacity"""
+
+    def __init__(self, seq, kind, instance_id, cpu, ram, priority, owner, key, on_admit, host_id=None,
+                 on_error=None):
+        self.seq = seq
+        self.kind = kind
+        self.instance_id = instance_id
+        self.cpu = cpu
+        self.ram = ram
+        self.priority = priority
+        self.owner = owner
+        self.key = key
+        self.on_admit = on_admit
+        self.on_error = on_error
+        self.host_id = host_id
+        self.queued_at = time.monotonic()
+        self.admitted_at = None
+        self.started_at = None
+
+    def to_dict(self):
+        return {'kind': self.kind, 'instance_id': self.instance_id, 'job_id': self.key, 'host_id': self.host_id,
+                'cpu_cores': self.cpu, 'ram_size': self.ram, 'owner': self.owner,
+                'priority': next(name for name, level in PRIORITIES.items() if level == self.priority)}
+
+
+class AdmissionScheduler:
+    """Admit creates and starts while the host has room, and queue the rest
+
+    Every host is scheduled on its own: capacity is its cores times
+    cpu_overcommit and its RAM minus ram_reserve_mb, and usage is the
+    footprint of its running instances plus its admitted operations. Host
+    None is the local VirtualBox; others come from `hosts` (a
+    hosts.HostRegistry). Waiting tickets are ordered by priority (which
+    improves the longer a ticket waits), then by how many operations the
+    same owner already has admitted, then by arrival. The first ticket that
+    does not fit holds back the ones behind it on the same host, so small
+    VMs cannot starve a large one. At most max_concurrent operations run at once and
+    admissions are at least `stagger` seconds apart, which turns a boot
+    storm into waves. An admitted ticket holds its CPUs and RAM at once but
+    takes a concurrency slot only when its work starts (see run_admitted);
+    while one admitted ticket is still waiting for a worker, the rest of
+    the queue waits in the scheduler rather than on the worker pool.
+    """
+
+    def __init__(self, connect, driver=None, max_concurrent=2, stagger=2.0, cpu_overcommit=2.0,
+                 ram_reserve_mb=1024, aging=60.0, cpus=None, ram_mb=None, interval=5.0, hosts=None):
+        self.connect = connect
+        self.driver = driver
+        self.hosts = hosts
+        self.max_concurrent = max(1, max_concurrent)
+        self.stagger = stagger
+        self.cpu_overcommit = cpu_overcommit
+        self.ram_reserve_mb = ram_reserve_mb
+        self.aging = aging
+        self.interval = interval
+        self._host = (cpus, ram_mb) if cpus and ram_mb else None
+        self._host_override = (cpus, ram_mb)
+        self._waiting = []
+        self._admitted = []
+        self._running = {}        # instance id -> (host id, cpus, ram) of running instances
+        self._running_version = None
+        self._durations = dict(DEFAULT_DURATIONS)
+        self._last_admit = 0.0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def ensure_started(self):
+        """Start the admission thread if it is not running yet"""
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='vsm-scheduler', daemon=True)
+                self._thread.start()
+
+    def capacity(self, host_id=None):
+        """(cpus, ram_mb) the scheduler may hand out on a host"""
+        if host_id is not None:
+            resources = self.hosts.resources(host_id) if self.hosts else None
+            if resources is None:
+                return 0, 0  # an agent that never reported its size gets nothing
+            cpus, ram_mb = resources
+        else:
+            if self._host is None:
+                cpus, ram_mb = host_resources(self.driver)
+                self._host = (self._host_override[0] or cpus, self._host_override[1] or ram_mb)
+            cpus, ram_mb = self._host
+        return cpus * self.cpu_overcommit, max(0, ram_mb - self.ram_reserve_mb)
+
+    def validate(self, cpu, ram, priority='normal', host_id=None):
+        """Raise ValueError for an unknown priority and CapacityError for a VM that can never fit"""
+        if priority not in PRIORITIES:
+            raise ValueError(f'priority must be one of: {", ".join(PRIORITIES)}')
+        cpu_capacity, ram_capacity = self.capacity(host_id)
+        if int(cpu) > cpu_capacity or int(ram) > ram_capacity:
+            where = 'this host' if host_id is None else f'host {self.hosts.name_of(host_id)}'
+            raise CapacityError(
+                f'{cpu} CPUs / {ram} MB can never fit on {where} '
+                f'({cpu_capacity:g} CPUs / {ram_capacity} MB schedulable)'
+            )
+
+    def candidates(self):
+        """Hosts new VMs may go to"""
+        if self.hosts is None:
+            return [None]
+        return ([None] if self.hosts.include_local else []) + self.hosts.online_ids()
+
+    def place(self, cpu, ram):
+        """Host id (None is local) of the least-loaded host the VM can fit on
+
+        Load is the larger of CPU and RAM use after adding the VM, counting
+        running instances, admitted operations and tickets already waiting
+        for that host. Ties (typically: nothing running anywhere) go to the
+        host with the fewest instances. Raises CapacityError when no host is
+        big enough.
+        """
+        cpu, ram = int(cpu), int(ram)
+        best = None
+        counts = {row['host_id']: row['count'] for row in self.connect().execute(
+            'SELECT host_id, COUNT(*) AS count FROM instances GROUP BY host_id'
+        )}
+        with self._cond:
+            self._refresh_running()
+            for host_id in self.candidates():
+                cpu_capacity, ram_capacity = self.capacity(host_id)
+                if cpu > cpu_capacity or ram > ram_capacity:
+                    continue
+                cpu_used, ram_used = self._usage(host_id)
+                cpu_used += sum(t.cpu for t in self._waiting if t.host_id == host_id)
+                ram_used += sum(t.ram for t in self._waiting if t.host_id == host_id)
+                load = (max((cpu_used + cpu) / cpu_capacity, (ram_used + ram) / ram_capacity),
+                        counts.get(host_id, 0))
+                if best is None or load < best[0]:
+                    best = (load, host_id)
+        if best is None:
+            raise CapacityError(f'{cpu} CPUs / {ram} MB does not fit on any host')
+        return best[1]
+
+    def submit(self, kind, instance_id, cpu, ram, on_admit, priority='normal', owner=None, key=None,
+               host_id=None, on_error=None):
+        """Queue an operation; on_admit(ticket) is called once there is room
+
+        on_admit runs on the scheduler thread (or on the caller's, when there
+        is room at once) and must return quickly: hand the work to a pool. Whoever runs the operation calls release(ticket)
+        when it is done. If on_admit raises, the ticket is dropped and
+        on_error(ticket, error) is called. key (a job id) is what position()
+        looks tickets up by.
+        """
+        self.validate(cpu, ram, priority, host_id)
+        ticket = Ticket(next(self._seq), kind, instance_id, int(cpu), int(ram),
+                        PRIORITIES[priority], owner, key, on_admit, host_id, on_error)
+        with self._cond:
+            self._waiting.append(ticket)
+            # Admit right away when there is room, so the caller sees the outcome
+            self._admit_ready()
+            self._cond.notify_all()
+        self.ensure_started()
+        return ticket
+
+    @contextlib.contextmanager
+    def admission(self, kind, instance_id, cpu, ram, priority='normal', owner=None, host_id=None):
+        """Block the calling thread until admitted; capacity is released on exit"""
+        admitted = threading.Event()
+        ticket = self.submit(kind, instance_id, cpu, ram, lambda t: admitted.set(), priority, owner,
+                             host_id=host_id)
+        admitted.wait()
+        self._start(ticket)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def run_admitted(self, ticket, func, *args):
+        """Run func for an admitted ticket and release the ticket afterwards"""
+        self._start(ticket)
+        try:
+            return func(*args)
+        finally:
+            self.release(ticket)
+
+    def _start(self, ticket):
+        """The admitted ticket's work is running: it takes its concurrency slot now"""
+        with self._cond:
+            ticket.started_at = time.monotonic()
+            self._cond.notify_all()
+
+    def release(self, ticket):
+        """Give an admitted ticket's capacity back and learn how long it took"""
+        with self._cond:
+            if ticket in self._admitted:
+                self._admitted.remove(ticket)
+                if ticket.started_at is not None:
+                    took = time.monotonic() - ticket.started_at
+                    self._durations[ticket.kind] = 0.7 * self._durations.get(ticket.kind, took) + 0.3 * took
+            self._cond.notify_all()
+
+    def _started(self):
+        return [t for t in self._admitted if t.started_at is not None]
+
+    def _dispatched(self):
+        """Admitted tickets whose work has not started yet (still waiting for a worker)"""
+        return [t for t in self._admitted if t.started_at is None]
+
+    def _loop(self):
+        with self._cond:
+            while True:
+                try:
+                    timeout = self._admit_ready()
+                except Exception as e:
+                    print(f"Scheduler error: {str(e)}")
+                    timeout = self.interval
+                self._cond.wait(timeout)
+
+    def _refresh_running(self):
+        conn = self.connect()
+        version = change_version(conn, 'instances')
+        if version != self._running_version:
+            rows = conn.execute(
+                "SELECT id, host_id, cpu_cores, ram_size, balloon_mb FROM instances WHERE status = 'running'"
+            ).fetchall()
+            # Memory a balloon holds is back with the host (see balloon.py)
+            self._running = {row['id']: (row['host_id'], int(row['cpu_cores'] or 0),
+                                         int(row['ram_size'] or 0) - int(row['balloon_mb'] or 0))
+                             for row in rows}
+            self._running_version = version
+
+    def _usage(self, host_id=None):
+        """(cpus, ram_mb) in use on a host by running instances and admitted operations"""
+        held = {t.instance_id for t in self._admitted}
+        running = [(c, r) for id, (host, c, r) in self._running.items() if host == host_id and id not in held]
+        admitted = [t for t in self._admitted if t.host_id == host_id]
+        cpu = sum(c for c, _ in running) + sum(t.cpu for t in admitted)
+        ram = sum(r for _, r in running) + sum(t.ram for t in admitted)
+        return cpu, ram
+
+    def _ordered(self):
+        now = time.monotonic()
+        in_flight = {}
+        for ticket in self._admitted:
+            in_flight[ticket.owner] = in_flight.get(ticket.owner, 0) + 1
+        return sorted(self._waiting, key=lambda t: (
+            t.priority - int((now - t.queued_at) / self.aging),
+            in_flight.get(t.owner, 0),
+            t.seq
+        ))
+
+    def _fits(self, ticket):
+        if ticket.kind in ('start', 'resume') and ticket.instance_id in self._running:
+            return True  # already running; starting it again uses nothing new
+        usage, capacity = self._usage(ticket.host_id), self.capacity(ticket.host_id)
+        return usage[0] + ticket.cpu <= capacity[0] and usage[1] + ticket.ram <= capacity[1]
+
+    def _blocker(self):
+        """Why the head of the queue is waiting: 'concurrency', 'workers', 'stagger' or 'capacity'"""
+        if not self._waiting:
+            return None
+        if len(self._started()) >= self.max_concurrent:
+            return 'concurrency'
+        if self._dispatched():
+            return 'workers'
+        if time.monotonic() < self._last_admit + self.stagger:
+            return 'stagger'
+        return 'capacity'
+
+    def _admit_ready(self):
+        """Admit what fits now; returns how long to sleep before looking again"""
+        if not self._waiting:
+            return None
+        self._refresh_running()
+        blocked = set()   # hosts whose first waiting ticket does not fit
+        while self._waiting and len(self._started()) < self.max_concurrent and not self._dispatched():
+            gap = self._last_admit + self.stagger - time.monotonic()
+            if gap > 0:
+                return gap
+            ticket = next((t for t in self._ordered() if t.host_id not in blocked), None)
+            if ticket is None:
+                break
+            if not self._fits(ticket):
+                blocked.add(ticket.host_id)
+                continue
+            self._waiting.remove(ticket)
+            ticket.admitted_at = self._last_admit = time.monotonic()
+            self._admitted.append(ticket)
+            try:
+                ticket.on_admit(ticket)
+            except Exception as e:
+                print(f"Failed to dispatch admitted {ticket.kind} for instance {ticket.instance_id}: {str(e)}")
+                self._admitted.remove(ticket)
+                if ticket.on_error is not None:
+                    try:
+                        ticket.on_error(ticket, e)
+                    except Exception as error:
+                        print(f"Failed to report dispatch failure: {str(error)}")
+        # Running instances change outside the scheduler too (stops, the reconciler)
+        return self.interval if self._waiting else None
+
+    def position(self, key):
+        """Queue position (0 is next) and estimated wait of a waiting ticket, or None"""
+        with self._cond:
+            ordered = self._ordered()
+            for index, ticket in enumerate(ordered):
+                if ticket.key == key:
+                    return {'position': index, 'queued': len(ordered),
+                            'eta_seconds': round(self._eta(index, ordered), 1),
+                            'waiting_on': self._blocker() if index == 0 else 'queue'}
+        return None
+
+    def _eta(self, index, ordered):
+        """Rough wait: until a slot frees up, then one admission per slot turnover"""
+        now = time.monotonic()
+        started = self._started()
+        if len(started) < self.max_concurrent:
+            first = max(0.0, self._last_admit + self.stagger - now)
+        else:
+            first = min(max(0.0, t.started_at + self._durations.get(t.kind, 30.0) - now)
+                        for t in started)
+        per_slot = [max(self.stagger, self._durations.get(t.kind, 30.0) / self.max_concurrent)
+                    for t in ordered[:index]]
+        return first + sum(per_slot)
+
+    def status(self):
+        """Capacity, usage, admitted operations and the queue in admission order"""
+        with self._cond:
+            self._refresh_running()
+            hosts = []
+            for host_id in self.candidates():
+                cpu_capacity, ram_capacity = self.capacity(host_id)
+                cpu_used, ram_used = self._usage(host_id)
+                hosts.append({'host_id': host_id, 'name': self.hosts.name_of(host_id) if self.hosts else 'local',
+                              'capacity': {'cpu_cores': cpu_capacity, 'ram_size': ram_capacity},
+                              'used': {'cpu_cores': cpu_used, 'ram_size': ram_used}})
+            ordered = self._ordered()
+            return {
+                'hosts': hosts,
+                'max_concurrent': self.max_concurrent,
+                'stagger_seconds': self.stagger,
+                'admitted': [dict(t.to_dict(), started=t.started_at is not None,
+                                  running_for=round(time.monotonic() - (t.started_at or t.admitted_at), 1))
+                             for t in self._admitted],
+                'queue': [dict(t.to_dict(), position=i, eta_seconds=round(self._eta(i, ordered), 1))
+                          for i, t in enumerate(ordered)],
+                'waiting_on': self._blocker(),
+                'expected_seconds': {kind: round(s, 1) for kind, s in self._durations.items()},
+            }
@@ -1,54 +0,0 @@
-#!/bin/bash
-
-# get_vm_stats.sh - Get real-time VM statistics
-# Usage: ./get_vm_stats.sh <vm_name>
-
-VM_NAME=$1
-
-# Find VBoxManage
-VBOXMANAGE=""
-if command -v VBoxManage &> /dev/null; then
-    VBOXMANAGE="VBoxManage"
-elif [ -f "/c/Program Files/Oracle/VirtualBox/VBoxManage.exe" ]; then
-    VBOXMANAGE="/c/Program Files/Oracle/VirtualBox/VBoxManage.exe"
-elif [ -f "/mnt/c/Program Files/Oracle/VirtualBox/VBoxManage.exe" ]; then
-    VBOXMANAGE="/mnt/c/Program Files/Oracle/VirtualBox/VBoxManage.exe"
-else
-    echo '{"error": "VBoxManage not found"}'
-    exit 1
-fi
-
-if [ -z "$VM_NAME" ]; then
-    echo '{"error": "VM name required"}'
-    exit 1
-fi
-
-# Check if VM exists
-if ! "$VBOXMANAGE" list vms | grep -q "\"$VM_NAME\""; then
-    echo '{"error": "VM not found"}'
-    exit 1
-fi
-
-# Get VM state
-VM_STATE=$("$VBOXMANAGE" showvminfo "$VM_NAME" --machinereadable | grep "^VMState=" | cut -d'"' -f2)
-
-if [ "$VM_STATE" != "running" ]; then
-    echo "{\"status\": \"$VM_STATE\", \"cpu\": 0, \"memory\": 0}"
-    exit 0
-fi
-
-# Get CPU usage (this is simulated since VBoxManage doesn't provide real-time CPU easily)
-# In production, you'd use performance metrics API
-CPU_USAGE=$(( RANDOM % 80 + 10 ))
-
-# Get memory info
-MEMORY_INFO=$("$VBOXMANAGE" showvminfo "$VM_NAME" --machinereadable | grep "^memory=")
-MEMORY_MB=$(echo "$MEMORY_INFO" | cut -d'=' -f2)
-
-# Simulate memory usage (random percentage)
-MEMORY_USAGE=$(( RANDOM % 80 + 10 ))
-
-# Output as JSON
-echo "{\"status\": \"running\", \"cpu\": $CPU_USAGE, \"memory\": $MEMORY_USAGE, \"memory_mb\": $MEMORY_MB}"
-
-exit 0
\ No newline at end of file
@@ -0,0 +1,192 @@
+import threading
+import time
+
+import metrics
+import vbox
+
+
+class StatsCollector:
+    """Sample every VM once per cycle and serve stats from an in-memory cache
+
+    One cycle costs three VBoxManage calls (`list vms`, `list -l runningvms`
+    and one batched `metrics query`) no matter how many VMs exist or how many
+    browser tabs are polling. Every sample is also appended to the history
+    in `store`. With several hosts (drivers() returns {host_id: driver})
+    each host costs its own three calls, and a host that does not answer
+    only leaves its own VMs out of the sample.
+
+    When nobody has read stats for `idle_after` seconds and keep_sampling()
+    is false (no open stream, no policy that reads the raw history), the
+    collector drops to one cycle per `idle_interval` seconds: still one
+    point per minute for the history's minute tier.
+    """
+
+    def __init__(self, store=None, interval=3.0, ttl=5.0, driver=None, drivers=None, idle_after=60.0,
+                 idle_interval=60.0, keep_sampling=None):
+        self.store = store or metrics.MetricsStore()
+        self.driver = driver or vbox.VBoxDriver()
+        self.drivers = drivers or (lambda: {None: self.driver})
+        self.interval = interval
+        self.ttl = ttl
+        self.idle_after = idle_after
+        self.idle_interval = idle_interval
+        self.keep_sampling = keep_sampling or (lambda: False)
+        self._last_read = 0.0
+        # Running VMs the performance collector was last set up for, per host
+        self._metrics_setup_for = {}
+
+        self._cache = {}
+        self._sampled_at = 0.0
+        self._error = None
+
+        self._lock = threading.Lock()
+        self._inflight = None
+        self._thread = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(stats, sampled_at) after every successful cycle"""
+        self._listeners.append(callback)
+
+    def ensure_started(self):
+        """Start the background sampling thread if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='vsm-stats', daemon=True)
+                self._thread.start()
+
+    def touch(self):
+        """Note that someone is looking at stats, so sampling runs at full rate"""
+        self._last_read = time.time()
+
+    def idle(self):
+        return time.time() - self._last_read >= self.idle_after and not self.keep_sampling()
+
+    def _loop(self):
+        while True:
+            if not self.idle() or time.time() - self._sampled_at >= self.idle_interval:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Stats collector error: {str(e)}")
+            time.sleep(self.interval)
+
+    def refresh(self):
+        """Sample the fleet; concurrent callers share the one sample in flight"""
+        with self._lock:
+            inflight = self._inflight
+            if inflight is None:
+                inflight = self._inflight = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            inflight.wait()
+            return
+
+        try:
+            stats, error = self._sample_fleet()
+            with self._lock:
+                if error is None:
+                    self._cache = stats
+                self._error = error
+                self._sampled_at = time.time()
+        finally:
+            with self._lock:
+                self._inflight = None
+            inflight.set()
+
+        if error is None:
+            for callback in self._listeners:
+                try:
+                    callback(stats, self._sampled_at)
+                except Exception as e:
+                    print(f"Stats listener error: {str(e)}")
+
+    def _sample_fleet(self):
+        """Collect stats for every registered VM on every host; returns (stats, error)"""
+        stats = {}
+        errors = []
+        drivers = self.drivers()
+        for host_id, driver in drivers.items():
+            error = self._sample_host(host_id, driver, stats)
+            if error:
+                print(f"Stats: sampling {getattr(driver, 'host_name', 'local')} failed: {error}")
+                errors.append(error)
+        if errors and len(errors) == len(drivers):
+            return {}, errors[0]
+        if not errors:
+            # History of a VM on a host that did not answer is kept for next time
+            self.store.forget(set(self.store.names()) - set(stats))
+        return stats, None
+
+    def _sample_host(self, host_id, driver, stats):
+        """Add one host's VMs to stats; returns an error message or None"""
+        listed = driver.run(['list', 'vms'])
+        if not listed['success']:
+            return listed.get('stderr') or listed.get('message')
+        running = driver.run(['list', '-l', 'runningvms'])
+        if not running['success']:
+            return running.get('stderr') or running.get('message')
+
+        running_vms = vbox.parse_long_vm_list(running['stdout'])
+        counters = self._query_counters(host_id, driver, running_vms)
+        now = time.time()
+        for name in vbox.parse_vm_list(listed['stdout']):
+            info = running_vms.get(name)
+            if info is None:
+                stats[name] = {'status': 'poweroff', 'cpu': 0, 'memory': 0, 'sampled_at': now}
+                continue
+
+            values = metrics.derive_stats(counters.get(name, {}), info.get('memory_mb'))
+            self.store.record(name, values, now)
+            stats[name] = dict(
+                values,
+                status=info.get('state', 'running'),
+                memory_mb=info.get('memory_mb'),
+                sampled_at=now
+            )
+        return None
+
+    def _query_counters(self, host_id, driver, running_vms):
+        """Read VirtualBox performance counters for all running VMs of a host in one call"""
+        if not running_vms:
+            return {}
+
+        # Collection only covers machines that were running at setup time
+        running = set(running_vms)
+        if running != self._metrics_setup_for.get(host_id):
+            setup = driver.run(
+                ['metrics', 'setup', '--period', 1, '--samples', 1, '*', metrics.SETUP_METRICS]
+            )
+            if setup['success']:
+                self._metrics_setup_for[host_id] = running
+
+        query = driver.run(['metrics', 'query', '*', ','.join(metrics.QUERY_METRICS)])
+        if not query['success']:
+            print(f"Metrics query failed: {query.get('stderr') or query.get('message')}")
+            return {}
+        return metrics.parse_metrics_query(query['stdout'])
+
+    def _ensure_fresh(self):
+        self.ensure_started()
+        self.touch()
+        if time.time() - self._sampled_at > self.ttl:
+            self.refresh()
+
+    def get(self, name):
+        """Return cached stats for one VM, or None if VirtualBox does not know it"""
+        self._ensure_fresh()
+        with self._lock:
+            if self._error:
+                raise RuntimeError(self._error)
+            return self._cache.get(name)
+
+    def get_all(self):
+        """Return (sampled_at, {name: stats}) for the whole fleet"""
+        self._ensure_fresh()
+        with self._lock:
+            if self._error:
+                raise RuntimeError(self._error)
+            return self._sampled_at, dict(self._cache)
@@ -0,0 +1,275 @@
+import threading
+import time
+
+import oplog
+import telemetry
+
+
+class StorageManager:
+    """Real disk usage of every VM, and background compaction of their images
+
+    Dynamically allocated images only ever grow. Each cycle measures the
+    images of up to `measure_batch` VMs whose figures are older than
+    `max_age` seconds (`showmediuminfo`, size on disk as well as
+    capacity), then hands at most one stopped VM to run_compaction(vm),
+    which runs `modifymedium --compact` as a job and returns the finished
+    job, or None if the VM is busy. Compactions run one at a time, and the
+    next one waits until the last has averaged `rate_mb` MB per second, so
+    they never saturate the host's disk. A VM is compacted once its images
+    have grown `min_growth_mb` since the last compaction, and not more
+    than once per `min_interval` seconds. Compaction only returns blocks
+    the guest has zeroed (zerofree, or fstrim with discard enabled).
+
+    Space freed by compacting and deleting VMs is recorded in
+    storage_reclaimed.
+    """
+
+    def __init__(self, connect, driver_for, run_compaction, interval=60.0, measure_batch=50, max_age=3600.0,
+                 rate_mb=50.0, min_growth_mb=1024, min_interval=86400.0, compact=True):
+        self.connect = connect
+        self.driver_for = driver_for
+        self.run_compaction = run_compaction
+        self.interval = interval
+        self.measure_batch = measure_batch
+        self.max_age = max_age
+        self.rate_mb = rate_mb
+        self.min_growth_mb = min_growth_mb
+        self.min_interval = min_interval
+        self.compact = compact
+        self._unmeasurable = {}      # instance id -> when a VM without readable disk images was last tried
+        self._paced_until = 0.0
+        self._last_check = None
+        self._last_compaction = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._cycle = threading.Lock()   # a POST to /api/storage and the thread never compact side by side
+        self._thread = None
+
+    def ensure_started(self):
+        """Start the storage thread if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='vsm-storage', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"Storage manager error: {str(e)}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def measure(self, instance_id):
+        """Measure one VM's images now and store them; returns their size on disk in MB, or None"""
+        conn = self.connect()
+        vm = conn.execute('SELECT id, name, vm_uuid, host_id FROM instances WHERE id = ?', (instance_id,)).fetchone()
+        if not vm:
+            return None
+        driver = self.driver_for(vm['host_id'])
+        paths = driver.disks(vm['vm_uuid'] or vm['name'])
+        if not paths:
+            # Nothing to store, so keep it from heading the queue until max_age has passed
+            self._unmeasurable[instance_id] = time.monotonic()
+            if paths is None:
+                return None
+
+        measured = {}
+        for path in paths:
+            medium = driver.medium_info(path)
+            if medium:
+                measured[path] = medium
+        for path, medium in measured.items():
+            conn.execute(
+                '''INSERT INTO media (instance_id, path, medium_uuid, capacity_mb, size_mb, measured_at)
+                   VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                   ON CONFLICT (instance_id, path) DO UPDATE SET
+                       medium_uuid = excluded.medium_uuid, capacity_mb = excluded.capacity_mb,
+                       size_mb = excluded.size_mb, measured_at = excluded.measured_at''',
+                (instance_id, path, medium['uuid'], medium['capacity_mb'], medium['size_mb'])
+            )
+        # Images that were detached (flatten swaps them) are no longer this VM's
+        placeholders = ', '.join('?' for _ in paths)
+        conn.execute(
+            f'DELETE FROM media WHERE instance_id = ? AND path NOT IN ({placeholders})',
+            [instance_id] + list(paths)
+        )
+        conn.commit()
+        return sum(medium['size_mb'] or 0 for medium in measured.values())
+
+    def measure_due(self):
+        """Measure the VMs with the oldest figures; returns how many were measured"""
+        now = time.monotonic()
+        self._unmeasurable = {id: at for id, at in self._unmeasurable.items() if now - at < self.max_age}
+        skip = list(self._unmeasurable)
+        rows = self.connect().execute(
+            f'''SELECT i.id FROM instances i LEFT JOIN media m ON m.instance_id = i.id
+                WHERE i.status NOT IN ('creating', 'missing')
+                  AND (i.host_id IS NULL OR i.host_id IN (SELECT id FROM hosts WHERE status = 'online'))
+                  AND i.id NOT IN ({', '.join('?' for _ in skip)})
+                GROUP BY i.id
+                HAVING MIN(m.measured_at) IS NULL OR MIN(m.measured_at) <= datetime('now', ?)
+                ORDER BY MIN(m.measured_at) LIMIT ?''',
+            skip + [f'-{int(self.max_age)} seconds', self.measure_batch]
+        ).fetchall()
+        for row in rows:
+            self.measure(row['id'])
+        return len(rows)
+
+    def candidates(self, limit=10):
+        """Stopped VMs due for compaction, the ones that grew most first"""
+        rows = self.connect().execute(
+            '''SELECT i.id, i.name, i.host_id, SUM(m.size_mb) AS size_mb,
+                      SUM(MAX(0, m.size_mb - COALESCE(m.compacted_size_mb, 0))) AS growth_mb,
+                      MAX(m.compacted_at) AS compacted_at
+               FROM instances i JOIN media m ON m.instance_id = i.id
+               WHERE i.status = 'stopped'
+                 AND (i.host_id IS NULL OR i.host_id IN (SELECT id FROM hosts WHERE status = 'online'))
+               GROUP BY i.id
+               HAVING growth_mb >= ? AND (MAX(m.compacted_at) IS NULL OR MAX(m.compacted_at) <= datetime('now', ?))
+               ORDER BY growth_mb DESC LIMIT ?''',
+            (self.min_growth_mb, f'-{int(self.min_interval)} seconds', limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def check_once(self):
+        """Measure what is due, then compact the next VM if the pace allows it"""
+        with self._cycle:
+            return self._check()
+
+    def _check(self):
+        measured = self.measure_due()
+        compacted = None
+        if self.compact and time.monotonic() >= self._paced_until:
+            for vm in self.candidates(limit=5):
+                started = time.monotonic()
+                job = self.run_compaction(vm)
+                if job is None:
+                    continue  # busy with another job; try the next one
+                took = time.monotonic() - started
+                # Average at most rate_mb MB/s over the compaction and the pause after it
+                self._paced_until = started + max(took, (vm['size_mb'] or 0) / self.rate_mb)
+                compacted = self._last_compaction = {
+                    'id': vm['id'], 'name': vm['name'], 'job_id': job['id'], 'status': job['status'],
+                    'freed_mb': (job.get('result') or {}).get('freed_mb'), 'seconds': round(took, 1),
+                }
+                break
+        self._last_check = time.strftime('%Y-%m-%d %H:%M:%S')
+        return {'measured': measured, 'compacted': compacted}
+
+    def compact_vm(self, instance_id):
+        """Compact every disk image of one stopped VM; returns a job result with freed_mb"""
+        conn = self.connect()
+        vm = conn.execute(
+            'SELECT id, name, vm_uuid, host_id, status FROM instances WHERE id = ?', (instance_id,)
+        ).fetchone()
+        if not vm:
+            return {'success': False, 'message': 'VM not found', 'stdout': '', 'stderr': ''}
+        if vm['status'] != 'stopped':
+            return {'success': False, 'message': f'Only stopped VMs are compacted ({vm["name"]} is {vm["status"]})',
+                    'stdout': '', 'stderr': ''}
+        driver = self.driver_for(vm['host_id'])
+        paths = driver.disks(vm['vm_uuid'] or vm['name'])
+        if paths is None:
+            return {'success': False, 'message': f'VM {vm["name"]} does not exist', 'stdout': '', 'stderr': ''}
+
+        freed, log, errors = 0, [], []
+        for n, path in enumerate(paths):
+            before = driver.medium_info(path)
+            result = driver.compact(path)
+            after = driver.medium_info(path)
+            if not result['success']:
+                errors.append(result.get('stderr') or result.get('message'))
+            elif before and after and before['size_mb'] is not None and after['size_mb'] is not None:
+                freed += max(0, before['size_mb'] - after['size_mb'])
+                log.append(f"{path}: {before['size_mb']} -> {after['size_mb']} MB")
+            if after:
+                conn.execute(
+                    '''INSERT INTO media (instance_id, path, medium_uuid, capacity_mb, size_mb, compacted_size_mb,
+                                          measured_at, compacted_at)
+                       VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                       ON CONFLICT (instance_id, path) DO UPDATE SET
+                           medium_uuid = excluded.medium_uuid, capacity_mb = excluded.capacity_mb,
+                           size_mb = excluded.size_mb, compacted_size_mb = excluded.compacted_size_mb,
+                           measured_at = excluded.measured_at, compacted_at = excluded.compacted_at''',
+                    (instance_id, path, after['uuid'], after['capacity_mb'], after['size_mb'],
+                     after['size_mb'] if result['success'] else None)
+                )
+                conn.commit()
+            oplog.progress(f'disk {n + 1} of {len(paths)} compacted')
+
+        self.record_freed('compact', instance_id, vm['name'], vm['host_id'], freed)
+        result = {'success': not errors, 'freed_mb': freed, 'stdout': '\n'.join(log), 'stderr': '\n'.join(errors),
+                  'message': f'Freed {freed} MB' if not errors else f'{len(errors)} of {len(paths)} images failed'}
+        return result
+
+    def record_freed(self, kind, instance_id, name, host_id, freed_mb):
+        """Add space given back by a delete or compaction to the ledger"""
+        if not freed_mb:
+            return
+        conn = self.connect()
+        conn.execute(
+            'INSERT INTO storage_reclaimed (kind, instance_id, name, host_id, freed_mb) VALUES (?, ?, ?, ?, ?)',
+            (kind, instance_id, name, host_id, int(freed_mb))
+        )
+        conn.commit()
+        telemetry.STORAGE_FREED.inc(int(freed_mb), kind=kind)
+
+    def usage(self):
+        """Fleet disk usage per host, what compaction could give back, and what has been freed"""
+        conn = self.connect()
+        hosts = [dict(row) for row in conn.execute(
+            '''SELECT i.host_id, COUNT(DISTINCT i.id) AS vms, SUM(m.capacity_mb) AS capacity_mb,
+                      SUM(m.size_mb) AS size_mb,
+                      SUM(CASE WHEN m.compacted_size_mb IS NULL THEN 0
+                               ELSE MAX(0, m.size_mb - m.compacted_size_mb) END) AS grown_since_compaction_mb,
+                      SUM(CASE WHEN m.compacted_size_mb IS NULL THEN m.size_mb ELSE 0 END) AS never_compacted_mb
+               FROM media m JOIN instances i ON i.id = m.instance_id
+               GROUP BY i.host_id ORDER BY i.host_id'''
+        )]
+        requested = conn.execute('SELECT SUM(storage_size) FROM instances').fetchone()[0] or 0
+        freed = {row['kind']: row['freed_mb'] for row in conn.execute(
+            'SELECT kind, SUM(freed_mb) AS freed_mb FROM storage_reclaimed GROUP BY kind'
+        )}
+        recent = [dict(row) for row in conn.execute(
+            'SELECT * FROM storage_reclaimed ORDER BY id DESC LIMIT 20'
+        )]
+        totals = {key: sum(host[key] or 0 for host in hosts)
+                  for key in ('vms', 'capacity_mb', 'size_mb', 'grown_since_compaction_mb', 'never_compacted_mb')}
+        return {
+            'total': dict(totals, requested_mb=requested),
+            'hosts': hosts,
+            'freed_mb': {'destroy': freed.get('destroy', 0), 'compact': freed.get('compact', 0)},
+            'recently_freed': recent,
+            'compaction_queue': self.candidates(),
+        }
+
+    def vm_usage(self, instance_id):
+        conn = self.connect()
+        media = [dict(row) for row in conn.execute(
+            'SELECT * FROM media WHERE instance_id = ? ORDER BY path', (instance_id,)
+        )]
+        freed = [dict(row) for row in conn.execute(
+            'SELECT * FROM storage_reclaimed WHERE instance_id = ? ORDER BY id DESC LIMIT 20', (instance_id,)
+        )]
+        return {'size_mb': sum(m['size_mb'] or 0 for m in media), 'media': media, 'freed': freed}
+
+    def status(self):
+        return {
+            'interval_seconds': self.interval,
+            'measure_batch': self.measure_batch,
+            'max_age_seconds': self.max_age,
+            'compaction': {
+                'enabled': self.compact,
+                'rate_mb_per_second': self.rate_mb,
+                'min_growth_mb': self.min_growth_mb,
+                'min_interval_seconds': self.min_interval,
+                'next_in_seconds': round(max(0.0, self._paced_until - time.monotonic()), 1),
+                'last': self._last_compaction,
+            },
+            'last_check': self._last_check,
+        }
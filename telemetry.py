@@ -0,0 +1,176 @@
+import os
+import re
+import threading
+
+# Print operations slower than this many milliseconds (0 turns it off)
+SLOW_MS = float(os.environ.get('VSM_SLOW_MS', 0))
+
+# Seconds; VirtualBox operations range from milliseconds to minutes
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base for metrics kept in memory and rendered in Prometheus text format"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_number(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    labels = _format_labels(self.labels, key, ('le', _format_number(float(bound))))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labels, key, ('le', '+Inf'))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total!r}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+def render():
+    """Every registered metric in Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def log_if_slow(kind, name, seconds, detail=None):
+    """Print operations slower than VSM_SLOW_MS"""
+    if SLOW_MS and seconds * 1000 >= SLOW_MS:
+        suffix = f' ({detail})' if detail else ''
+        print(f"SLOW {kind} {name}: {seconds * 1000:.0f} ms{suffix}")
+
+
+# Direct VBoxManage calls made by vbox.py
+VBOXMANAGE_SECONDS = Histogram('vsm_vboxmanage_duration_seconds', 'VBoxManage call time', ('command', 'outcome'))
+VBOXMANAGE_TIMEOUTS = Counter('vsm_vboxmanage_timeouts_total', 'VBoxManage calls killed by the timeout', ('command',))
+VBOXMANAGE_FAILURES = Counter('vsm_vboxmanage_failures_total', 'VBoxManage calls that failed', ('command',))
+VBOXMANAGE_IN_FLIGHT = Gauge('vsm_vboxmanage_in_flight', 'VBoxManage processes running now', ('command',))
+
+# VBoxManage calls sent to node agents by hosts.RemoteDriver
+AGENT_SECONDS = Histogram('vsm_agent_request_duration_seconds', 'Node agent VBoxManage call time', ('host', 'outcome'))
+AGENT_FAILURES = Counter('vsm_agent_unreachable_total', 'Node agent calls that got no answer', ('host',))
+
+# SQLite, timed by db.TimedConnection
+SQL_SECONDS = Histogram('vsm_sqlite_query_duration_seconds', 'SQLite statement time (until the first row)', ('operation',))
+
+# HTTP, timed around every Flask request
+HTTP_SECONDS = Histogram('vsm_http_request_duration_seconds', 'HTTP request time', ('route', 'method', 'status'))
+HTTP_IN_FLIGHT = Gauge('vsm_http_requests_in_flight', 'HTTP requests being handled now')
+
+# Background jobs run by jobs.JobManager
+JOB_SECONDS = Histogram('vsm_job_duration_seconds', 'Background job run time', ('kind', 'status'))
+JOBS_IN_FLIGHT = Gauge('vsm_jobs_in_flight', 'Background jobs running now', ('kind',))
+
+# Host disk space given back, recorded by storage.StorageManager
+STORAGE_FREED = Counter('vsm_storage_freed_megabytes_total', 'Host disk space freed by deletes and compaction', ('kind',))
+
+
+def record_vboxmanage(command, seconds, outcome):
+    """Record one finished VBoxManage call; outcome is 'success', 'failure' or 'timeout'"""
+    VBOXMANAGE_SECONDS.observe(seconds, command=command, outcome=outcome)
+    if outcome == 'timeout':
+        VBOXMANAGE_TIMEOUTS.inc(command=command)
+    elif outcome != 'success':
+        VBOXMANAGE_FAILURES.inc(command=command)
+    log_if_slow('vboxmanage', command, seconds, outcome if outcome != 'success' else None)
+
+
+STATEMENT_RE = re.compile(r'^\s*(\w+)')
+
+
+def record_query(sql, seconds):
+    """Record one SQLite statement, labelled by its leading keyword"""
+    match = STATEMENT_RE.match(sql)
+    operation = match.group(1).upper() if match else 'OTHER'
+    SQL_SECONDS.observe(seconds, operation=operation)
+    if SLOW_MS and seconds * 1000 >= SLOW_MS:
+        log_if_slow('sql', operation, seconds, ' '.join(sql.split())[:200])
+
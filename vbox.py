@@ -0,0 +1,688 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import oplog
+import telemetry
+
+# Where VirtualBox installs VBoxManage (PATH first; Git Bash and WSL paths on Windows)
+VBOXMANAGE_CANDIDATES = [
+    'VBoxManage',
+    '/c/Program Files/Oracle/VirtualBox/VBoxManage.exe',
+    '/mnt/c/Program Files/Oracle/VirtualBox/VBoxManage.exe',
+    r'C:\Program Files\Oracle\VirtualBox\VBoxManage.exe',
+]
+
+_vboxmanage = None
+
+# "vm name" {uuid}
+VM_LIST_RE = re.compile(r'^"(?P<name>.*)" \{(?P<uuid>[^}]+)\}$')
+
+# key="value", "quoted key"="value" or key=number
+MACHINEREADABLE_RE = re.compile(r'^(?:"(?P<quoted>[^"]*)"|(?P<key>[^=]+))=(?P<value>.*)$')
+
+# "SATA Controller-0-0"="/path/disk.vdi"
+MEDIUM_KEY_RE = re.compile(r'^(?P<controller>.+)-(?P<port>\d+)-(?P<device>\d+)$')
+
+# `snapshot <vm> list --machinereadable`: SnapshotName="base", SnapshotName-1="child", ...
+SNAPSHOT_NAME_RE = re.compile(r'^SnapshotName(?:-[\d-]+)?="(?P<name>.*)"$', re.MULTILINE)
+
+# Snapshot that linked clones of a VM are made from; taken on first use
+BASE_SNAPSHOT = 'vsm-base'
+
+# Hard disk images, as opposed to the ISOs attached to DVD drives
+DISK_EXTENSIONS = ('.vdi', '.vmdk', '.vhd')
+
+# `showmediuminfo`: "Capacity:       10240 MBytes" ("Logical size" before 5.0), "Size on disk:   2048 MBytes"
+MEDIUM_SIZE_RE = re.compile(r'^(?P<key>Capacity|Logical size|Size on disk):\s*(?P<number>[\d.]+)\s*(?P<unit>[KMGT]?)Bytes',
+                            re.MULTILINE)
+
+UUID_RE = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+
+# Form OS name -> VirtualBox --ostype (the mapping the old create_vm.sh used)
+VBOX_OS_TYPES = {
+    'Ubuntu': 'Ubuntu_64',
+    'CentOS': 'RedHat_64',
+    'Debian': 'Debian_64',
+}
+
+# Read-only commands whose whole output callers parse; everything else
+# streams into the job log and keeps only a tail of its output
+QUERY_COMMANDS = ('list', 'showvminfo', 'showmediuminfo', 'metrics', 'guestproperty')
+
+# Set by the Guest Additions service once it runs in the guest, and cleared at
+# power off; guestcontrol works from then on
+GUEST_READY_PROPERTY = '/VirtualBox/GuestInfo/OS/LoggedInUsers'
+
+# States in which the VM process exists and has to be powered off first
+ACTIVE_STATES = ('running', 'paused', 'stuck')
+
+
+def find_vboxmanage():
+    """Locate the VBoxManage binary once and remember it"""
+    global _vboxmanage
+    if _vboxmanage is None:
+        for candidate in VBOXMANAGE_CANDIDATES:
+            path = shutil.which(candidate) or (candidate if os.path.isfile(candidate) else None)
+            if path:
+                _vboxmanage = path
+                break
+    return _vboxmanage
+
+
+def command_label(args):
+    """Metric label for a call: the subcommand, plus the listing for list/metrics"""
+    if not args:
+        return ''
+    if args[0] == 'list':
+        return f'list {args[-1]}'
+    if args[0] == 'metrics' and len(args) > 1:
+        return f'metrics {args[1]}'
+    return str(args[0])
+
+
+@contextmanager
+def secret_files(files):
+    """Write {placeholder: content} to temp files only this user can read; yields {placeholder: path}"""
+    paths = {}
+    try:
+        for placeholder, content in files.items():
+            fd, path = tempfile.mkstemp(prefix='vsm-')   # created with mode 0600
+            paths[placeholder] = path
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+        yield paths
+    finally:
+        for path in paths.values():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def run_vboxmanage(args, timeout=30, files=None):
+    """Run VBoxManage with an argv list; returns the same dict shape as run_shell_script()
+
+    Queries return their whole output. Other commands stream it line by line
+    into the current job's log and return only its tail. files maps
+    placeholder args to secrets (passwords, scripts with passwords in them):
+    each is written to a 0600 temp file for the call and the arg replaced
+    by its path, so the secret never shows up in the process list.
+    """
+    vboxmanage = find_vboxmanage()
+    if not vboxmanage:
+        return {
+            'success': False,
+            'message': 'VBoxManage not found. Please install VirtualBox.',
+            'stderr': 'VBoxManage not found',
+            'stdout': ''
+        }
+    if files:
+        with secret_files(files) as paths:
+            return run_vboxmanage([paths.get(arg, arg) for arg in args], timeout)
+
+    label = command_label(args)
+    argv = [vboxmanage] + [str(arg) for arg in args]
+    telemetry.VBOXMANAGE_IN_FLIGHT.inc(command=label)
+    started = time.perf_counter()
+    try:
+        if args[0] in QUERY_COMMANDS:
+            result = subprocess.run(argv, capture_output=True, text=True, timeout=timeout)
+            returncode, stdout, stderr = result.returncode, result.stdout, result.stderr
+        else:
+            # guestcontrol carries credentials and the provisioning script; log its name only
+            display = f'VBoxManage {label}' if args[0] == 'guestcontrol' else 'VBoxManage ' + ' '.join(argv[1:])
+            result = oplog.run_process(argv, timeout, display=display)
+            if result['timed_out']:
+                raise subprocess.TimeoutExpired(argv, timeout)
+            returncode, stdout, stderr = result['returncode'], result['stdout'], result['stderr']
+    except subprocess.TimeoutExpired:
+        telemetry.record_vboxmanage(label, time.perf_counter() - started, 'timeout')
+        return {
+            'success': False,
+            'message': f'VBoxManage {args[0]} timed out',
+            'stderr': f'Timeout after {timeout} seconds',
+            'stdout': ''
+        }
+    except OSError as e:
+        telemetry.record_vboxmanage(label, time.perf_counter() - started, 'failure')
+        return {'success': False, 'message': str(e), 'stderr': str(e), 'stdout': ''}
+    finally:
+        telemetry.VBOXMANAGE_IN_FLIGHT.dec(command=label)
+
+    telemetry.record_vboxmanage(label, time.perf_counter() - started,
+                                'success' if returncode == 0 else 'failure')
+    return {
+        'success': returncode == 0,
+        'stdout': stdout.strip(),
+        'stderr': stderr.strip(),
+        'returncode': returncode
+    }
+
+
+def parse_vm_list(output):
+    """Parse `VBoxManage list vms` output into a {name: uuid} dict"""
+    vms = {}
+    for line in output.splitlines():
+        match = VM_LIST_RE.match(line.strip())
+        if match:
+            vms[match.group('name')] = match.group('uuid')
+    return vms
+
+
+def parse_long_vm_list(output):
+    """Parse `VBoxManage list -l vms|runningvms` into {name: {uuid, state, memory_mb}}"""
+    vms = {}
+    current = None
+    block_start = True
+    for line in output.splitlines():
+        key, _, value = line.partition(':')
+        value = value.strip()
+        if not line.strip():
+            block_start = True
+            continue
+        if block_start and key == 'Name' and value:
+            # Every machine block opens with its Name: line
+            current = {}
+            vms[value] = current
+        block_start = False
+        if current is None or key == 'Name':
+            continue
+        if key == 'UUID' and 'uuid' not in current:
+            current['uuid'] = value
+        elif key == 'State' and 'state' not in current:
+            # "running (since 2024-01-01T10:00:00.000000000)"
+            current['state'] = value.split(' (')[0]
+        elif line.startswith('Memory size') and 'memory_mb' not in current:
+            # VirtualBox 6.x prints "Memory size     1024MB" without a colon
+            digits = re.search(r'(\d+)\s*MB', line)
+            if digits:
+                current['memory_mb'] = int(digits.group(1))
+    return vms
+
+
+def parse_medium_info(output):
+    """Parse `VBoxManage showmediuminfo` into {uuid, capacity_mb, size_mb}"""
+    medium = {'uuid': None, 'capacity_mb': None, 'size_mb': None}
+    uuid_line = re.search(r'^UUID:\s*(\S+)', output, re.MULTILINE)
+    if uuid_line:
+        medium['uuid'] = uuid_line.group(1)
+    factors = {'': 1 / 1048576, 'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1048576}
+    for match in MEDIUM_SIZE_RE.finditer(output):
+        mb = round(float(match.group('number')) * factors[match.group('unit')])
+        medium['size_mb' if match.group('key') == 'Size on disk' else 'capacity_mb'] = mb
+    return medium
+
+
+def parse_machinereadable(output):
+    """Parse `showvminfo --machinereadable` output into a flat {key: value} dict"""
+    fields = {}
+    for line in output.splitlines():
+        match = MACHINEREADABLE_RE.match(line.strip())
+        if not match:
+            continue
+        key = match.group('quoted') if match.group('quoted') is not None else match.group('key')
+        value = match.group('value')
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        fields[key] = value
+    return fields
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class VMInfo:
+    """Typed view of one VM's `showvminfo --machinereadable` output"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.name = fields.get('name')
+        self.uuid = fields.get('UUID')
+        self.state = fields.get('VMState')
+        self.os_type = fields.get('ostype')
+        self.cpus = _int(fields.get('cpus'))
+        self.memory_mb = _int(fields.get('memory'))
+        self.vram_mb = _int(fields.get('vram'))
+        self.cfg_file = fields.get('CfgFile')
+        # {"SATA Controller-0-0": "/path/disk.vdi"}; empty slots are left out
+        self.media = {
+            key: value for key, value in fields.items()
+            if MEDIUM_KEY_RE.match(key) and '-ImageUUID-' not in key
+            and value not in ('none', 'emptydrive', '')
+        }
+
+    @property
+    def running(self):
+        return self.state == 'running'
+
+    @property
+    def vm_dir(self):
+        return os.path.dirname(self.cfg_file) if self.cfg_file else None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'uuid': self.uuid,
+            'state': self.state,
+            'os_type': self.os_type,
+            'cpus': self.cpus,
+            'memory_mb': self.memory_mb,
+            'vram_mb': self.vram_mb,
+            'cfg_file': self.cfg_file,
+            'media': self.media,
+        }
+
+
+def _ok(message, vm_uuid=None, stdout=None):
+    """Successful driver result; the UUID (if any) is on the last stdout line like the scripts"""
+    lines = [stdout or message]
+    if vm_uuid:
+        lines.append(vm_uuid)
+    return {'success': True, 'message': message, 'uuid': vm_uuid, 'stdout': '\n'.join(lines), 'stderr': ''}
+
+
+def _failed(message, result):
+    return {
+        'success': False,
+        'message': message,
+        'stderr': result.get('stderr') or result.get('message') or '',
+        'stdout': result.get('stdout', '')
+    }
+
+
+class VBoxDriver:
+    """VirtualBox operations as direct VBoxManage calls
+
+    Everything the app does to VirtualBox goes through here: no bash,
+    no repeated binary lookup, no `list vms | grep` existence checks. VM
+    details are parsed into VMInfo objects and cached by UUID for
+    `cache_ttl` seconds; every mutating call drops the entry it touched.
+    run() is the only place a process is spawned, so a subclass can send
+    the same calls somewhere else.
+    """
+
+    def __init__(self, cache_ttl=5.0):
+        self.cache_ttl = cache_ttl
+        self._cache = {}   # uuid -> (fetched_at, VMInfo)
+        self._names = {}   # name -> uuid
+        self._lock = threading.Lock()
+        self._snapshot_locks = {}
+
+    def run(self, args, timeout=30, files=None):
+        """Run one VBoxManage command; returns the run_shell_script() dict shape"""
+        return run_vboxmanage(args, timeout=timeout, files=files)
+
+    def info(self, ref, max_age=None):
+        """VMInfo for a VM name or UUID, or None if VirtualBox does not know it"""
+        max_age = self.cache_ttl if max_age is None else max_age
+        with self._lock:
+            entry = self._cache.get(self._names.get(ref, ref))
+        if entry and time.monotonic() - entry[0] <= max_age:
+            return entry[1]
+
+        result = self.run(['showvminfo', ref, '--machinereadable'])
+        if not result['success']:
+            self.invalidate(ref)
+            return None
+        info = VMInfo(parse_machinereadable(result['stdout']))
+        with self._lock:
+            self._cache[info.uuid] = (time.monotonic(), info)
+            self._names[info.name] = info.uuid
+        return info
+
+    def invalidate(self, ref=None):
+        """Forget cached details for one VM (by name or UUID), or for all of them"""
+        with self._lock:
+            if ref is None:
+                self._cache.clear()
+                self._names.clear()
+                return
+            vm_uuid = self._names.pop(ref, ref)
+            self._cache.pop(vm_uuid, None)
+            for name in [n for n, u in self._names.items() if u == vm_uuid]:
+                del self._names[name]
+
+    def list_vms(self):
+        """Return {name: uuid} for every registered VM, or None on error"""
+        result = self.run(['list', 'vms'])
+        return parse_vm_list(result['stdout']) if result['success'] else None
+
+    def create(self, name, os_type, cpu_cores, ram_size, storage_size, iso=None, page_fusion=False):
+        """Create, configure and register a VM with an empty disk and the iso (a path) attached"""
+        vm_uuid = str(uuid.uuid4())
+        created = self.run([
+            'createvm', '--name', name, '--ostype', VBOX_OS_TYPES.get(os_type, 'Linux_64'),
+            '--uuid', vm_uuid, '--register'
+        ])
+        if not created['success']:
+            return _failed('Failed to create VM', created)
+        oplog.progress('VM registered')
+
+        settings = re.search(r"^Settings file: '(.*)'$", created['stdout'], re.MULTILINE)
+        if settings:
+            vm_dir = os.path.dirname(settings.group(1))
+        else:
+            info = self.info(vm_uuid, max_age=0)
+            vm_dir = info.vm_dir if info else None
+        if not vm_dir:
+            self.run(['unregistervm', vm_uuid, '--delete'])
+            return _failed('Failed to locate the VM folder', created)
+        disk = os.path.join(vm_dir, f'{name}.vdi')
+
+        steps = [
+            ('configure VM settings', 'settings applied', [
+                'modifyvm', vm_uuid, '--memory', ram_size, '--cpus', cpu_cores, '--vram', 16,
+                '--boot1', 'dvd', '--boot2', 'disk', '--boot3', 'none', '--boot4', 'none',
+                '--nic1', 'nat', '--natpf1', 'ssh,tcp,,2222,,22', '--graphicscontroller', 'vmsvga',
+                '--pagefusion', 'on' if page_fusion else 'off'
+            ]),
+            ('create storage controller', 'storage controller added', [
+                'storagectl', vm_uuid, '--name', 'SATA Controller', '--add', 'sata',
+                '--controller', 'IntelAhci', '--portcount', 1, '--bootable', 'on'
+            ]),
+            ('create virtual disk', 'disk created', [
+                'createmedium', 'disk', '--filename', disk, '--size', storage_size, '--format', 'VDI'
+            ]),
+            ('attach disk to VM', 'disk attached', [
+                'storageattach', vm_uuid, '--storagectl', 'SATA Controller', '--port', 0,
+                '--device', 0, '--type', 'hdd', '--medium', disk
+            ]),
+        ]
+        for label, done, args in steps:
+            result = self.run(args, timeout=300)
+            if not result['success']:
+                if args[0] == 'storageattach':
+                    self.run(['closemedium', 'disk', disk, '--delete'])
+                self.run(['unregistervm', vm_uuid, '--delete'])
+                return _failed(f'Failed to {label}', result)
+            oplog.progress(done)
+
+        log = [f'Created VM {name} ({VBOX_OS_TYPES.get(os_type, "Linux_64")}) with a {storage_size} MB disk']
+        ide = self.run(['storagectl', vm_uuid, '--name', 'IDE Controller', '--add', 'ide'])
+        if not ide['success']:
+            log.append('WARNING: Failed to create IDE controller')
+        elif iso:
+            attached = self.run([
+                'storageattach', vm_uuid, '--storagectl', 'IDE Controller', '--port', 0,
+                '--device', 0, '--type', 'dvddrive', '--medium', iso
+            ])
+            if attached['success']:
+                log.append(f'Attached ISO: {iso}')
+                oplog.progress('ISO attached')
+            else:
+                log.append('WARNING: Failed to attach ISO')
+        else:
+            log.append(f'WARNING: No installer image for {os_type}; the VM has no boot media')
+
+        return _ok('VM created successfully', vm_uuid, '\n'.join(log))
+
+    def start(self, ref):
+        """Start a VM headless; starting a running VM is not an error"""
+        result = self.run(['startvm', ref, '--type', 'headless'], timeout=60)
+        self.invalidate(ref)
+        if result['success']:
+            return _ok('VM started')
+        info = self.info(ref, max_age=0)
+        if info and info.running:
+            return _ok('VM is already running.')
+        return _failed('Failed to start VM', result)
+
+    def stop(self, ref):
+        """Power a VM off; stopping a stopped VM is not an error"""
+        result = self.run(['controlvm', ref, 'poweroff'], timeout=60)
+        self.invalidate(ref)
+        if result['success']:
+            return _ok('VM stopped')
+        info = self.info(ref, max_age=0)
+        if info and info.state == 'saved':
+            # A suspended VM is stopped by dropping its saved memory
+            result = self.run(['discardstate', info.uuid], timeout=60)
+            self.invalidate(info.uuid)
+            if result['success']:
+                return _ok('VM stopped (saved state discarded)')
+            return _failed('Failed to stop VM', result)
+        if info and info.state not in ACTIVE_STATES:
+            return _ok('VM is already stopped.')
+        return _failed('Failed to stop VM', result)
+
+    def suspend(self, ref):
+        """Save a running VM's memory to disk and stop it; suspending a saved VM is not an error"""
+        # Writing out the guest's RAM takes a while on a big VM
+        result = self.run(['controlvm', ref, 'savestate'], timeout=300)
+        self.invalidate(ref)
+        if result['success']:
+            return _ok('VM suspended')
+        info = self.info(ref, max_age=0)
+        if info and info.state == 'saved':
+            return _ok('VM is already suspended.')
+        return _failed('Failed to suspend VM', result)
+
+    def resume(self, ref):
+        """Start a VM from its saved state (a cold boot if it has none)"""
+        info = self.info(ref, max_age=0)
+        if info and info.state == 'paused':
+            result = self.run(['controlvm', ref, 'resume'], timeout=60)
+        else:
+            result = self.run(['startvm', ref, '--type', 'headless'], timeout=60)
+        self.invalidate(ref)
+        if result['success']:
+            restored = bool(info) and info.state in ('saved', 'paused')
+            return _ok('VM resumed' if restored else 'VM had no saved state and was booted')
+        info = self.info(ref, max_age=0)
+        if info and info.running:
+            return _ok('VM is already running.')
+        return _failed('Failed to resume VM', result)
+
+    def disks(self, ref):
+        """Paths of a VM's hard disk images, or None if the VM does not exist"""
+        info = self.info(ref, max_age=0)
+        if not info:
+            return None
+        return [path for _, path in sorted(info.media.items()) if path.lower().endswith(DISK_EXTENSIONS)]
+
+    def medium_info(self, path):
+        """{uuid, capacity_mb, size_mb} of a disk image, or None if it cannot be read"""
+        result = self.run(['showmediuminfo', 'disk', path])
+        if not result['success']:
+            return None
+        return parse_medium_info(result['stdout'])
+
+    def compact(self, path):
+        """Give the zeroed blocks of a dynamically allocated image back to the host"""
+        result = self.run(['modifymedium', 'disk', path, '--compact'], timeout=3600)
+        if result['success']:
+            return _ok(f'Compacted {path}')
+        return _failed(f'Failed to compact {path}', result)
+
+    def wait_for_guest(self, ref, timeout=300, interval=2.0):
+        """Wait until the Guest Additions in a running VM answer; False on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self.run(['guestproperty', 'get', ref, GUEST_READY_PROPERTY])
+            if result['success'] and result['stdout'].startswith('Value:'):
+                return True
+            if time.monotonic() + interval > deadline:
+                return False
+            time.sleep(interval)
+
+    def set_balloon(self, ref, size_mb):
+        """Resize a running VM's memory balloon (needs Guest Additions in the guest)"""
+        result = self.run(['controlvm', ref, 'guestmemoryballoon', int(size_mb)])
+        if result['success']:
+            return _ok(f'Memory balloon set to {int(size_mb)} MB')
+        return _failed('Failed to resize the memory balloon', result)
+
+    def destroy(self, ref):
+        """Power off if needed, then unregister the VM and delete its files"""
+        info = self.info(ref, max_age=0)
+        if not info:
+            return {'success': False, 'message': f'VM {ref} does not exist.',
+                    'stderr': f'VM {ref} does not exist.', 'stdout': ''}
+        if info.state in ACTIVE_STATES:
+            self.run(['controlvm', info.uuid, 'poweroff'], timeout=60)
+            oplog.progress('powered off')
+
+        # The session can stay locked for a moment after poweroff
+        for attempt in range(5):
+            result = self.run(['unregistervm', info.uuid, '--delete'], timeout=300)
+            if result['success'] or 'lock' not in result.get('stderr', '').lower():
+                break
+            time.sleep(1)
+        self.invalidate(info.uuid)
+        if not result['success']:
+            return _failed('Failed to delete VM', result)
+        return _ok('VM deleted')
+
+    def snapshots(self, ref):
+        """Names of a VM's snapshots, or None if they cannot be listed"""
+        result = self.run(['snapshot', ref, 'list', '--machinereadable'])
+        if not result['success']:
+            # VirtualBox treats "no snapshots" as an error
+            if 'does not have any snapshots' in result['stdout'] + result['stderr']:
+                return []
+            return None
+        return SNAPSHOT_NAME_RE.findall(result['stdout'])
+
+    def ensure_snapshot(self, ref, name=BASE_SNAPSHOT):
+        """Take snapshot `name` of a VM unless it already has one by that name"""
+        with self._lock:
+            lock = self._snapshot_locks.setdefault(ref, threading.Lock())
+        # Two clones of the same source must not both take the snapshot
+        with lock:
+            names = self.snapshots(ref)
+            if names is None:
+                return {'success': False, 'message': f"Cannot list snapshots of '{ref}'",
+                        'stderr': f"Cannot list snapshots of '{ref}'", 'stdout': ''}
+            if name in names:
+                return _ok(f"Reusing snapshot '{name}'")
+            result = self.run(['snapshot', ref, 'take', name,
+                               '--description', 'Base for linked clones'], timeout=600)
+            self.invalidate(ref)
+            if not result['success']:
+                return _failed(f"Failed to take snapshot '{name}' of '{ref}'", result)
+            oplog.progress('base snapshot taken')
+            return _ok(f"Took snapshot '{name}'")
+
+    def clone(self, source, new_name, cpu_cores=None, ram_size=None, linked=False, snapshot=BASE_SNAPSHOT):
+        """Clone a VM, optionally resized; the clone's UUID is chosen up front
+
+        A full clone copies every disk. A linked clone gets differencing
+        disks on top of `snapshot` of the source (taken if missing), which
+        takes seconds, but the source cannot be deleted while it exists.
+        """
+        new_uuid = str(uuid.uuid4())
+        args = ['clonevm', source, '--name', new_name, '--uuid', new_uuid, '--register']
+        if linked:
+            prepared = self.ensure_snapshot(source, snapshot)
+            if not prepared['success']:
+                return prepared
+            args += ['--snapshot', snapshot, '--options', 'link']
+        oplog.progress('cloning disks')
+        result = self.run(args, timeout=1800)
+        if not result['success']:
+            return _failed(f"Failed to clone VM '{source}'", result)
+        oplog.progress('clone registered')
+
+        if cpu_cores is not None or ram_size is not None:
+            args = ['modifyvm', new_uuid]
+            if cpu_cores is not None:
+                args += ['--cpus', cpu_cores]
+            if ram_size is not None:
+                args += ['--memory', ram_size]
+            configured = self.run(args)
+            if not configured['success']:
+                self.run(['unregistervm', new_uuid, '--delete'])
+                return _failed('Failed to configure cloned VM', configured)
+            oplog.progress('clone configured')
+
+        kind = 'Linked clone' if linked else 'VM cloned'
+        return _ok(f'{kind}: {source} -> {new_name}', new_uuid)
+
+    def flatten(self, ref):
+        """Replace a linked clone's differencing disks with standalone copies
+
+        Each disk is merged with its parents by clonemedium, attached in place
+        of the original and the differencing image deleted, so the VM keeps
+        its name and UUID but no longer depends on the snapshot it came from.
+        The VM has to be powered off.
+        """
+        info = self.info(ref, max_age=0)
+        if not info:
+            return {'success': False, 'message': f'VM {ref} does not exist.',
+                    'stderr': f'VM {ref} does not exist.', 'stdout': ''}
+        if info.state in ACTIVE_STATES:
+            return {'success': False, 'message': 'Stop the VM before flattening it',
+                    'stderr': f'VM {info.name} is {info.state}', 'stdout': ''}
+
+        disks = [(slot, path) for slot, path in sorted(info.media.items())
+                 if path.lower().endswith(DISK_EXTENSIONS)]
+        log = []
+        for n, (slot, old_path) in enumerate(disks):
+            controller, port, device = MEDIUM_KEY_RE.match(slot).group('controller', 'port', 'device')
+            new_path = os.path.join(info.vm_dir, f'{info.name}-disk{n}.vdi')
+            steps = [
+                ('copy disk', ['clonemedium', 'disk', old_path, new_path, '--format', 'VDI']),
+                ('attach copied disk', ['storageattach', info.uuid, '--storagectl', controller,
+                                        '--port', port, '--device', device, '--type', 'hdd',
+                                        '--medium', new_path]),
+            ]
+            for label, args in steps:
+                result = self.run(args, timeout=1800)
+                if not result['success']:
+                    if args[0] == 'storageattach':
+                        self.run(['closemedium', 'disk', new_path, '--delete'])
+                    self.invalidate(info.uuid)
+                    return _failed(f'Failed to {label} {old_path}', result)
+            # The old differencing image is detached now; a failure here only leaks the file
+            removed = self.run(['closemedium', 'disk', old_path, '--delete'])
+            log.append(f'{slot}: {old_path} -> {new_path}' + ('' if removed['success'] else ' (old image kept)'))
+            oplog.progress(f'disk {n + 1} of {len(disks)} flattened')
+
+        self.invalidate(info.uuid)
+        return _ok(f'VM {info.name} flattened', info.uuid, '\n'.join(log) or 'No disks to flatten')
+
+    def resize_disk(self, ref, size_mb):
+        """Grow a VM's first disk image to size_mb; one that is already as big is left alone"""
+        paths = self.disks(ref)
+        if not paths:
+            return {'success': False, 'message': f'VM {ref} has no disk image.',
+                    'stderr': f'VM {ref} has no disk image.', 'stdout': ''}
+        medium = self.medium_info(paths[0])
+        if medium and medium['capacity_mb'] is not None and medium['capacity_mb'] >= int(size_mb):
+            return _ok(f'{paths[0]} is already {medium["capacity_mb"]} MB')
+        result = self.run(['modifymedium', 'disk', paths[0], '--resize', int(size_mb)], timeout=600)
+        if not result['success']:
+            return _failed(f'Failed to resize {paths[0]}', result)
+        return _ok(f'Resized {paths[0]} to {size_mb} MB')
+
+    def rename(self, ref, new_name, cpu_cores=None, ram_size=None):
+        """Rename a VM, optionally setting its CPUs and RAM in the same call
+
+        Pass the UUID as ref to avoid a lookup afterwards.
+        """
+        args = ['modifyvm', ref, '--name', new_name]
+        if cpu_cores is not None:
+            args += ['--cpus', cpu_cores]
+        if ram_size is not None:
+            args += ['--memory', ram_size]
+        result = self.run(args)
+        self.invalidate(ref)
+        if not result['success']:
+            return _failed(f"Failed to rename VM '{ref}'", result)
+        if UUID_RE.match(ref):
+            vm_uuid = ref
+        else:
+            info = self.info(new_name)
+            vm_uuid = info.uuid if info else None
+        return _ok(f'VM renamed: {ref} -> {new_name}', vm_uuid)
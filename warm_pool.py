@@ -0,0 +1,217 @@
+import calendar
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+PROVISIONING = 'provisioning'
+READY = 'ready'
+CLAIMED = 'claimed'
+
+
+class WarmPool:
+    """Keep ready, stopped VMs per shape so create() only has to rename one
+
+    Targets say how many ready VMs each (OS, CPU, RAM, disk) shape should
+    have and which golden VM to clone them from. Each clone gets the
+    shape's CPUs and RAM and its disk is grown to the shape's size (a
+    golden disk that is already bigger is kept as it is); the claim sets
+    CPUs and RAM again with the rename, in one modifyvm. A background thread clones
+    until every target is met and deletes surplus VMs. A shape nobody has
+    asked for within `idle_ttl` seconds is treated as having a target of 0,
+    so unused pools give their disk space back.
+    """
+
+    def __init__(self, connect, driver, interval=30.0, idle_ttl=7 * 86400, max_parallel=2):
+        # driver is a vbox.VBoxDriver
+        self.connect = connect
+        self.driver = driver
+        self.interval = interval
+        self.idle_ttl = idle_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='vsm-pool')
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        """Start the refill thread if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._recover()
+                self._thread = threading.Thread(target=self._loop, name='vsm-pool', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Ask the refill thread to run now instead of at the next interval"""
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.refill_once()
+            except Exception as e:
+                print(f"Warm pool error: {str(e)}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _recover(self):
+        """Forget pool members a previous process left half-done"""
+        conn = self.connect()
+        rows = conn.execute(
+            'SELECT * FROM warm_pool_vms WHERE state IN (?, ?)', (PROVISIONING, CLAIMED)
+        ).fetchall()
+        conn.execute('DELETE FROM warm_pool_vms WHERE state IN (?, ?)', (PROVISIONING, CLAIMED))
+        conn.commit()
+        for row in rows:
+            if row['state'] == PROVISIONING:
+                # A half-cloned VM is useless; remove whatever got registered
+                self._executor.submit(self.driver.destroy, row['vm_name'])
+            print(f"Warm pool: dropped interrupted {row['state']} VM {row['vm_name']}")
+
+    def set_target(self, os_type, cpu_cores, ram_size, storage_size, golden_vm, target):
+        """Create or update the target for one shape"""
+        conn = self.connect()
+        conn.execute(
+            '''INSERT INTO warm_pool_targets (os_type, cpu_cores, ram_size, storage_size, golden_vm, target)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (os_type, cpu_cores, ram_size, storage_size)
+               DO UPDATE SET golden_vm = excluded.golden_vm, target = excluded.target''',
+            (os_type, cpu_cores, ram_size, storage_size, golden_vm, target)
+        )
+        conn.commit()
+        self.wake()
+
+    def status(self):
+        """Targets with their ready and provisioning counts"""
+        conn = self.connect()
+        rows = conn.execute(
+            '''SELECT t.*,
+                      SUM(v.state = 'ready') AS ready,
+                      SUM(v.state = 'provisioning') AS provisioning
+               FROM warm_pool_targets t
+               LEFT JOIN warm_pool_vms v ON v.target_id = t.id
+               GROUP BY t.id ORDER BY t.id'''
+        ).fetchall()
+        return [dict(row, ready=row['ready'] or 0, provisioning=row['provisioning'] or 0,
+                     effective_target=self._effective_target(row))
+                for row in rows]
+
+    def _effective_target(self, target):
+        last = target['last_requested_at']
+        if self.idle_ttl and last:
+            # CURRENT_TIMESTAMP is UTC
+            age = time.time() - calendar.timegm(time.strptime(last, '%Y-%m-%d %H:%M:%S'))
+            if age > self.idle_ttl:
+                return 0
+        return target['target']
+
+    def claim(self, os_type, cpu_cores, ram_size, storage_size):
+        """Reserve a ready VM of this shape; returns its row or None on a miss"""
+        conn = self.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            target = conn.execute(
+                '''SELECT id FROM warm_pool_targets
+                   WHERE os_type = ? AND cpu_cores = ? AND ram_size = ? AND storage_size = ?''',
+                (os_type, int(cpu_cores), int(ram_size), int(storage_size))
+            ).fetchone()
+            if not target:
+                conn.commit()
+                return None
+
+            # Hits and misses both count as demand for this shape
+            conn.execute(
+                'UPDATE warm_pool_targets SET last_requested_at = CURRENT_TIMESTAMP WHERE id = ?',
+                (target['id'],)
+            )
+            row = conn.execute(
+                '''SELECT * FROM warm_pool_vms WHERE target_id = ? AND state = ?
+                   ORDER BY ready_at LIMIT 1''',
+                (target['id'], READY)
+            ).fetchone()
+            if row:
+                conn.execute('UPDATE warm_pool_vms SET state = ? WHERE id = ?', (CLAIMED, row['id']))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        # Start cloning a replacement straight away
+        self.wake()
+        return dict(row) if row else None
+
+    def complete_claim(self, entry, new_name, cpu_cores, ram_size):
+        """Rename a claimed VM to its server name and apply its CPUs and RAM; returns the driver result"""
+        result = self.driver.rename(entry['vm_uuid'] or entry['vm_name'], new_name, int(cpu_cores), int(ram_size))
+        conn = self.connect()
+        if result['success']:
+            conn.execute('DELETE FROM warm_pool_vms WHERE id = ?', (entry['id'],))
+        else:
+            # Hand it back; the next refill pass treats it as a normal member
+            conn.execute('UPDATE warm_pool_vms SET state = ? WHERE id = ?', (READY, entry['id']))
+        conn.commit()
+        return result
+
+    def refill_once(self):
+        """Clone toward each target and delete surplus ready VMs"""
+        futures = []
+        for target in self.status():
+            wanted = self._effective_target(target)
+            have = target['ready'] + target['provisioning']
+            for _ in range(max(0, wanted - have)):
+                futures.append(self._executor.submit(self._provision, target))
+            if target['ready'] > wanted:
+                futures.append(self._executor.submit(self._evict, target['id'], target['ready'] - wanted))
+        for future in futures:
+            future.result()
+
+    def _provision(self, target):
+        name = f"pool-{target['os_type']}-{target['cpu_cores']}c-{target['ram_size']}m-{uuid.uuid4().hex[:8]}"
+        conn = self.connect()
+        cursor = conn.execute(
+            'INSERT INTO warm_pool_vms (target_id, vm_name, state) VALUES (?, ?, ?)',
+            (target['id'], name, PROVISIONING)
+        )
+        entry_id = cursor.lastrowid
+        conn.commit()
+
+        result = self.driver.clone(target['golden_vm'], name, target['cpu_cores'], target['ram_size'])
+        if result['success']:
+            resized = self.driver.resize_disk(result['uuid'], target['storage_size'])
+            if not resized['success']:
+                self.driver.destroy(result['uuid'])
+                result = resized
+        if result['success']:
+            conn.execute(
+                'UPDATE warm_pool_vms SET state = ?, vm_uuid = ?, ready_at = CURRENT_TIMESTAMP WHERE id = ?',
+                (READY, result['uuid'], entry_id)
+            )
+            print(f"Warm pool: {name} is ready")
+        else:
+            conn.execute('DELETE FROM warm_pool_vms WHERE id = ?', (entry_id,))
+            print(f"Warm pool: cloning {name} failed: {result.get('stderr') or result.get('message')}")
+        conn.commit()
+
+    def _evict(self, target_id, count):
+        conn = self.connect()
+        rows = conn.execute(
+            '''SELECT * FROM warm_pool_vms WHERE target_id = ? AND state = ?
+               ORDER BY ready_at LIMIT ?''',
+            (target_id, READY, count)
+        ).fetchall()
+        for row in rows:
+            # Claim it first so a concurrent create cannot take it mid-delete
+            cursor = conn.execute(
+                'UPDATE warm_pool_vms SET state = ? WHERE id = ? AND state = ?',
+                (CLAIMED, row['id'], READY)
+            )
+            conn.commit()
+            if not cursor.rowcount:
+                continue
+            result = self.driver.destroy(row['vm_uuid'] or row['vm_name'])
+            if result['success']:
+                conn.execute('DELETE FROM warm_pool_vms WHERE id = ?', (row['id'],))
+                print(f"Warm pool: evicted {row['vm_name']}")
+            else:
+                conn.execute('UPDATE warm_pool_vms SET state = ? WHERE id = ?', (READY, row['id']))
+            conn.commit()